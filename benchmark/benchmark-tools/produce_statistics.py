@@ -7,8 +7,12 @@ import json
 from statistics import mean, variance, stdev, median
 from multiprocessing import Pool, cpu_count
 
+# The delay entries can be zip, gzip or zstd compressed, they are read with the trace helper of the generator
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'coflow-workload-generator'))
+from compressed_io import open_file, strip_compression_suffix
+
 def timestamp_generator(file_path):
-    with open(file_path, 'rb') as f:
+    with open_file(file_path, 'rb') as f:
         objects = ijson.items(f, 'delay_timestamps.item')
         for obj in objects:
             yield obj
@@ -46,9 +50,10 @@ def get_first_packet_delays(timestamps, destination_ip):
     return first_packet_delay_base, first_packet_delay_associated, len(unique_flow_keys)
 
 def process_file(file_path):
-    with open(file_path, 'rb') as f:
+    # Opened twice rather than seeked, a zstd stream can not seek back
+    with open_file(file_path, 'rb') as f:
         pod_id = next(ijson.items(f, 'pod_id'))
-        f.seek(0)
+    with open_file(file_path, 'rb') as f:
         destination_ip = next(ijson.items(f, 'IP_address'))
 
     timestamps = list(timestamp_generator(file_path))
@@ -98,7 +103,7 @@ def worker(file_path):
 
 def process_directory(directory: str):
     pool = Pool(processes=cpu_count())
-    files = [os.path.join(directory, f) for f in os.listdir(directory) if f.endswith('.json')]
+    files = [os.path.join(directory, f) for f in os.listdir(directory) if strip_compression_suffix(f).endswith('.json')]
     results = pool.map(worker, files)
     pool.close()
     pool.join()
@@ -1,10 +1,10 @@
 import os
-import json
 import random
 
-from pathlib import Path
 import uppdate_metadata
 from create_src_IP import IPv4Generator
+from trace_io import load_trace, save_trace, stream_trace, get_trace_name, get_json_suffix
+from sharded_enrichment import split_into_shards, join_shards, get_shard_seed, map_shards
 
 class AddIPsToCoflowTrace:
         
@@ -12,66 +12,98 @@ class AddIPsToCoflowTrace:
         excluded_subnets = ['1.0.0.0', '2.0.0.0', '3.0.0.0', '40.0.0.0', '4.255.255.254']
         self.IPv4Generator = IPv4Generator(excluded_subnets=excluded_subnets)
 
-    def add_IPs_to_coflow_trace(self, json_file: str, output_file_path: str, NUM_PODS: int) -> str:
-        
-        if not os.path.exists(json_file):
-            print(f"File '{json_file}' not found.")
-            raise FileNotFoundError
+    def add_IPs_to_coflow(self, coflow: dict, NUM_PODS: int, rng=random) -> dict:
 
-        # Load JSON coflow trace
-        with open(json_file, 'r') as f:
-            coflow_trace = json.load(f)
+        first_flow = True
+        coflow_id = coflow['coflow_id']
+
+        for flow in coflow['flows']:
+
+            host_id = rng.choice([0, 1]) # Even distribution between 3.0.0.x/8 and 3.0.1.x/8
+            dst_id = int(flow["dest_id"]) # dst_id provided by Sincronia coflow workload generator
+            pod_index = (dst_id % NUM_PODS) + 1 # Create pod index based on dst_id to ensure dst_ip are on range [1, NUM_PODS]
+            dst_ip = f"3.0.{host_id}.{pod_index}" # Create destination IP address
+    
+            # First flow in coflow is a unique 5-tuple base flow with 2100 as destination port and unique source IP
+            if first_flow:
+                first_flow = False # Set first_flow to False after first flow is generated
+                src_port = int(coflow_id) # Use coflow_id as source port as unique identifier
+                dst_port = 2100 # Destination port for the base flow
+                src_ip = self.IPv4Generator.generate_src_ipv4_address(coflow_id) # Generate unique and determistic source IP address for the base flow
+                dst_ip = dst_ip # Destination IP address for the base flow, using id from Sincronia coflow workload generator
+
+                flow['src_port'] = src_port # update src_port
+                flow['dst_port'] = dst_port # update dst_port
+                flow['pod_index'] = pod_index # set pod_index
+                flow['src_ip'] = src_ip # set src_ip
+                flow['dst_ip'] = dst_ip # set dst_ip
+
+            # Other flows in coflow are associated with the unique 5-tuple base flow
+            else:
+                src_id = int(flow["source_id"])
+                src_ip = f"192.168.1.{src_id}" # Create source IP address, doesn't matter?
+
+                flow['pod_index'] = pod_index # set pod_index
+                flow['src_ip'] = src_ip # set src_ip
+                flow['dst_ip'] = dst_ip # set dst_ip
+
+        return coflow
+
+    def add_IPs_to_trace(self, coflow_trace: dict, NUM_PODS: int) -> dict:
 
         for coflow in coflow_trace['coflows']:
-            
-            first_flow = True
-            coflow_id = coflow['coflow_id']
+            self.add_IPs_to_coflow(coflow, NUM_PODS)
 
-            for flow in coflow['flows']:
+        return coflow_trace
 
-                host_id = random.choice([0, 1]) # Even distribution between 3.0.0.x/8 and 3.0.1.x/8
-                dst_id = int(flow["dest_id"]) # dst_id provided by Sincronia coflow workload generator
-                pod_index = (dst_id % NUM_PODS) + 1 # Create pod index based on dst_id to ensure dst_ip are on range [1, NUM_PODS]
-                dst_ip = f"3.0.{host_id}.{pod_index}" # Create destination IP address
-        
-                # First flow in coflow is a unique 5-tuple base flow with 2100 as destination port and unique source IP
-                if first_flow:
-                    first_flow = False # Set first_flow to False after first flow is generated
-                    src_port = int(coflow_id) # Use coflow_id as source port as unique identifier
-                    dst_port = 2100 # Destination port for the base flow
-                    src_ip = self.IPv4Generator.generate_src_ipv4_address(coflow_id) # Generate unique and determistic source IP address for the base flow
-                    dst_ip = dst_ip # Destination IP address for the base flow, using id from Sincronia coflow workload generator
+    def add_IPs_to_shard(self, coflows: list, NUM_PODS: int, seed: int) -> list:
 
-                    flow['src_port'] = src_port # update src_port
-                    flow['dst_port'] = dst_port # update dst_port
-                    flow['pod_index'] = pod_index # set pod_index
-                    flow['src_ip'] = src_ip # set src_ip
-                    flow['dst_ip'] = dst_ip # set dst_ip
+        rng = random.Random(seed)
 
-                # Other flows in coflow are associated with the unique 5-tuple base flow
-                else:
-                    src_id = int(flow["source_id"])
-                    src_ip = f"192.168.1.{src_id}" # Create source IP address, doesn't matter?
+        for coflow in coflows:
+            self.add_IPs_to_coflow(coflow, NUM_PODS, rng)
 
-                    flow['pod_index'] = pod_index # set pod_index
-                    flow['src_ip'] = src_ip # set src_ip
-                    flow['dst_ip'] = dst_ip # set dst_ip
+        return coflows
 
+    def add_IPs_to_trace_sharded(self, coflow_trace: dict, NUM_PODS: int, workers: int, seed: int = 0) -> dict:
 
-        with open(output_file_path, 'w') as f:
-            json.dump(coflow_trace, f, indent=2)
+        # The base flow IPs only depend on the coflow id, no state is carried between shards
+        shards = split_into_shards(coflow_trace['coflows'])
+        shard_arguments = [(shard, NUM_PODS, get_shard_seed(seed, 'IPs', shard_index)) for shard_index, shard in enumerate(shards)]
 
-        return output_file_path
+        coflow_trace['coflows'] = join_shards(map_shards(self.add_IPs_to_shard, shard_arguments, workers))
+
+        return coflow_trace
+
+    def add_IPs_to_coflow_trace(self, json_file: str, output_file_path: str, NUM_PODS: int, streaming: bool = False, workers: int = 0, seed: int = 0) -> str:
+
+        # Read and write one coflow at a time
+        if streaming:
+            return stream_trace(json_file, output_file_path, lambda coflow: self.add_IPs_to_coflow(coflow, NUM_PODS))
+
+        # Load JSON coflow trace
+        coflow_trace = load_trace(json_file)
+
+        if workers:
+            coflow_trace = self.add_IPs_to_trace_sharded(coflow_trace, NUM_PODS, workers, seed)
+        else:
+            coflow_trace = self.add_IPs_to_trace(coflow_trace, NUM_PODS)
+
+        return save_trace(coflow_trace, output_file_path)
+
+    def get_output_file_path(self, json_file_path: str, output_dir: str) -> str:
+
+        json_file_name_without_extension = get_trace_name(json_file_path)
 
-    def run(self, json_file_path: str, output_dir: str, NUM_PODS: int) -> str:
+        output_file = f'{json_file_name_without_extension}_IPs{get_json_suffix(json_file_path)}'
 
-        self.json_file_name_without_extension = Path(os.path.basename(json_file_path)).stem
+        return os.path.join(output_dir, output_file)
 
-        output_file = f'{self.json_file_name_without_extension}_IPs.json'
+    def run(self, json_file_path: str, output_dir: str, NUM_PODS: int, streaming: bool = False, workers: int = 0, seed: int = 0) -> str:
 
-        output_file_path = os.path.join(output_dir, output_file)
+        output_file_path = self.get_output_file_path(json_file_path, output_dir)
 
-        output_file_path = self.add_IPs_to_coflow_trace(json_file_path, output_file_path, NUM_PODS)
+        output_file_path = self.add_IPs_to_coflow_trace(json_file_path, output_file_path, NUM_PODS, streaming, workers, seed)
 
         return output_file_path
     
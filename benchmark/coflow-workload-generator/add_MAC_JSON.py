@@ -1,7 +1,10 @@
 import os
-import json
+import numpy as np
 
-from pathlib import Path
+from trace_io import load_trace, save_trace, get_trace_suffix, get_trace_name, iter_coflows, stream_trace
+from sharded_enrichment import split_into_shards, join_shards, map_shards
+from flow_key_index import FlowKeyIndex, concatenate_flow_keys
+from trace_metadata import TraceMetadata
 
 class AddMACsToCoflowTrace:
         
@@ -12,93 +15,122 @@ class AddMACsToCoflowTrace:
             return "00:EC:00:{:x}:{:x}:{:x}".format(mid >> 16 & 0xff,
                                                 mid >> 8 & 0xff, mid & 0xff)
 
-    def create_shared_values_dictionary(self, unique_flows) -> dict:
+    def get_flow_macs(self, flow_index: FlowKeyIndex, metadata: TraceMetadata = None) -> list:
 
-        shared_values_count = (len(unique_flows)) // 3
+        number_of_unique_flows = flow_index.count_unique()
+
+        print(f"Flow set size: {number_of_unique_flows}")
+
+        shared_values_count = number_of_unique_flows // 3
         shared_values_count = min(shared_values_count, 32400) # leaving some room for existing 3k dp flows
-        
-        values = list(range(shared_values_count + 1))
-        
-        shared_values_dict = {}
-        
-        for i, key in enumerate(unique_flows):
+        shared_values_count = max(shared_values_count, 1)
 
-            mac_id_index = values[i % shared_values_count]
-            #print(f'mac_id_index: {mac_id_index}')
-            mac_id = self.get_mac_by_id(mac_id_index)
-            shared_values_dict[key] = mac_id
-        
-        return shared_values_dict
-    
-    def create_flow_set(self, json_file: str) -> set:
+        # The unique flows take turns on the shared MACs in the order they first appear in the trace.
+        # Unlike the iteration order of a flow set this does not change from run to run.
+        mac_ids = flow_index.get_flow_ids() % shared_values_count
 
-        flow_set = set()
-        
-        if not os.path.exists(json_file):
-            print(f"File '{json_file}' not found.")
-            raise FileNotFoundError
+        unique_mac_ids, mac_id_counts = np.unique(mac_ids, return_counts=True)
+        macs = {mac_id: self.get_mac_by_id(mac_id) for mac_id in unique_mac_ids.tolist()}
 
-        # Load JSON coflow trace
-        with open(json_file, 'r') as f:
-            coflow_trace = json.load(f)
+        # Every flow gets a new MAC, so the MACs in the metadata are replaced
+        if metadata is not None:
+            metadata.set_src_macs(dict(zip([macs[mac_id] for mac_id in unique_mac_ids.tolist()], mac_id_counts.tolist())))
 
-        for coflow in coflow_trace['coflows']:
-            
-            for flow in coflow['flows']:
-                src_ip = flow['src_ip']
-                src_port = flow['src_port']
-                dst_ip = flow['dst_ip']
-                dst_port = flow['dst_port']
-                flow = (src_ip, src_port, dst_ip, dst_port)
-                flow_set.add(flow)
+        # The MAC of every flow, in trace order
+        return [macs[mac_id] for mac_id in mac_ids.tolist()]
 
-        print(f"Flow set size: {len(flow_set)}")
 
-        return flow_set
+    def add_MACs_to_coflow(self, coflow: dict, flow_macs) -> dict:
 
+        # flow_macs is an iterator over the MACs of the flows in trace order
+        for flow in coflow['flows']:
+            flow['src_mac'] = next(flow_macs)
 
-    def add_MACs_to_coflow_trace(self, json_file: str, output_file_path: str) -> str:
+        return coflow
 
-        flow_set = self.create_flow_set(json_file)
-        flow_mac_dict = self.create_shared_values_dictionary(flow_set)
-        
-        if not os.path.exists(json_file):
-            print(f"File '{json_file}' not found.")
-            raise FileNotFoundError
+    def add_MACs_to_trace(self, coflow_trace: dict, metadata: TraceMetadata = None) -> dict:
 
-        # Load JSON coflow trace
-        with open(json_file, 'r') as f:
-            coflow_trace = json.load(f)
+        flow_index = FlowKeyIndex.from_trace(coflow_trace) if metadata is None else metadata.get_flow_index(coflow_trace)
+
+        flow_macs = iter(self.get_flow_macs(flow_index, metadata))
 
         for coflow in coflow_trace['coflows']:
-            
-            for flow in coflow['flows']:
-                src_ip = flow['src_ip']
-                src_port = flow['src_port']
-                dst_ip = flow['dst_ip']
-                dst_port = flow['dst_port']
+            self.add_MACs_to_coflow(coflow, flow_macs)
 
-                flow_key_tuple = (src_ip, src_port, dst_ip, dst_port)
-                flow_mac = flow_mac_dict[flow_key_tuple]
+        return coflow_trace
 
-                flow['src_mac'] = flow_mac
+    def get_flow_keys_in_shard(self, coflows: list) -> np.ndarray:
+        return FlowKeyIndex.from_coflows(coflows).keys
 
-                
-        with open(output_file_path, 'w') as f:
-            json.dump(coflow_trace, f, indent=2)
+    def add_MACs_to_shard(self, coflows: list, flow_macs: list) -> list:
 
-        return output_file_path
+        flow_macs = iter(flow_macs)
+
+        for coflow in coflows:
+            self.add_MACs_to_coflow(coflow, flow_macs)
+
+        return coflows
+
+    def add_MACs_to_trace_sharded(self, coflow_trace: dict, workers: int, metadata: TraceMetadata = None) -> dict:
+
+        shards = split_into_shards(coflow_trace['coflows'])
+
+        # The metadata already has the keys of the trace, otherwise the shards are packed by the workers
+        if metadata is not None:
+            flow_index = metadata.get_flow_index(coflow_trace)
+            shard_sizes = [sum(len(coflow['flows']) for coflow in shard) for shard in shards]
+        else:
+            shard_flow_keys = map_shards(self.get_flow_keys_in_shard, [(shard,) for shard in shards], workers)
+            # The shards are in trace order, so the flows are numbered the same as without sharding
+            flow_index = FlowKeyIndex(concatenate_flow_keys(shard_flow_keys))
+            shard_sizes = [len(flow_keys) for flow_keys in shard_flow_keys]
+
+        flow_macs = self.get_flow_macs(flow_index, metadata)
+
+        # Every shard only gets the MACs of its own flows
+        shard_arguments = []
+        position = 0
+        for shard, shard_size in zip(shards, shard_sizes):
+            shard_arguments.append((shard, flow_macs[position:position + shard_size]))
+            position += shard_size
+
+        coflow_trace['coflows'] = join_shards(map_shards(self.add_MACs_to_shard, shard_arguments, workers))
+
+        return coflow_trace
+
+
+    def add_MACs_to_coflow_trace(self, json_file: str, output_file_path: str, streaming: bool = False, workers: int = 0) -> str:
+
+        # Two passes over the file, the first collects the unique flows and the second writes the MACs
+        if streaming:
+            flow_macs = iter(self.get_flow_macs(FlowKeyIndex.from_coflows(iter_coflows(json_file))))
+            return stream_trace(json_file, output_file_path, lambda coflow: self.add_MACs_to_coflow(coflow, flow_macs))
+
+        # Load JSON coflow trace
+        coflow_trace = load_trace(json_file)
+
+        if workers:
+            coflow_trace = self.add_MACs_to_trace_sharded(coflow_trace, workers)
+        else:
+            coflow_trace = self.add_MACs_to_trace(coflow_trace)
+
+        return save_trace(coflow_trace, output_file_path)
     
 
-    def run(self, json_file_path: str, output_dir: str) -> str:
+    def get_output_file_path(self, json_file_path: str, output_dir: str) -> str:
+
+        json_file_name_without_extension = get_trace_name(json_file_path)
+
+        output_file = f'{json_file_name_without_extension}_MACs{get_trace_suffix(json_file_path)}'
+
+        return os.path.join(output_dir, output_file)
 
-        self.json_file_name_without_extension = Path(os.path.basename(json_file_path)).stem
 
-        output_file = f'{self.json_file_name_without_extension}_MACs.json'
+    def run(self, json_file_path: str, output_dir: str, streaming: bool = False, workers: int = 0) -> str:
 
-        output_file_path = os.path.join(output_dir, output_file)
+        output_file_path = self.get_output_file_path(json_file_path, output_dir)
 
-        output_file_path = self.add_MACs_to_coflow_trace(json_file_path, output_file_path)
+        output_file_path = self.add_MACs_to_coflow_trace(json_file_path, output_file_path, streaming, workers)
 
         return output_file_path
     
@@ -1,13 +1,14 @@
 import os
 import datetime
 from pathlib import Path
+from compressed_io import get_compression_suffix, strip_compression_suffix
 
-def add_date(json_file_path) -> str:
+def get_dated_file_path(json_file_path) -> str:
     # Extract the file name without extension
-    json_file_name_without_extension = Path(json_file_path).stem
+    json_file_name_without_extension = Path(strip_compression_suffix(json_file_path)).stem
     
-    # Extract the file extension
-    file_extension = Path(json_file_path).suffix
+    # Extract the file extension, with the compression of a compressed trace
+    file_extension = Path(strip_compression_suffix(json_file_path)).suffix + get_compression_suffix(json_file_path)
     
     # Get the current date
     date = datetime.datetime.now().strftime("%Y-%m-%d")
@@ -19,8 +20,11 @@ def add_date(json_file_path) -> str:
     file_directory = os.path.dirname(json_file_path)
     
     # Create the full path of the output file
-    output_file_path = os.path.join(file_directory, output_file_name)
+    return os.path.join(file_directory, output_file_name)
+
+def add_date(json_file_path) -> str:
+    output_file_path = get_dated_file_path(json_file_path)
 
     os.rename(json_file_path, output_file_path)
     
-    return output_file_path
\ No newline at end of file
+    return output_file_path
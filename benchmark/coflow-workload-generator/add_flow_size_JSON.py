@@ -1,46 +1,102 @@
-import json
 import os
 import random
 import sys
+import numpy as np
 
 from generate_bytes_from_CDF import CDFGenerator
+from trace_io import load_trace, save_trace, stream_trace, get_trace_name, get_json_suffix
+from sharded_enrichment import split_into_shards, join_shards, get_shard_seed, map_shards
 
 class AddSizeToCoflowTrace:
 
-    def add_size_to_coflow_trace(self, json_file: str, output_file_path: str):
+    def add_size_to_coflow(self, coflow: dict) -> dict:
+
+        # Generate the byte sizes for all flows in the coflow
+        flow_sizes_bytes = self.cdf_generator.generate_byte_sizes(len(coflow['flows'])).tolist()
+
+        for flow, flow_size_bytes in zip(coflow['flows'], flow_sizes_bytes):
+            # Add byte size to flow
+            flow['flow_size_bytes'] = flow_size_bytes
+
+        return coflow
+
+    def add_size_to_trace(self, coflow_trace: dict) -> dict:
+
+        flows = [flow for coflow in coflow_trace['coflows'] for flow in coflow['flows']]
+
+        # One vectorized draw for the whole trace, in flow order
+        flow_sizes_bytes = self.cdf_generator.generate_byte_sizes(len(flows)).tolist()
+
+        # Update JSON coflow trace with flow sizes
+        for flow, flow_size_bytes in zip(flows, flow_sizes_bytes):
+            flow['flow_size_bytes'] = flow_size_bytes
+
+        return coflow_trace
+
+    def add_size_to_shard(self, coflows: list, seed: int) -> list:
+
+        flows = [flow for coflow in coflows for flow in coflow['flows']]
+
+        flow_sizes_bytes = self.cdf_generator.generate_byte_sizes(len(flows), np.random.RandomState(seed)).tolist()
+
+        for flow, flow_size_bytes in zip(flows, flow_sizes_bytes):
+            flow['flow_size_bytes'] = flow_size_bytes
+
+        return coflows
+
+    def add_size_to_trace_sharded(self, coflow_trace: dict, workers: int, seed: int = 0) -> dict:
+
+        shards = split_into_shards(coflow_trace['coflows'])
+        shard_arguments = [(shard, get_shard_seed(seed, 'size', shard_index)) for shard_index, shard in enumerate(shards)]
+
+        coflow_trace['coflows'] = join_shards(map_shards(self.add_size_to_shard, shard_arguments, workers))
+
+        return coflow_trace
+
+    def add_size_to_coflow_trace(self, json_file: str, output_file_path: str, streaming: bool = False, workers: int = 0, seed: int = 0):
         if not os.path.exists(json_file):
             print(f"File '{json_file}' not found.")
             return
 
+        # Read and write one coflow at a time
+        if streaming:
+            return stream_trace(json_file, output_file_path, self.add_size_to_coflow)
+
         # Load JSON coflow trace
-        with open(json_file, 'r') as f:
-            coflow_trace = json.load(f)
+        coflow_trace = load_trace(json_file)
 
-        # Update JSON coflow trace with source and destination ports
-        for coflow in coflow_trace['coflows']:
-            for flow in coflow['flows']:
-                # Generate the byte size for the flow
-                flow_size_bytes = self.cdf_generator.generate_byte_size()
-                # Add byte size to flow
-                flow['flow_size_bytes'] = flow_size_bytes
+        if workers:
+            coflow_trace = self.add_size_to_trace_sharded(coflow_trace, workers, seed)
+        else:
+            coflow_trace = self.add_size_to_trace(coflow_trace)
 
-        with open(output_file_path, 'w') as f:
-            json.dump(coflow_trace, f, indent=2)
+        return save_trace(coflow_trace, output_file_path)
 
-        return output_file_path
-    
-    def run(self, json_file_path: str, CDF_file_path: str, output_dir: str) -> str:
+    def get_output_file_path(self, json_file_path: str, CDF_file_path: str, output_dir: str) -> str:
 
-        self.json_file_name_without_extension = os.path.splitext(os.path.basename(json_file_path))[0]
+        json_file_name_without_extension = get_trace_name(json_file_path)
 
-        self.CDF_file_without_extension = os.path.splitext(os.path.basename(CDF_file_path))[0]
+        CDF_file_without_extension = os.path.splitext(os.path.basename(CDF_file_path))[0]
+
+        output_file = f'{json_file_name_without_extension}_{CDF_file_without_extension}_size{get_json_suffix(json_file_path)}'
+        return os.path.join(output_dir, output_file)
+
+    def run_trace(self, coflow_trace: dict, CDF_file_path: str, lookup_table_size: int = None, workers: int = 0, seed: int = 0) -> dict:
+
+        self.cdf_generator = CDFGenerator(CDF_file_path, lookup_table_size)
+
+        if workers:
+            return self.add_size_to_trace_sharded(coflow_trace, workers, seed)
+
+        return self.add_size_to_trace(coflow_trace)
+    
+    def run(self, json_file_path: str, CDF_file_path: str, output_dir: str, streaming: bool = False, lookup_table_size: int = None, workers: int = 0, seed: int = 0) -> str:
 
-        output_file = f'{self.json_file_name_without_extension}_{self.CDF_file_without_extension}_size.json'
-        output_file_path = os.path.join(output_dir, output_file)
+        output_file_path = self.get_output_file_path(json_file_path, CDF_file_path, output_dir)
 
-        self.cdf_generator = CDFGenerator(CDF_file_path)
+        self.cdf_generator = CDFGenerator(CDF_file_path, lookup_table_size)
 
-        output_file_path = self.add_size_to_coflow_trace(json_file_path, output_file_path)
+        output_file_path = self.add_size_to_coflow_trace(json_file_path, output_file_path, streaming, workers, seed)
 
         return output_file_path
     
@@ -1,81 +1,144 @@
 import os
-import json
 import random
 
+from trace_io import load_trace, save_trace, stream_trace
+from sharded_enrichment import split_into_shards, join_shards, get_shard_seed, map_shards
+
+SRC_PORT_FIRST = 10000
+SRC_PORT_LAST = 10030
+
 class AddPortsToCoflowTrace:
 
     def __init__(self):
         self.dst_ports = [2110, 2120, 2130, 2140, 2150, 2160, 2170, 2180]
-
-    def add_ports_to_coflow_trace(self, json_file, output_dir):
-        if not os.path.exists(json_file):
-            print(f"File '{json_file}' not found.")
-            return
-
-        # Load JSON coflow trace
-        with open(json_file, 'r') as f:
-            coflow_trace = json.load(f)
-
-        # Function to get a random port for an IP from the respective dictionary
-        def get_src_port(ip, src_ip_ports_dict) -> int:
-            current_port = src_ip_ports_dict[ip]
-            # if 18, set to 1
-            if current_port == 10030: # number of max src ports, currently 11
-            #if current_port == 109000:
-                src_ip_ports_dict[ip] = 10000
-                return 10000
-            else:
-                src_ip_ports_dict[ip] += 1
-                return current_port
-
+        self.src_ip_ports_dict = {}  # Dictionary to store the current port for each IP
+
+    # Function to get a random port for an IP from the respective dictionary
+    def get_src_port(self, ip, src_ip_ports_dict) -> int:
+        current_port = src_ip_ports_dict[ip]
+        # if 18, set to 1
+        if current_port == SRC_PORT_LAST: # number of max src ports, currently 11
+        #if current_port == 109000:
+            src_ip_ports_dict[ip] = SRC_PORT_FIRST
+            return SRC_PORT_FIRST
+        else:
+            src_ip_ports_dict[ip] += 1
+            return current_port
+
+    def get_src_port_state(self, calls: int) -> int:
+        # Port counter of an IP after calls to get_src_port, it cycles through SRC_PORT_FIRST..SRC_PORT_LAST
+        return SRC_PORT_FIRST + calls % (SRC_PORT_LAST - SRC_PORT_FIRST + 1)
+
+    def add_ports_to_coflow(self, coflow: dict, rng=random) -> dict:
 
         # Dictionary to store common ports for each IP in the coflow
         common_src_ports = {}
         common_dst_ports = {}
 
-        src_ip_ports_dict = {}  # Dictionary to store the current port for each IP
+        src_ip_ports_dict = self.src_ip_ports_dict
+
+        for flow in coflow['flows']:
+            # Get source and destination IPs
+            src_ip = float(flow['source_id'])
+            dst_ip = float(flow['dest_id'])
+
+            # If source IP is not in the dictionary, add it
+            if src_ip not in src_ip_ports_dict:
+                src_ip_ports_dict[src_ip] = SRC_PORT_FIRST
+
+            # If common source port is not assigned for this IP in the coflow, assign one
+            if src_ip not in common_src_ports:
+                common_src_ports[src_ip] = self.get_src_port(src_ip, src_ip_ports_dict)
+
+            # If common destination port is not assigned for this IP in the coflow, assign one
+            if dst_ip not in common_dst_ports:
+                # select a random destination port from the list of destination ports
+                common_dst_ports[dst_ip] = rng.choice(self.dst_ports)
+
+            # Update the flow with source and destination ports
+            flow['src_port'] = common_src_ports[src_ip]
+            flow['dst_port'] = common_dst_ports[dst_ip]
+
+        return coflow
+
+    def add_ports_to_trace(self, coflow_trace: dict) -> dict:
+
+        self.src_ip_ports_dict = {}
 
         # Update JSON coflow trace with source and destination ports
         for coflow in coflow_trace['coflows']:
-            for flow in coflow['flows']:
-                # Get source and destination IPs
-                src_ip = float(flow['source_id'])
-                dst_ip = float(flow['dest_id'])
-
-                # If source IP is not in the dictionary, add it
-                if src_ip not in src_ip_ports_dict:
-                    src_ip_ports_dict[src_ip] = 10000
-
-                # If common source port is not assigned for this IP in the coflow, assign one
-                if src_ip not in common_src_ports:
-                    common_src_ports[src_ip] = get_src_port(src_ip, src_ip_ports_dict)
-
-                # If common destination port is not assigned for this IP in the coflow, assign one
-                if dst_ip not in common_dst_ports:
-                    # select a random destination port from the list of destination ports
-                    common_dst_ports[dst_ip] = random.choice(self.dst_ports)
-
-                # Update the flow with source and destination ports
-                flow['src_port'] = common_src_ports[src_ip]
-                flow['dst_port'] = common_dst_ports[dst_ip]
-            
-            # clear the common ports dictionaries
-            common_src_ports.clear()
-            common_dst_ports.clear()
+            self.add_ports_to_coflow(coflow)
+
+        return coflow_trace
+
+    def count_src_ips_in_shard(self, coflows: list) -> dict:
+        # Calls to get_src_port per source IP, one for every coflow the IP sends in
+        src_ip_counts = {}
+        for coflow in coflows:
+            for src_ip in {float(flow['source_id']) for flow in coflow['flows']}:
+                src_ip_counts[src_ip] = src_ip_counts.get(src_ip, 0) + 1
+        return src_ip_counts
+
+    def add_ports_to_shard(self, coflows: list, src_ip_ports_dict: dict, seed: int) -> list:
+
+        self.src_ip_ports_dict = src_ip_ports_dict
+        rng = random.Random(seed)
+
+        for coflow in coflows:
+            self.add_ports_to_coflow(coflow, rng)
+
+        return coflows
+
+    def add_ports_to_trace_sharded(self, coflow_trace: dict, workers: int, seed: int = 0) -> dict:
+
+        shards = split_into_shards(coflow_trace['coflows'])
+        shard_src_ip_counts = map_shards(self.count_src_ips_in_shard, [(shard,) for shard in shards], workers)
+
+        # Prefix scan of the calls per IP gives the port counters at the start of every shard,
+        # the source ports are the same as in add_ports_to_trace
+        calls = {}
+        shard_arguments = []
+        for shard_index, (shard, src_ip_counts) in enumerate(zip(shards, shard_src_ip_counts)):
+            src_ip_ports_dict = {src_ip: self.get_src_port_state(calls.get(src_ip, 0)) for src_ip in src_ip_counts}
+            shard_arguments.append((shard, src_ip_ports_dict, get_shard_seed(seed, 'ports', shard_index)))
+            for src_ip, count in src_ip_counts.items():
+                calls[src_ip] = calls.get(src_ip, 0) + count
+
+        coflow_trace['coflows'] = join_shards(map_shards(self.add_ports_to_shard, shard_arguments, workers))
+
+        return coflow_trace
+
+    def add_ports_to_coflow_trace(self, json_file, output_dir, streaming: bool = False, workers: int = 0, seed: int = 0):
+        if not os.path.exists(json_file):
+            print(f"File '{json_file}' not found.")
+            return
+
+        output_file_path = self.get_output_file_path(json_file, output_dir)
+
+        # Read and write one coflow at a time
+        if streaming:
+            self.src_ip_ports_dict = {}
+            return stream_trace(json_file, output_file_path, self.add_ports_to_coflow)
+
+        # Load JSON coflow trace
+        coflow_trace = load_trace(json_file)
+
+        if workers:
+            coflow_trace = self.add_ports_to_trace_sharded(coflow_trace, workers, seed)
+        else:
+            coflow_trace = self.add_ports_to_trace(coflow_trace)
 
         # Save the modified JSON coflow trace
+        return save_trace(coflow_trace, output_file_path)
+
+    def get_output_file_path(self, json_file: str, output_dir: str) -> str:
         # create output file name by adding '_ports' to the original file name
         output_file = os.path.basename(json_file).replace('.json', '_ports.json')
-        output_file_path = os.path.join(output_dir, output_file)
-
-        with open(output_file_path, 'w') as f:
-            json.dump(coflow_trace, f, indent=2)
-
-        return output_file_path
+        return os.path.join(output_dir, output_file)
     
-    def run(self, json_file_path: str, output_dir: str) -> str:
+    def run(self, json_file_path: str, output_dir: str, streaming: bool = False, workers: int = 0, seed: int = 0) -> str:
 
-        output_file_path = self.add_ports_to_coflow_trace(json_file_path, output_dir)
+        output_file_path = self.add_ports_to_coflow_trace(json_file_path, output_dir, streaming, workers, seed)
 
         return output_file_path
     
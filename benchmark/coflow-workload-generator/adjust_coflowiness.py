@@ -1,15 +1,17 @@
 import os
 import math
-import json
 import argparse
 import humanize
 import create_pcap_file_CDF
 
-from pathlib import Path
 from time import perf_counter
 from utils.check_coflowiness import CheckCoflowiness
 from create_unique_base_IP import BaseIPv4Generator
+from columnar_trace import format_ipv4
 from remove_flows import RemoveFlows
+from trace_metadata import TraceMetadata
+from trace_io import load_trace, save_trace, stream_trace, get_trace_name, get_json_suffix
+from sharded_enrichment import split_into_shards, join_shards, map_shards
 import uppdate_metadata
 
 
@@ -27,77 +29,179 @@ class AdjustCoflowiness:
         else:
             return "Number must be between 0 and 1."
      
-    def adjust_coflowiness(self, json_file: str, output_file_path: str, coflowiness: float) -> str:
-        
-        if not os.path.exists(json_file):
-            print(f"File '{json_file}' not found.")
-            raise FileNotFoundError
+    def adjust_coflowiness_coflow(self, coflow: dict, inverted_coflowiness: float) -> dict:
 
-        # Load JSON coflow trace
-        with open(json_file, 'r') as f:
-            coflow_trace = json.load(f)
+        num_flows = len(coflow['flows'])
+
+        number_of_flows_to_change = math.floor(num_flows * inverted_coflowiness)
+        self.changed_flows = 0
+
+        if not num_flows:
+            return coflow
+
+        first_flow = coflow['flows'][0]
+        first_flow['dst_port'] = 2100
+        self.ipv4_generator.add_excluded_subnet(first_flow['src_ip'])
+
+        # The flows after the first become base flows with consecutive unique source IPs
+        flows_to_change = coflow['flows'][1:1 + number_of_flows_to_change]
+        unique_base_src_ips = format_ipv4(self.ipv4_generator.get_unique_base_src_ips(self.base_flow_index, len(flows_to_change)))
+
+        for flow, unique_base_src_ip in zip(flows_to_change, unique_base_src_ips):
+            flow['dst_port'] = 2100
+            flow['src_ip'] = unique_base_src_ip
+
+        self.changed_flows = len(flows_to_change)
+        self.base_flow_index += len(flows_to_change)
+
+        return coflow
+
+    def adjust_coflowiness_trace(self, coflow_trace: dict, coflowiness: float, metadata: TraceMetadata = None) -> dict:
 
         inverted_coflowiness = self.invert_number(coflowiness)
 
         for coflow in coflow_trace['coflows']:
-            
+            self.adjust_coflowiness_coflow(coflow, inverted_coflowiness)
+            if metadata is not None:
+                metadata.add_coflow(coflow)
+
+        return coflow_trace
+
+    def summarize_shard(self, coflows: list, inverted_coflowiness: float) -> tuple:
+        # Base flows the shard uses and the source IPs it excludes, in the order adjust_coflowiness_coflow does
+        base_flows = 0
+        excluded_src_ips = []
+        for coflow in coflows:
             num_flows = len(coflow['flows'])
-            self.first_flow = True
-            
-            number_of_flows_to_change = math.floor(num_flows * inverted_coflowiness)
-            self.changed_flows = 0
-
-            for flow in coflow['flows']:
-                if self.first_flow:
-                    src_ip = flow['src_ip']
-                    flow['dst_port'] = 2100
-                    self.ipv4_generator.add_excluded_subnet(src_ip)
-                    self.first_flow = False
-                    continue
-
-                if self.changed_flows < number_of_flows_to_change:
-                    flow['dst_port'] = 2100
-                    unique_base_src_ip = self.ipv4_generator.get_unique_base_src_ip(self.base_flow_index)
-                    flow['src_ip'] = unique_base_src_ip
-                    self.changed_flows += 1
-                    self.base_flow_index += 1
-
-
-        with open(output_file_path, 'w') as f:
-            json.dump(coflow_trace, f, indent=2)
-
-        return output_file_path
+            if num_flows:
+                excluded_src_ips.append(coflow['flows'][0]['src_ip'])
+                base_flows += min(math.floor(num_flows * inverted_coflowiness), num_flows - 1)
+        return base_flows, excluded_src_ips
+
+    def adjust_coflowiness_shard(self, coflows: list, inverted_coflowiness: float, base_flow_index: int, excluded_src_ips: list, metadata: TraceMetadata = None) -> tuple:
+        # Returns the adjusted coflows and the empty metadata it was given filled with the shard, or None
+
+        self.base_flow_index = base_flow_index
+        for src_ip in excluded_src_ips:
+            self.ipv4_generator.add_excluded_subnet(src_ip)
+
+        for coflow in coflows:
+            self.adjust_coflowiness_coflow(coflow, inverted_coflowiness)
+            if metadata is not None:
+                metadata.add_coflow(coflow)
+
+        return coflows, metadata
+
+    def adjust_coflowiness_trace_sharded(self, coflow_trace: dict, coflowiness: float, workers: int, metadata: TraceMetadata = None) -> dict:
+
+        inverted_coflowiness = self.invert_number(coflowiness)
+
+        shards = split_into_shards(coflow_trace['coflows'])
+        shard_summaries = map_shards(self.summarize_shard, [(shard, inverted_coflowiness) for shard in shards], workers)
+
+        # Prefix scan of the base flow index and the excluded subnets, the output is the same as adjust_coflowiness_trace
+        base_flow_index = self.base_flow_index
+        excluded_src_ips = []
+        shard_arguments = []
+        for shard, (base_flows, shard_excluded_src_ips) in zip(shards, shard_summaries):
+            shard_arguments.append((shard, inverted_coflowiness, base_flow_index, list(excluded_src_ips), None if metadata is None else TraceMetadata(metadata.cardinality_error)))
+            base_flow_index += base_flows
+            excluded_src_ips.extend(shard_excluded_src_ips)
+
+        adjusted_shards = map_shards(self.adjust_coflowiness_shard, shard_arguments, workers)
+
+        coflow_trace['coflows'] = join_shards([shard for shard, _ in adjusted_shards])
+
+        if metadata is not None:
+            for _, shard_metadata in adjusted_shards:
+                metadata.merge(shard_metadata)
+
+        self.base_flow_index = base_flow_index
+        for src_ip in excluded_src_ips:
+            self.ipv4_generator.add_excluded_subnet(src_ip)
+
+        return coflow_trace
+
+    def adjust_coflowiness(self, json_file: str, output_file_path: str, coflowiness: float, streaming: bool = False, workers: int = 0) -> str:
+
+        # Read and write one coflow at a time
+        if streaming:
+            inverted_coflowiness = self.invert_number(coflowiness)
+            return stream_trace(json_file, output_file_path, lambda coflow: self.adjust_coflowiness_coflow(coflow, inverted_coflowiness))
+
+        # Load JSON coflow trace
+        coflow_trace = load_trace(json_file)
+
+        if workers:
+            coflow_trace = self.adjust_coflowiness_trace_sharded(coflow_trace, coflowiness, workers)
+        else:
+            coflow_trace = self.adjust_coflowiness_trace(coflow_trace, coflowiness)
+
+        return save_trace(coflow_trace, output_file_path)
     
 
-    def run(self, json_file_path: str, output_dir: str, coflowiness: float, desired_unique_flows: int) -> str:
+    def get_output_file_path(self, json_file_path: str, output_dir: str, coflowiness: float) -> str:
+
+        json_file_name_without_extension = get_trace_name(json_file_path)
+
+        output_file = f'{json_file_name_without_extension}_coflowiness_{coflowiness}{get_json_suffix(json_file_path)}'
+
+        return os.path.join(output_dir, output_file)
+
+
+    def run_trace(self, coflow_trace: dict, coflowiness: float, desired_unique_flows: int, NUM_PODS: int = 8, workers: int = 0, cardinality_error: float = None) -> dict:
 
         if coflowiness <= 0 or coflowiness > 1:
             print("Coflowiness should be between 0 and 1.")
             raise ValueError("Coflowiness should be between 0 and 1.")
 
-        self.json_file_name_without_extension = Path(os.path.basename(json_file_path)).stem
+        # The metadata is counted while the flows are adjusted and kept up to date by the later stages
+        self.metadata = TraceMetadata(cardinality_error)
+
+        if workers:
+            coflow_trace = self.adjust_coflowiness_trace_sharded(coflow_trace, coflowiness, workers, self.metadata)
+        else:
+            coflow_trace = self.adjust_coflowiness_trace(coflow_trace, coflowiness, self.metadata)
+
+        number_of_unique_flows = self.metadata.get_unique_flows(coflow_trace)
+
+        # Remember which branch was taken, the file names of the two branches differ
+        self.flows_removed = number_of_unique_flows > desired_unique_flows
+
+        if self.flows_removed:
+
+            print(f"Number of unique flows, {number_of_unique_flows}, is more than the desired number of unique flows, {desired_unique_flows}.")
+            print(f"Removing {number_of_unique_flows - desired_unique_flows} flows.")
+            return RemoveFlows().run_trace(coflow_trace, desired_unique_flows, NUM_PODS, self.metadata)
 
-        output_file = f'{self.json_file_name_without_extension}_coflowiness_{coflowiness}.json'
+        print(f'No flows removed. Number of unique flows: {number_of_unique_flows}')
+        return uppdate_metadata.UpdateMetadata().update_metadata_trace(coflow_trace, NUM_PODS, self.metadata)
+
+
+    def run(self, json_file_path: str, output_dir: str, coflowiness: float, desired_unique_flows: int, streaming: bool = False, workers: int = 0, cardinality_error: float = None) -> str:
+
+        if coflowiness <= 0 or coflowiness > 1:
+            print("Coflowiness should be between 0 and 1.")
+            raise ValueError("Coflowiness should be between 0 and 1.")
 
-        output_file_path = os.path.join(output_dir, output_file)
+        output_file_path = self.get_output_file_path(json_file_path, output_dir, coflowiness)
 
-        output_file_path = self.adjust_coflowiness(json_file_path, output_file_path, coflowiness)
+        output_file_path = self.adjust_coflowiness(json_file_path, output_file_path, coflowiness, streaming, workers)
 
         ## Add check if unique flows are more than desired
 
-        flow_set = RemoveFlows().create_flow_set(output_file_path)
-        number_of_unique_flows = len(flow_set)
+        number_of_unique_flows = RemoveFlows().create_flow_index(output_file_path, streaming).count_unique()
 
         if number_of_unique_flows > desired_unique_flows:
 
             print(f"Number of unique flows, {number_of_unique_flows}, is more than the desired number of unique flows, {desired_unique_flows}.")
             print(f"Removing {number_of_unique_flows - desired_unique_flows} flows.")
-            updated_output_file_path = RemoveFlows().run(output_file_path, output_dir, desired_unique_flows)
+            updated_output_file_path = RemoveFlows().run(output_file_path, output_dir, desired_unique_flows, cardinality_error)
         
         else:
             print(f'No flows removed. Number of unique flows: {number_of_unique_flows}')
             update_metadata_instance = uppdate_metadata.UpdateMetadata()
-            updated_output_file_path = update_metadata_instance.run(json_file_path=output_file_path, output_dir=output_dir, NUM_PODS=8)
+            updated_output_file_path = update_metadata_instance.run(json_file_path=output_file_path, output_dir=output_dir, NUM_PODS=8, cardinality_error=cardinality_error)
 
         return updated_output_file_path
     
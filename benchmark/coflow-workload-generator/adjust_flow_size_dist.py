@@ -16,13 +16,14 @@ class AddSizeToCoflowTrace:
         with open(json_file, 'r') as f:
             coflow_trace = json.load(f)
 
-        # Update JSON coflow trace with source and destination ports
-        for coflow in coflow_trace['coflows']:
-            for flow in coflow['flows']:
-                # Generate the byte size for the flow
-                flow_size_bytes = self.cdf_generator.generate_byte_size()
-                # Add byte size to flow
-                flow['flow_size_bytes'] = flow_size_bytes
+        flows = [flow for coflow in coflow_trace['coflows'] for flow in coflow['flows']]
+
+        # Generate the byte sizes for all flows in one vectorized call
+        flow_sizes_bytes = self.cdf_generator.generate_byte_sizes(len(flows)).tolist()
+
+        # Update JSON coflow trace with flow sizes
+        for flow, flow_size_bytes in zip(flows, flow_sizes_bytes):
+            flow['flow_size_bytes'] = flow_size_bytes
 
         with open(output_file_path, 'w') as f:
             json.dump(coflow_trace, f, indent=2)
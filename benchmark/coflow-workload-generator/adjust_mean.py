@@ -1,11 +1,11 @@
 import os
-import json
 import argparse
 
 from statistics import mean
-from pathlib import Path
 import sys
 
+from trace_io import load_trace, save_trace, get_trace_name, get_json_suffix
+
 class AdjustMean:
 
     def __init__(self):
@@ -17,15 +17,7 @@ class AdjustMean:
         else:
             return "Number must be between 0 and 1."
      
-    def adjust_mean(self, json_file: str, output_file_path: str) -> str:
-        
-        if not os.path.exists(json_file):
-            print(f"File '{json_file}' not found.")
-            raise FileNotFoundError
-
-        # Load JSON coflow trace
-        with open(json_file, 'r') as f:
-            coflow_trace = json.load(f)
+    def adjust_mean_trace(self, coflow_trace: dict) -> dict:
 
         coflow_lengths = []
 
@@ -39,11 +31,16 @@ class AdjustMean:
                 coflow_lengths.append(new_coflow_length)
                 coflow['flows'] = coflow['flows'][:new_coflow_length]
 
+        return coflow_trace
 
-        with open(output_file_path, 'w') as f:
-            json.dump(coflow_trace, f, indent=2)
+    def adjust_mean(self, json_file: str, output_file_path: str) -> str:
 
-        return output_file_path
+        # Load JSON coflow trace
+        coflow_trace = load_trace(json_file)
+
+        coflow_trace = self.adjust_mean_trace(coflow_trace)
+
+        return save_trace(coflow_trace, output_file_path)
     
 
     def get_mean_coflow_length(self, coflow_lengths) -> float:
@@ -57,13 +54,18 @@ class AdjustMean:
         return additional_value
     
 
-    def run(self, json_file_path: str, output_dir: str) -> str:
+    def get_output_file_path(self, json_file_path: str, output_dir: str) -> str:
+
+        json_file_name_without_extension = get_trace_name(json_file_path)
 
-        self.json_file_name_without_extension = Path(os.path.basename(json_file_path)).stem
+        output_file = f'{json_file_name_without_extension}_100_mean{get_json_suffix(json_file_path)}'
 
-        output_file = f'{self.json_file_name_without_extension}_100_mean.json'
+        return os.path.join(output_dir, output_file)
 
-        output_file_path = os.path.join(output_dir, output_file)
+
+    def run(self, json_file_path: str, output_dir: str) -> str:
+
+        output_file_path = self.get_output_file_path(json_file_path, output_dir)
 
         output_file_path = self.adjust_mean(json_file_path, output_file_path)
 
@@ -74,15 +76,7 @@ class AdjustMean:
         return output_file_path
     
 
-    def check_mean_coflow_length(self, json_file: str) -> float:
-    
-        if not os.path.exists(json_file):
-            print(f"File '{json_file}' not found.")
-            raise FileNotFoundError
-
-        # Load JSON coflow trace
-        with open(json_file, 'r') as f:
-            coflow_trace = json.load(f)
+    def get_mean_coflow_length_trace(self, coflow_trace: dict) -> float:
 
         coflow_lengths = []
 
@@ -92,6 +86,13 @@ class AdjustMean:
 
         mean_coflow_length = mean(coflow_lengths)
         return mean_coflow_length
+
+    def check_mean_coflow_length(self, json_file: str) -> float:
+
+        # Load JSON coflow trace
+        coflow_trace = load_trace(json_file)
+
+        return self.get_mean_coflow_length_trace(coflow_trace)
     
     
     
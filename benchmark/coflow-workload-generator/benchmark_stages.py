@@ -0,0 +1,296 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import resource
+import tempfile
+import traceback
+import subprocess
+import contextlib
+import humanize
+import numpy as np
+import multiprocessing
+
+from time import perf_counter
+
+import trace_producer, parse_trace, adjust_mean, add_ports_to_trace, add_IPs_JSON, adjust_coflowiness, remove_flows, add_MAC_JSON, add_flow_size_JSON, uppdate_metadata, create_pcap_file_CDF
+
+# Benchmark of the trace generation stages
+#
+# Runs the file based stages of main.py one after the other on synthetic traces of a few sizes and
+# appends the wall time, peak RSS and output bytes of every stage to a JSON history file. The FB
+# trace the Sincronia trace producer samples from is synthesized with a fixed seed, and all files
+# are written to a temporary directory, so nothing under /mnt/traces is needed.
+#
+# Every stage runs in a forked process, so the peak RSS of the process and of the pcap workers it
+# starts is the peak of that stage, on top of the modules it inherits from the benchmark process.
+# The stages are seeded the same way on every run, the output bytes only change with the output.
+
+DEFAULT_SIZES = [100, 1000, 10000] # coflows
+DEFAULT_HISTORY_FILE = 'benchmark_history.json'
+
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CDF_FILE = os.path.join(CODE_DIR, 'data', 'CDFs', 'Facebook_HadoopDist_All.txt')
+
+FB_TRACE_COFLOWS = 526 # as many as in the FB trace
+NUM_INP_PORTS = 150
+
+STAGES = ['trace_producer', 'parse', 'mean', 'ports', 'IPs', 'coflowiness', 'remove_flows', 'MACs', 'size', 'metadata', 'pcap']
+
+STAGE_DIRS = ['traces', 'parsed_traces', 'mean', 'ports', 'traces_with_IPs', 'adjusted_coflowiness', 'removed_flows', 'traces_with_MAC', 'traces_with_size', 'updated_metadata', 'pcap_traces']
+
+
+def write_fb_trace(file_path: str, seed: int):
+
+    # Same format as coflow-benchmark-trace.txt: id, arrival time in ms, the mappers and the reducers with their MB
+    rng = np.random.default_rng(seed)
+
+    with open(file_path, 'w') as f:
+        for coflow_id in range(1, FB_TRACE_COFLOWS + 1):
+            num_mappers = min(int(rng.zipf(1.6)), NUM_INP_PORTS)
+            num_reducers = min(int(rng.zipf(1.6)), NUM_INP_PORTS)
+            mappers = rng.choice(NUM_INP_PORTS, num_mappers, replace=False)
+            reducers = rng.choice(NUM_INP_PORTS, num_reducers, replace=False)
+            reducer_datas = rng.lognormal(3, 1.5, num_reducers)
+            fields = [coflow_id, (coflow_id - 1) * 100, num_mappers, *mappers, num_reducers, *(f'{reducer}:{data:.1f}' for reducer, data in zip(reducers, reducer_datas))]
+            f.write(' '.join(str(field) for field in fields) + '\n')
+
+
+def get_output_bytes(output_file_paths: list) -> int:
+    return sum(os.path.getsize(file_path) for file_path in output_file_paths if os.path.exists(file_path))
+
+
+def get_peak_rss() -> int:
+    # ru_maxrss is in KB on Linux, the children are the pcap workers
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * 1024
+
+
+def run_stage_process(stage_function, seed: int, verbose: bool, connection):
+
+    random.seed(seed)
+    np.random.seed(seed)
+
+    try:
+        with contextlib.ExitStack() as stack:
+            if not verbose:
+                stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, 'w'))))
+            start = perf_counter()
+            output_file_paths = stage_function()
+            wall_time = perf_counter() - start
+        connection.send((output_file_paths, wall_time, get_peak_rss(), None))
+    except Exception:
+        connection.send((None, None, None, traceback.format_exc()))
+    finally:
+        connection.close()
+
+
+def measure_stage(stage_function, seed: int, verbose: bool) -> tuple:
+
+    context = multiprocessing.get_context('fork')
+    receiver, sender = context.Pipe(duplex=False)
+
+    process = context.Process(target=run_stage_process, args=(stage_function, seed, verbose, sender))
+    process.start()
+    sender.close()
+
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = (None, None, None, f'Stage process exited with code {process.exitcode}')
+    process.join()
+
+    output_file_paths, wall_time, peak_rss, error = result
+    if error is not None:
+        raise RuntimeError(error)
+
+    return output_file_paths, wall_time, peak_rss
+
+
+def run_benchmark(coflows: int, work_dir: str, CDF_file_path: str, seed: int, load_factor: float, coflowiness: float, unique_flows_fraction: float, NUM_PODS: int, workers: int, streaming: bool, cores: int, packet_backend: str, verbose: bool, stages: list = STAGES) -> dict:
+
+    dirs = {name: os.path.join(work_dir, name) for name in STAGE_DIRS}
+    for dir in dirs.values():
+        os.makedirs(dir, exist_ok=True)
+
+    # The trace producer reads the FB trace from and writes its traces and pickles to the working directory
+    write_fb_trace(os.path.join(work_dir, 'coflow-benchmark-trace.txt'), seed)
+    os.chdir(work_dir)
+
+    # Input of the next stage, the first output of the stage before
+    paths = {}
+
+    def produce():
+        path = trace_producer.run(NUM_COFLOWS=coflows, ALPHA='FB-UP', LOAD_FACTOR=load_factor)
+        return [path, parse_trace.get_flow_starts_file_path(path)]
+
+    def adjust():
+        coflowiness_adjuster = adjust_coflowiness.AdjustCoflowiness()
+        output_file_path = coflowiness_adjuster.get_output_file_path(paths['IPs'], dirs['adjusted_coflowiness'], coflowiness)
+        return [coflowiness_adjuster.adjust_coflowiness(paths['IPs'], output_file_path, coflowiness, streaming, workers)]
+
+    def remove():
+        # The unique flows are counted like in AdjustCoflowiness.run, a fraction of them is kept
+        flow_remover = remove_flows.RemoveFlows()
+        number_of_unique_flows = flow_remover.create_flow_index(paths['coflowiness'], streaming).count_unique()
+        return [flow_remover.run(paths['coflowiness'], dirs['removed_flows'], int(number_of_unique_flows * unique_flows_fraction))]
+
+    stage_functions = {
+        'trace_producer': produce,
+        'parse': lambda: [parse_trace.ParseTrace().run(paths['trace_producer'], dirs['parsed_traces'])],
+        'mean': lambda: [adjust_mean.AdjustMean().run(paths['parse'], dirs['mean'])],
+        'ports': lambda: [add_ports_to_trace.AddPortsToCoflowTrace().run(paths['mean'], dirs['ports'], streaming=streaming, workers=workers, seed=seed)],
+        'IPs': lambda: [add_IPs_JSON.AddIPsToCoflowTrace().run(paths['ports'], dirs['traces_with_IPs'], NUM_PODS=NUM_PODS, streaming=streaming, workers=workers, seed=seed)],
+        'coflowiness': adjust,
+        'remove_flows': remove,
+        'MACs': lambda: [add_MAC_JSON.AddMACsToCoflowTrace().run(paths['remove_flows'], dirs['traces_with_MAC'], streaming=streaming, workers=workers)],
+        'size': lambda: [add_flow_size_JSON.AddSizeToCoflowTrace().run(paths['MACs'], CDF_file_path, dirs['traces_with_size'], streaming=streaming, workers=workers, seed=seed)],
+        'metadata': lambda: [uppdate_metadata.UpdateMetadata().run(json_file_path=paths['size'], output_dir=dirs['updated_metadata'], NUM_PODS=NUM_PODS)],
+        'pcap': lambda: create_pcap_file_CDF.CoflowTraceGenerator().run(paths['metadata'], dirs['pcap_traces'], cores, packet_backend),
+    }
+
+    results = {}
+
+    for stage in stages:
+
+        print(f'Running stage {stage} with {coflows} coflows')
+
+        output_file_paths, wall_time, peak_rss = measure_stage(stage_functions[stage], seed, verbose)
+
+        paths[stage] = output_file_paths[0]
+        results[stage] = {
+            'wall_time': wall_time,
+            'peak_rss': peak_rss,
+            'output_bytes': get_output_bytes(output_file_paths)
+        }
+
+        print(f'Stage {stage} took {wall_time:.3f} seconds, peak RSS {humanize.naturalsize(peak_rss)}, output {humanize.naturalsize(results[stage]["output_bytes"])}')
+
+    return results
+
+
+def load_history(history_file: str) -> list:
+
+    if not os.path.exists(history_file):
+        return []
+
+    with open(history_file, 'r') as f:
+        return json.load(f)
+
+
+def save_history(history: list, history_file: str):
+
+    # Write to a temporary file first so that an interrupted run never leaves a partial history
+    tmp_history_file = f'{history_file}.{os.getpid()}.tmp'
+    with open(tmp_history_file, 'w') as f:
+        json.dump(history, f, indent=2)
+    os.replace(tmp_history_file, history_file)
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=CODE_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def find_previous_results(history: list, parameters: dict, coflows: int) -> dict:
+    # The last run with the same parameters that has this size
+    for run in reversed(history):
+        if run['parameters'] == parameters and str(coflows) in run['results']:
+            return run['results'][str(coflows)]
+    return None
+
+
+def print_results(results: dict, previous_results: dict, coflows: int):
+
+    print(f'\n{coflows} coflows')
+    print(f'{"stage":<16}{"wall time":>12}{"peak RSS":>12}{"output":>12}{"vs previous":>14}')
+
+    for stage, stage_results in results.items():
+        change = ''
+        if previous_results and stage in previous_results and previous_results[stage]['wall_time'] > 0:
+            change = f'{stage_results["wall_time"] / previous_results[stage]["wall_time"]:.2f}x'
+        print(f'{stage:<16}{stage_results["wall_time"]:>11.3f}s{humanize.naturalsize(stage_results["peak_rss"]):>12}{humanize.naturalsize(stage_results["output_bytes"]):>12}{change:>14}')
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Benchmark the trace generation stages on synthetic traces and append the results to a JSON history.')
+
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help=f'Numbers of coflows to benchmark. (default: {" ".join(str(size) for size in DEFAULT_SIZES)})')
+    parser.add_argument('--history-file', type=str, default=DEFAULT_HISTORY_FILE, help=f'JSON file the results are appended to. (default: {DEFAULT_HISTORY_FILE})')
+    parser.add_argument('--work-dir', type=str, default=None, help='Directory for the traces of the stages, kept after the run. (default: a temporary directory that is removed)')
+    parser.add_argument('--flow-size-distribution', type=str, default=DEFAULT_CDF_FILE, help='Path to flow size distribution file')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic FB trace and of the stages. (default: 0)')
+    parser.add_argument('--load-factor', type=float, default=0.9, help='Load factor between 0 and 1. (default: 0.9)')
+    parser.add_argument('--coflowiness', type=float, default=0.9, help='Coflowiness between 0 and 1. (default: 0.9)')
+    parser.add_argument('--unique-flows-fraction', type=float, default=0.9, help='Fraction of the unique flows RemoveFlows keeps. (default: 0.9)')
+    parser.add_argument('--NUM_PODS', type=int, default=8, help='Number of dst IPs to include in trace. (default: 8)')
+    parser.add_argument('--enrichment-workers', type=int, default=0, help='Workers of the sharded stages, as in main.py. (default: 0)')
+    parser.add_argument('--streaming', action='store_true', help='Run the stages that support it one coflow at a time, as in main.py. (default: False)')
+    parser.add_argument('--cores', type=int, default=1, help='Number of cores of the pcap generation. (default: 1)')
+    parser.add_argument('--packet-backend', type=str, default='scapy', choices=['scapy', 'raw', 'summary'], help='Packet backend of the pcap generation. (default: scapy)')
+    parser.add_argument('--no-pcap', action='store_true', help='Skip the pcap generation, its output grows with the flow sizes and can be much larger than the traces. (default: False)')
+    parser.add_argument('--verbose', action='store_true', help='Show the output of the stages. (default: False)')
+
+    args = parser.parse_args()
+
+    history_file = os.path.abspath(args.history_file)
+    CDF_file_path = os.path.abspath(args.flow_size_distribution)
+
+    if not os.path.exists(CDF_file_path):
+        print(f"Error: Flow size distribution file '{CDF_file_path}' does not exist.")
+        exit(1)
+
+    # Runs are only compared with runs of the same parameters
+    parameters = {
+        'seed': args.seed,
+        'load_factor': args.load_factor,
+        'coflowiness': args.coflowiness,
+        'unique_flows_fraction': args.unique_flows_fraction,
+        'NUM_PODS': args.NUM_PODS,
+        'enrichment_workers': args.enrichment_workers,
+        'streaming': args.streaming,
+        'cores': args.cores,
+        'packet_backend': None if args.no_pcap else args.packet_backend,
+        'flow_size_distribution': os.path.basename(CDF_file_path)
+    }
+
+    stages = STAGES[:-1] if args.no_pcap else STAGES
+
+    history = load_history(history_file)
+
+    run = {
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': get_commit(),
+        'python': sys.version.split()[0],
+        'parameters': parameters,
+        'results': {}
+    }
+
+    base_work_dir = os.path.abspath(args.work_dir) if args.work_dir else tempfile.mkdtemp(prefix='coflow-benchmark-')
+    cwd = os.getcwd()
+
+    try:
+        for coflows in args.sizes:
+            work_dir = os.path.join(base_work_dir, str(coflows))
+            run['results'][str(coflows)] = run_benchmark(coflows, work_dir, CDF_file_path, args.seed, args.load_factor, args.coflowiness, args.unique_flows_fraction, args.NUM_PODS, args.enrichment_workers, args.streaming, args.cores, args.packet_backend, args.verbose, stages)
+            # The traces of one size are not needed for the next
+            if not args.work_dir:
+                os.chdir(cwd)
+                shutil.rmtree(work_dir, ignore_errors=True)
+    finally:
+        os.chdir(cwd)
+        if not args.work_dir:
+            shutil.rmtree(base_work_dir, ignore_errors=True)
+
+    for coflows in args.sizes:
+        print_results(run['results'][str(coflows)], find_previous_results(history, parameters, coflows), coflows)
+
+    history.append(run)
+    save_history(history, history_file)
+
+    print(f'\nResults appended to {history_file}')
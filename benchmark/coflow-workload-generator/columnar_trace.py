@@ -0,0 +1,325 @@
+import os
+import sys
+import json
+import socket
+import numpy as np
+
+from compressed_io import open_file
+
+# Compact columnar on-disk format for coflow traces (.npz)
+#
+# Every flow field is stored as one array over all flows of the trace, the flows of
+# coflow i are flows[coflow_offsets[i]:coflow_offsets[i + 1]]. IPs are packed into
+# uint32, MACs into uint64 and integer fields into the smallest unsigned type that
+# holds them. Anything that can not be packed losslessly is stored as a string table.
+
+FORMAT_VERSION = 1
+
+def get_mac_by_id(mid) -> str:
+    return "00:EC:00:{:x}:{:x}:{:x}".format(mid >> 16 & 0xff,
+                                        mid >> 8 & 0xff, mid & 0xff)
+
+
+def parse_ipv4(ip: str) -> int:
+    # inet_pton only takes plain dotted quads, anything else is parsed below
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET, ip), 'big')
+    except OSError:
+        pass
+    octets = ip.split('.')
+    if len(octets) != 4:
+        raise ValueError(f"Not an IPv4 address: {ip}")
+    value = 0
+    for octet in octets:
+        octet = int(octet)
+        if not 0 <= octet <= 255:
+            raise ValueError(f"Not an IPv4 address: {ip}")
+        value = (value << 8) | octet
+    return value
+
+
+def format_ipv4(values: np.ndarray) -> list:
+    values = np.asarray(values, dtype=np.uint32)
+    a = (values >> 24).tolist()
+    b = ((values >> 16) & 0xff).tolist()
+    c = ((values >> 8) & 0xff).tolist()
+    d = (values & 0xff).tolist()
+    return [f'{w}.{x}.{y}.{z}' for w, x, y, z in zip(a, b, c, d)]
+
+
+def parse_mac(mac: str) -> int:
+    groups = mac.split(':')
+    if len(groups) != 6:
+        raise ValueError(f"Not a MAC address: {mac}")
+    value = 0
+    for group in groups:
+        group = int(group, 16)
+        if not 0 <= group <= 255:
+            raise ValueError(f"Not a MAC address: {mac}")
+        value = (value << 8) | group
+    return value
+
+
+def format_mac(value: int, style: str) -> str:
+    if style == 'ec':
+        return get_mac_by_id(value & 0xffffff)
+    return ':'.join(f'{(value >> shift) & 0xff:02x}' for shift in range(40, -8, -8))
+
+
+def format_macs(values: np.ndarray, style: str) -> list:
+    return [format_mac(value, style) for value in np.asarray(values, dtype=np.uint64).tolist()]
+
+
+def smallest_int_dtype(values: list) -> str:
+    if not values:
+        return 'uint16'
+    low = min(values)
+    high = max(values)
+    if low >= 0:
+        for dtype in ('uint16', 'uint32', 'uint64'):
+            if high <= np.iinfo(dtype).max:
+                return dtype
+    return 'int64'
+
+
+def encode_column(values: list) -> tuple:
+    # Returns (spec, arrays) where spec describes how to decode the arrays again
+
+    if all(type(value) is int for value in values):
+        dtype = smallest_int_dtype(values)
+        return {'kind': 'int'}, {'': np.asarray(values, dtype=dtype)}
+
+    if all(type(value) is float for value in values):
+        return {'kind': 'float'}, {'': np.asarray(values, dtype=np.float64)}
+
+    if all(type(value) is str for value in values):
+        unique_values = set(values)
+
+        try:
+            packed = {value: parse_ipv4(value) for value in unique_values}
+            if all('.'.join(str((packed[value] >> shift) & 0xff) for shift in (24, 16, 8, 0)) == value for value in unique_values):
+                return {'kind': 'ipv4'}, {'': np.asarray([packed[value] for value in values], dtype=np.uint32)}
+        except ValueError:
+            pass
+
+        try:
+            packed = {value: parse_mac(value) for value in unique_values}
+            for style in ('ec', 'plain'):
+                if all(format_mac(packed[value], style) == value for value in unique_values):
+                    return {'kind': 'mac', 'style': style}, {'': np.asarray([packed[value] for value in values], dtype=np.uint64)}
+        except ValueError:
+            pass
+
+    # Fall back to a string table, JSON encoded so that any value type round trips
+    strings = [json.dumps(value) for value in values]
+    table = sorted(set(strings))
+    codes = {string: code for code, string in enumerate(table)}
+    return {'kind': 'json'}, {'': np.asarray([codes[string] for string in strings], dtype=np.uint32),
+                              '/table': np.asarray(table, dtype=str)}
+
+
+def decode_column(spec: dict, arrays: dict, start: int = None, end: int = None) -> list:
+
+    values = arrays[''][start:end]
+    kind = spec['kind']
+
+    if kind == 'int' or kind == 'float':
+        return values.tolist()
+    if kind == 'ipv4':
+        return format_ipv4(values)
+    if kind == 'mac':
+        return format_macs(values, spec['style'])
+    if kind == 'json':
+        table = arrays['/table']
+        return [json.loads(table[code]) for code in values.tolist()]
+
+    raise ValueError(f"Unknown column kind: {kind}")
+
+
+class ColumnarTrace:
+
+    def __init__(self, header: dict, coflow_offsets: np.ndarray, coflow_columns: dict, flow_columns: dict):
+        self.header = header
+        self.coflow_offsets = coflow_offsets
+        self.coflow_columns = coflow_columns
+        self.flow_columns = flow_columns
+
+    @property
+    def num_coflows(self) -> int:
+        return len(self.coflow_offsets) - 1
+
+    @property
+    def num_flows(self) -> int:
+        return int(self.coflow_offsets[-1])
+
+    def flow_column(self, name: str) -> np.ndarray:
+        return self.flow_columns[name]['']
+
+    @classmethod
+    def from_trace(cls, coflow_trace: dict) -> 'ColumnarTrace':
+
+        coflows = coflow_trace['coflows']
+        metadata = {key: value for key, value in coflow_trace.items() if key != 'coflows'}
+
+        coflow_keys = list(coflows[0].keys()) if coflows else ['flows']
+        flows = [flow for coflow in coflows for flow in coflow['flows']]
+        flow_keys = list(flows[0].keys()) if flows else []
+
+        for coflow in coflows:
+            if list(coflow.keys()) != coflow_keys:
+                raise ValueError(f"Coflow {coflow.get('coflow_id')} has different fields than the first coflow.")
+        for flow in flows:
+            if list(flow.keys()) != flow_keys:
+                raise ValueError(f"Flow {flow} has different fields than the first flow.")
+
+        coflow_offsets = np.zeros(len(coflows) + 1, dtype=np.int64)
+        coflow_offsets[1:] = np.cumsum([len(coflow['flows']) for coflow in coflows])
+
+        coflow_specs = {}
+        coflow_columns = {}
+        for key in coflow_keys:
+            if key == 'flows':
+                continue
+            coflow_specs[key], coflow_columns[key] = encode_column([coflow[key] for coflow in coflows])
+
+        flow_specs = {}
+        flow_columns = {}
+        for key in flow_keys:
+            flow_specs[key], flow_columns[key] = encode_column([flow[key] for flow in flows])
+
+        header = {
+            'format_version': FORMAT_VERSION,
+            'key_order': list(coflow_trace.keys()),
+            'metadata': metadata,
+            'coflow_keys': coflow_keys,
+            'coflow_specs': coflow_specs,
+            'flow_keys': flow_keys,
+            'flow_specs': flow_specs,
+        }
+
+        return cls(header, coflow_offsets, coflow_columns, flow_columns)
+
+    def coflow(self, index: int) -> dict:
+
+        start = int(self.coflow_offsets[index])
+        end = int(self.coflow_offsets[index + 1])
+
+        return self.build_coflows(index, index + 1, start, end)[0]
+
+    def iter_coflows(self, batch_size: int = 256):
+        # Decode a batch of coflows at a time so that only the columns stay in memory
+        for first in range(0, self.num_coflows, batch_size):
+            last = min(first + batch_size, self.num_coflows)
+            yield from self.build_coflows(first, last, int(self.coflow_offsets[first]), int(self.coflow_offsets[last]))
+
+    def build_coflows(self, first: int, last: int, start: int, end: int) -> list:
+
+        flow_keys = self.header['flow_keys']
+        flow_values = [decode_column(self.header['flow_specs'][key], self.flow_columns[key], start, end) for key in flow_keys]
+        flows = [dict(zip(flow_keys, row)) for row in zip(*flow_values)] if flow_keys else [{} for _ in range(end - start)]
+
+        coflow_values = {key: decode_column(self.header['coflow_specs'][key], self.coflow_columns[key], first, last)
+                         for key in self.coflow_columns}
+
+        coflows = []
+        for i in range(last - first):
+            flow_start = int(self.coflow_offsets[first + i]) - start
+            flow_end = int(self.coflow_offsets[first + i + 1]) - start
+            coflow = {}
+            for key in self.header['coflow_keys']:
+                coflow[key] = flows[flow_start:flow_end] if key == 'flows' else coflow_values[key][i]
+            coflows.append(coflow)
+
+        return coflows
+
+    def to_trace(self) -> dict:
+
+        coflows = list(self.iter_coflows())
+
+        coflow_trace = {}
+        for key in self.header['key_order']:
+            coflow_trace[key] = coflows if key == 'coflows' else self.header['metadata'][key]
+
+        return coflow_trace
+
+    def save(self, npz_file: str) -> str:
+
+        arrays = {
+            'header': np.asarray(json.dumps(self.header)),
+            'coflow_offsets': self.coflow_offsets,
+        }
+        for key, column in self.coflow_columns.items():
+            for suffix, array in column.items():
+                arrays[f'coflow/{key}{suffix}'] = array
+        for key, column in self.flow_columns.items():
+            for suffix, array in column.items():
+                arrays[f'flow/{key}{suffix}'] = array
+
+        with open(npz_file, 'wb') as f:
+            np.savez(f, **arrays)
+
+        return npz_file
+
+    @classmethod
+    def load(cls, npz_file: str) -> 'ColumnarTrace':
+
+        if not os.path.exists(npz_file):
+            print(f"File '{npz_file}' not found.")
+            raise FileNotFoundError
+
+        with np.load(npz_file, allow_pickle=False) as data:
+            header = json.loads(str(data['header']))
+
+            if header['format_version'] != FORMAT_VERSION:
+                raise ValueError(f"Unsupported columnar trace version {header['format_version']} in {npz_file}")
+
+            coflow_columns = {}
+            flow_columns = {}
+            for name in data.files:
+                if name.startswith('coflow/') or name.startswith('flow/'):
+                    level, rest = name.split('/', 1)
+                    key, _, suffix = rest.partition('/')
+                    columns = coflow_columns if level == 'coflow' else flow_columns
+                    columns.setdefault(key, {})['/' + suffix if suffix else ''] = data[name]
+
+            return cls(header, data['coflow_offsets'], coflow_columns, flow_columns)
+
+
+def is_columnar_trace(file_path: str) -> bool:
+    return file_path.endswith('.npz')
+
+
+def json_to_columnar(json_file: str, npz_file: str) -> str:
+
+    if not os.path.exists(json_file):
+        print(f"File '{json_file}' not found.")
+        raise FileNotFoundError
+
+    with open_file(json_file, 'r') as f:
+        coflow_trace = json.load(f)
+
+    return ColumnarTrace.from_trace(coflow_trace).save(npz_file)
+
+
+def columnar_to_json(npz_file: str, json_file: str) -> str:
+
+    coflow_trace = ColumnarTrace.load(npz_file).to_trace()
+
+    with open_file(json_file, 'w') as f:
+        json.dump(coflow_trace, f, indent=2)
+
+    return json_file
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) != 3:
+        print(f"Usage: {sys.argv[0]} <input .json|.npz> <output .npz|.json>")
+        exit(1)
+
+    input_file, output_file = sys.argv[1], sys.argv[2]
+
+    if is_columnar_trace(input_file):
+        print(f"Converted to JSON: {columnar_to_json(input_file, output_file)}")
+    else:
+        print(f"Converted to columnar trace: {json_to_columnar(input_file, output_file)}")
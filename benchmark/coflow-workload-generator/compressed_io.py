@@ -0,0 +1,128 @@
+import io
+import os
+import gzip
+import zipfile
+
+# Transparent compression of trace files
+#
+# open_file opens plain, zip, gzip and zstd files alike, the compression is taken from the file
+# name. A zip file holds one member named like the zip file without .zip, which is how the traces
+# under coflow-traces/ are shipped. The data is decompressed while it is read, so ijson parses a
+# multi-GB .json.zip as a stream and nothing is unpacked to disk. zstd needs the zstandard package.
+
+COMPRESSION_SUFFIXES = {'zip': '.zip', 'gzip': '.gz', 'zstd': '.zst'}
+
+GZIP_LEVEL = 6 # the gzip module defaults to 9, which is several times slower for a few percent
+ZSTD_LEVEL = 3
+
+
+def get_compression(file_path: str) -> str:
+    # None for an uncompressed file
+    for compression, suffix in COMPRESSION_SUFFIXES.items():
+        if file_path.endswith(suffix):
+            return compression
+    return None
+
+
+def is_compressed(file_path: str) -> bool:
+    return get_compression(file_path) is not None
+
+
+def get_compression_suffix(file_path: str) -> str:
+    compression = get_compression(file_path)
+    return COMPRESSION_SUFFIXES[compression] if compression else ''
+
+
+def strip_compression_suffix(file_path: str) -> str:
+    compression_suffix = get_compression_suffix(file_path)
+    return file_path[:-len(compression_suffix)] if compression_suffix else file_path
+
+
+def import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Reading and writing .zst files needs the zstandard package, install it with pip install zstandard.")
+    return zstandard
+
+
+class ZipMemberWriter(io.BufferedIOBase):
+
+    # Closing the member only finishes its entry, the zip file is finished when the writer is closed
+
+    def __init__(self, file_path: str, member_name: str):
+        self.zip_file = zipfile.ZipFile(file_path, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+        self.member = self.zip_file.open(member_name, 'w', force_zip64=True)
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        return self.member.write(data)
+
+    def close(self):
+        if not self.closed:
+            self.member.close()
+            self.zip_file.close()
+        super().close()
+
+
+def open_zip_member(file_path: str):
+
+    zip_file = zipfile.ZipFile(file_path)
+    member_names = [member.filename for member in zip_file.infolist() if not member.is_dir()]
+    member_name = os.path.basename(strip_compression_suffix(file_path))
+
+    if len(member_names) == 1:
+        member_name = member_names[0]
+    elif member_name not in member_names:
+        zip_file.close()
+        raise ValueError(f"Zip file '{file_path}' has {len(member_names)} files and none of them is {member_name}.")
+
+    # The member keeps the file open until it is closed itself
+    member = zip_file.open(member_name)
+    zip_file.close()
+
+    return member
+
+
+def open_binary_file(file_path: str, mode: str, compression_file_path: str):
+
+    compression = get_compression(compression_file_path)
+
+    if compression is None:
+        return open(file_path, mode + 'b')
+
+    if compression == 'gzip':
+        return gzip.open(file_path, mode + 'b', compresslevel=GZIP_LEVEL)
+
+    if compression == 'zip':
+        if mode == 'r':
+            return open_zip_member(file_path)
+        return ZipMemberWriter(file_path, os.path.basename(strip_compression_suffix(compression_file_path)))
+
+    zstandard = import_zstandard()
+    if mode == 'r':
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(file_path, 'rb'), closefd=True))
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(open(file_path, 'wb'), closefd=True)
+
+
+def open_file(file_path: str, mode: str = 'r', compression_file_path: str = None):
+    # Modes 'r', 'w', 'rb' and 'wb', text is UTF-8. The compression and the zip member name are taken
+    # from compression_file_path when it is given, a temporary file is written like the file it replaces.
+
+    if compression_file_path is None:
+        compression_file_path = file_path
+
+    if mode not in ('r', 'w', 'rb', 'wb'):
+        raise ValueError(f"Unsupported mode: {mode}")
+
+    if not is_compressed(compression_file_path):
+        return open(file_path, mode)
+
+    f = open_binary_file(file_path, mode[0], compression_file_path)
+
+    if mode.endswith('b'):
+        return f
+
+    return io.TextIOWrapper(f, encoding='utf-8')
@@ -1,13 +1,16 @@
 from scapy.all import Ether, IP, UDP, wrpcap
 from functools import lru_cache
+from collections import OrderedDict
 
 destination_mac = "00:00:00:03:00:00"
 
+PACKET_CACHE_MEMORY_BUDGET = 64 * 1024 * 1024 # bytes
+PACKET_OBJECT_OVERHEAD = 4096 # rough size of the Scapy layer objects on top of the packet bytes
+
 @lru_cache(maxsize=65000, typed=True)
 def create_ethernet_header(source_mac: str) -> Ether:
     return Ether(src=source_mac, dst=destination_mac)
 
-@lru_cache(maxsize=10, typed=True)
 def create_udp_packet(source_ip, source_port, destination_ip, destination_port, source_mac, payload_size):
     payload = b'A' * payload_size
     ethernet_header = create_ethernet_header(source_mac=source_mac)
@@ -20,17 +23,86 @@ def create_udp_packet(source_ip, source_port, destination_ip, destination_port,
     
     return packet
 
+class PacketTemplateCache:
+
+    # LRU cache of built packets keyed by flow and payload size, bounded by an estimate of the memory they use
+
+    def __init__(self, memory_budget: int = PACKET_CACHE_MEMORY_BUDGET):
+        self.memory_budget = memory_budget
+        self.packets = OrderedDict()
+        self.memory_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_packet(self, source_ip, source_port, destination_ip, destination_port, source_mac, payload_size):
+
+        key = (source_ip, source_port, destination_ip, destination_port, source_mac, payload_size)
+
+        packet = self.packets.get(key)
+        if packet is not None:
+            self.hits += 1
+            self.packets.move_to_end(key)
+            return packet
+
+        self.misses += 1
+        packet = create_udp_packet(source_ip, source_port, destination_ip, destination_port, source_mac, payload_size)
+
+        packet_memory = self.get_packet_memory(payload_size)
+        if packet_memory > self.memory_budget:
+            return packet
+
+        self.packets[key] = packet
+        self.memory_used += packet_memory
+
+        while self.memory_used > self.memory_budget:
+            (_, _, _, _, _, evicted_payload_size), _ = self.packets.popitem(last=False)
+            self.memory_used -= self.get_packet_memory(evicted_payload_size)
+            self.evictions += 1
+
+        return packet
+
+    def get_packet_memory(self, payload_size: int) -> int:
+        return payload_size + PACKET_OBJECT_OVERHEAD
+
+    def get_statistics(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'packets': len(self.packets),
+            'memory_used': self.memory_used,
+            'memory_budget': self.memory_budget
+        }
+
+packet_cache = PacketTemplateCache()
+
+def set_packet_cache_memory_budget(memory_budget: int):
+    global packet_cache
+    packet_cache = PacketTemplateCache(memory_budget)
+
+def get_packet_cache_statistics() -> dict:
+    return packet_cache.get_statistics()
+
 def generate_udp_traffic(source_ip, source_port, destination_ip, destination_port, source_mac, udp_payload):
     max_payload_size = 1458
+
+    if udp_payload <= 0:
+        return []
+
+    # All segments but the last carry a full payload and share one packet, only the tail packet differs
+    number_of_full_packets, last_payload_size = divmod(udp_payload, max_payload_size)
+
     data_packets = []
 
-    while udp_payload > 0:
-        payload_size = min(udp_payload, max_payload_size)
-        
-        packet = create_udp_packet(source_ip, source_port, destination_ip, destination_port, source_mac, payload_size)
-        
-        data_packets.append(packet)
-        udp_payload -= payload_size
+    if number_of_full_packets:
+        full_packet = packet_cache.get_packet(source_ip, source_port, destination_ip, destination_port, source_mac, max_payload_size)
+        data_packets = [full_packet] * number_of_full_packets
+
+    if last_payload_size:
+        data_packets.append(packet_cache.get_packet(source_ip, source_port, destination_ip, destination_port, source_mac, last_payload_size))
 
     return data_packets
 
@@ -1,17 +1,27 @@
 import os
-import ijson
+import heapq
+import numpy as np
 
-from scapy.all import wrpcap
+from scapy.all import PcapWriter
+from scapy.data import DLT_EN10MB
 from time import perf_counter
-from multiprocessing import Manager, Process
-
-from create_flow import generate_udp_traffic
+from multiprocessing import Process
+from multiprocessing.connection import wait
+
+from create_flow import generate_udp_traffic, set_packet_cache_memory_budget, get_packet_cache_statistics, PACKET_CACHE_MEMORY_BUDGET
+from raw_pcap_writer import RawPcapWriter, generate_udp_frames, PCAP_RECORD_HEADER
+from ipsummary_writer import IPSummaryDumpWriter, generate_udp_summary_records, SUMMARY_RECORD
+from columnar_trace import ColumnarTrace, is_columnar_trace
+from trace_index import get_trace_index, read_coflow, get_number_of_packets, MAX_PAYLOAD_SIZE
+from trace_io import iter_coflows, get_trace_name
+from compressed_io import is_compressed, COMPRESSION_SUFFIXES
+from worker_progress import WorkerProgress
+from packet_timing import LineRateClock, get_flow_start, interleave_flows, DEFAULT_LINE_RATE
 
 class CoflowTraceGenerator:
 
     def __init__(self):
-        self.manager = Manager()
-        self.counter = self.manager.Value('i', 0)
+        self.progress = None
 
     # Generate packets for each flow in the coflow
     def generate_coflow_packets(self, coflow):
@@ -30,42 +40,139 @@ class CoflowTraceGenerator:
             # Generate the packets for the flow, returns a list of packets for the flow
             packets = generate_udp_traffic(src_ip, src_port, dst_ip, dst_port, src_mac, flow_size_bytes)
 
-            yield packets
-
+            yield packets, self.get_flow_timestamps(coflow, flow, len(packets))
 
-    def generate_trace_from_json_parallel(self, pid, json_file, coflow_ids, pcap_file):
+    # Same as generate_coflow_packets, but the packets are raw frames built without Scapy
+    def generate_coflow_frames(self, coflow):
+        for flow in coflow["flows"]:
+            frames = generate_udp_frames(flow["src_ip"], int(flow["src_port"]), flow["dst_ip"], int(flow["dst_port"]), flow["src_mac"], int(flow["flow_size_bytes"]))
+            yield frames, self.get_flow_timestamps(coflow, flow, len(frames))
 
-        with open(json_file, 'r') as f:
-            coflow_items = ijson.items(f, 'coflows.item')
+    # Binary IPSummaryDump records of the packets of each flow, no payload is built
+    def generate_coflow_summary_records(self, coflow):
+        for flow in coflow["flows"]:
+            flow_size_bytes = int(flow["flow_size_bytes"])
+            timestamps = self.get_flow_timestamps(coflow, flow, -(-flow_size_bytes // MAX_PAYLOAD_SIZE) if flow_size_bytes > 0 else 0)
+            yield generate_udp_summary_records(flow["src_ip"], int(flow["src_port"]), flow["dst_ip"], int(flow["dst_port"]), flow["src_mac"], flow_size_bytes, timestamps=timestamps), timestamps
+
+    def get_flow_timestamps(self, coflow, flow, number_of_packets) -> list:
+        # The packets of the flow leave from its start time at the line rate
+        first_packet_time, interval = self.clock.schedule_flow(get_flow_start(coflow, flow))
+        return self.clock.get_packet_timestamps(first_packet_time, interval, number_of_packets)
+
+
+    def read_coflows(self, json_file, coflow_positions):
+        # coflow_positions is a set of coflow positions in the trace, in trace order they are the coflows of one worker
+        if is_columnar_trace(json_file):
+            columnar_trace = ColumnarTrace.load(json_file)
+            for position in sorted(coflow_positions):
+                yield columnar_trace.coflow(position)
+            return
+
+        # A compressed trace can not be seeked, every worker streams it and keeps its own coflows
+        if is_compressed(json_file):
+            for position, coflow in enumerate(iter_coflows(json_file)):
+                if position in coflow_positions:
+                    yield coflow
+            return
+
+        # Seek straight to the coflows of this worker using the byte ranges from the index
+        with open(json_file, 'rb') as f:
+            for position in sorted(coflow_positions):
+                _, start, end, _, _ = self.trace_index['coflows'][position]
+                yield read_coflow(f, start, end)
+
+    def generate_trace_from_json_parallel(self, pid, json_file, coflow_positions, pcap_file):
+
+        generate_packets = {
+            'scapy': self.generate_coflow_packets,
+            'raw': self.generate_coflow_frames,
+            'summary': self.generate_coflow_summary_records
+        }[self.packet_backend]
+
+        def generate_flows():
+            for coflow in self.read_coflows(json_file, coflow_positions):
+                yield from generate_packets(coflow)
+                # The packets of the coflow are generated by the time the next one is requested
+                self.progress.add_coflow(pid)
+
+        # Flows that overlap in time are interleaved, so the packets of a worker are in timestamp order
+        if self.packet_backend == 'summary':
+            yield from interleave_flows(generate_flows(), lambda records, start, end: records[start * SUMMARY_RECORD.size:end * SUMMARY_RECORD.size])
+        else:
+            yield from interleave_flows(generate_flows())
+
+        print(f"Process {pid}: Finished generating all packets to {pcap_file}")
+    
+    def generate(self, pid, json_file, coflow_positions, pcap_file):
+        self.progress.start(pid)
+        self.clock = LineRateClock(self.line_rate, self.base_timestamp)
+        trace_packets = self.generate_trace_from_json_parallel(pid, json_file, coflow_positions, pcap_file)
+        if self.packet_backend == 'raw':
+            self.save_frames_to_pcap(trace_packets, pcap_file, pid)
+        elif self.packet_backend == 'summary':
+            self.save_records_to_summary(trace_packets, pcap_file, pid)
+        else:
+            set_packet_cache_memory_budget(self.packet_cache_memory_budget)
+            self.save_trace_to_pcap(trace_packets, pcap_file, pid)
+            statistics = get_packet_cache_statistics()
+            print(f"Process {pid}: Packet cache {statistics['hits']} hits, {statistics['misses']} misses, {statistics['evictions']} evictions, hit rate {statistics['hit_rate']:.3f}")
+        self.progress.finish(pid)
+
+
+    def save_trace_to_pcap(self, trace_packets, pcap_file, pid):
+        # Same file as wrpcap, but a packet that is repeated within a flow is only serialized once
+        with PcapWriter(pcap_file, linktype=DLT_EN10MB) as writer:
+            writer.write_header(None)
+            for packets, timestamps in trace_packets:
+                raw_packets = {}
+                nr_of_bytes = 0
+                for packet, (sec, usec) in zip(packets, timestamps):
+                    raw_packet = raw_packets.get(id(packet))
+                    if raw_packet is None:
+                        raw_packet = raw_packets[id(packet)] = bytes(packet)
+                    writer.write_packet(raw_packet, sec=sec, usec=usec)
+                    nr_of_bytes += PCAP_RECORD_HEADER.size + len(raw_packet)
+                self.progress.add_packets(pid, len(packets), nr_of_bytes)
+
+    def save_frames_to_pcap(self, trace_frames, pcap_file, pid):
+        # Frames of a flow are written as soon as they are generated
+        with RawPcapWriter(pcap_file) as writer:
+            for frames, timestamps in trace_frames:
+                writer.write_frames(frames, timestamps=timestamps)
+                self.progress.add_packets(pid, len(frames), sum(map(len, frames)) + PCAP_RECORD_HEADER.size * len(frames))
+
+    def save_records_to_summary(self, trace_records, summary_file, pid):
+        with IPSummaryDumpWriter(summary_file) as writer:
+            for records, _ in trace_records:
+                writer.write_records(records)
+                self.progress.add_packets(pid, len(records) // SUMMARY_RECORD.size, len(records))
 
-            for coflow in coflow_items:
-                coflow_id = coflow['coflow_id']
-                if coflow_id in coflow_ids:
-                    print(f"Process {pid}: Generating packets for coflow {coflow_id}")
-                    yield from self.generate_coflow_packets(coflow)
-                    self.counter.value += 1
-                    print(f"Process {pid}: Finished generating packets for coflow {coflow_id}. {self.counter.value}/{self.nr_of_coflows} coflows generated.")
-        
-        print(f"Process {pid}: Finished generating all packets. Writing to pcap file {pcap_file}")
     
-    def generate(self, pid, json_file, coflow_ids, pcap_file):
-        trace_packets = self.generate_trace_from_json_parallel(pid, json_file, coflow_ids, pcap_file)
-        self.save_trace_to_pcap(trace_packets, pcap_file)
+    def run(self, json_file_path, pcap_dir, cores: int = 1, packet_backend: str = 'scapy', packet_cache_memory_budget: int = PACKET_CACHE_MEMORY_BUDGET, progress_interval: float = 5.0, line_rate: float = DEFAULT_LINE_RATE, summary_compression: str = None, base_timestamp: int = 0):
 
+        if packet_backend not in ('scapy', 'raw', 'summary'):
+            raise ValueError(f"Unknown packet backend: {packet_backend}")
 
-    def save_trace_to_pcap(self, trace_packets, pcap_file):
-        # Flatten the list of packets using a generator expression
-        flat_packets = (pkt for sublist in trace_packets for pkt in sublist)
-        
-        # Write the flattened packets to the pcap file using Scapy's wrpcap
-        wrpcap(pcap_file, flat_packets)
+        if summary_compression is not None and summary_compression not in COMPRESSION_SUFFIXES:
+            raise ValueError(f"Unknown compression: {summary_compression}")
 
-    
-    def run(self, json_file_path, pcap_dir, cores: int = 1):
+        self.packet_backend = packet_backend
+        self.packet_cache_memory_budget = packet_cache_memory_budget
+        self.line_rate = line_rate
+
+        # Packet timestamps are the flow start times from the trace counted from base_timestamp, in seconds
+        # since the epoch. It is fixed rather than the time of the run, so the same trace gives the same files.
+        self.base_timestamp = int(base_timestamp)
+
+        json_file_without_extension = get_trace_name(json_file_path)
 
-        json_file_without_extension = os.path.splitext(os.path.basename(json_file_path))[0]
+        # Index the coflow byte ranges once, the workers and the coflow count read from it
+        self.trace_index = None if is_columnar_trace(json_file_path) or is_compressed(json_file_path) else get_trace_index(json_file_path)
 
-        nr_of_coflows = self.get_number_of_coflows(json_file_path)
+        packet_counts = self.get_coflow_packet_counts(json_file_path)
+
+        nr_of_coflows = len(packet_counts)
 
         self.nr_of_coflows = nr_of_coflows
 
@@ -73,19 +180,23 @@ class CoflowTraceGenerator:
 
         print(f"\nGenerating {nr_of_coflows} coflows using {nr_of_workers} workers")
 
-        list_of_coflow_ids = self.create_2d_list(nr_of_coflows, nr_of_workers)
+        list_of_coflow_positions = self.create_weighted_partitions(packet_counts, nr_of_workers)
+
+        estimated_packets = [sum(packet_counts[position] for position in coflow_positions) for coflow_positions in list_of_coflow_positions]
 
-        print(f"\nList of coflow id for each worker:")
-        print(list_of_coflow_ids)
+        print(f"\nEstimated packets for each worker:")
+        print(estimated_packets)
+
+        self.progress = WorkerProgress(estimated_packets)
 
         process_list = []
         pcap_file_paths = []
 
-        for pid, coflow_ids in enumerate(list_of_coflow_ids):
-            pcap_file_name = f'{pid}_{json_file_without_extension}.pcap'
+        for pid, coflow_positions in enumerate(list_of_coflow_positions):
+            pcap_file_name = f'{pid}_{json_file_without_extension}.{"sum" + COMPRESSION_SUFFIXES.get(summary_compression, "") if packet_backend == "summary" else "pcap"}'
             pcap_file_paths.append(os.path.join(pcap_dir, pcap_file_name))
             pcap_file_path = os.path.join(pcap_dir, pcap_file_name)
-            process = Process(target=self.generate, args=(pid, json_file_path, coflow_ids, pcap_file_path))
+            process = Process(target=self.generate, args=(pid, json_file_path, coflow_positions, pcap_file_path))
             process_list.append(process)
 
         start = perf_counter()
@@ -94,6 +205,14 @@ class CoflowTraceGenerator:
             print(f"\nStarting process {pid}")
             process.start()
 
+        # Sample the shared counters until all workers are done
+        running = [process.sentinel for process in process_list]
+        while running:
+            for sentinel in wait(running, timeout=progress_interval):
+                running.remove(sentinel)
+            if running:
+                self.progress.print_progress(perf_counter() - start)
+
         for process in process_list:
             process.join()
 
@@ -101,32 +220,44 @@ class CoflowTraceGenerator:
 
         print(f"\nFinished generating {nr_of_coflows} coflows in {end - start} seconds")
 
+        self.progress.print_progress(end - start)
+
+        summary_file = self.progress.write_summary(os.path.join(pcap_dir, f'{json_file_without_extension}_workers.json'), pcap_file_paths, end - start, {'base_timestamp': self.base_timestamp, 'line_rate': self.line_rate})
+
+        print(f"Worker summary saved to {summary_file}")
+
         return pcap_file_paths
     
 
-    def get_number_of_coflows(self, json_file):
-            with open(json_file, 'r') as f:
-                coflow_items = ijson.items(f, 'coflows.item')
-                return sum(1 for _ in coflow_items)
-
-    def create_2d_list(self, x, y):
-        if y == 0:
-            raise ValueError("Parameter 'y' must not be zero.")
-        
-        num_lists = min(x, y)
-        step_size = x // num_lists
-        remainder = x % num_lists
-        
-        result = []
-        start = 0
-        
-        for i in range(num_lists):
-            end = start + step_size + (1 if i < remainder else 0)
-            result.append(list(range(start, end)))
-            start = end
-        
-        return result
-            
+    def get_coflow_packet_counts(self, json_file) -> list:
+        # Estimated number of packets of every coflow, in trace order
+        if is_columnar_trace(json_file):
+            columnar_trace = ColumnarTrace.load(json_file)
+            flow_packets = -(-columnar_trace.flow_column('flow_size_bytes').astype(np.int64) // MAX_PAYLOAD_SIZE)
+            coflow_of_flow = np.repeat(np.arange(columnar_trace.num_coflows), np.diff(columnar_trace.coflow_offsets))
+            return np.bincount(coflow_of_flow, weights=flow_packets, minlength=columnar_trace.num_coflows).astype(np.int64).tolist()
+
+        # No index for a compressed trace, the counts take one pass over the stream
+        if is_compressed(json_file):
+            return [sum(get_number_of_packets(flow.get('flow_size_bytes', 0)) for flow in coflow['flows']) for coflow in iter_coflows(json_file)]
+
+        return [num_packets for _, _, _, _, num_packets in get_trace_index(json_file)['coflows']]
+
+    def create_weighted_partitions(self, packet_counts: list, nr_of_workers: int) -> list:
+        # Longest processing time first: the largest coflow goes to the worker with the fewest packets so far.
+        # Returns one set of coflow positions per worker, workers without coflows are left out.
+        if nr_of_workers <= 0:
+            raise ValueError("Number of workers must be positive.")
+
+        partitions = [set() for _ in range(min(len(packet_counts), nr_of_workers))]
+        worker_loads = [(0, worker) for worker in range(len(partitions))]
+
+        for position in sorted(range(len(packet_counts)), key=lambda position: (-packet_counts[position], position)):
+            load, worker = heapq.heappop(worker_loads)
+            partitions[worker].add(position)
+            heapq.heappush(worker_loads, (load + packet_counts[position], worker))
+
+        return partitions
 
 
 if __name__ == "__main__":
@@ -1,35 +1,16 @@
-class IPv4Generator:
-    
-    def __init__(self, excluded_subnets=[]):
+import numpy as np
 
-        self.excluded_first_octets = set()
-        for subnet in excluded_subnets:
-            subnet_parts = subnet.split('.')
-            if len(subnet_parts) >= 1:
-                self.excluded_first_octets.add(subnet_parts[0])
+from create_unique_base_IP import BaseIPv4Generator
+
+
+# Same addresses as BaseIPv4Generator, from the same table of allowed first octets
+class IPv4Generator(BaseIPv4Generator):
 
     def generate_src_ipv4_address(self, x) -> str:
-        # Check if x is within the valid range
-        if x < 0:
-            raise ValueError("Value of x must be greater than or equal to 0.")
-
-        # Determine the first octet based on x and excluded subnets
-        first_octet = '1'
-        if x > 254 and len(self.excluded_first_octets) < 254:
-            possible_first_octets = set(str(i) for i in range(1, 256)) - self.excluded_first_octets
-            if possible_first_octets:
-                first_octet = min(possible_first_octets)
-
-        # Generate the IPv4 address
-        if x <= 254:
-            if first_octet in self.excluded_first_octets:
-                # Find the next available first octet
-                first_octet = min(set(str(i) for i in range(1, 256)) - self.excluded_first_octets)
-            return f'{first_octet}.1.0.{x}'
-        else:
-            third_octet = (x - 255) // 256 + 1
-            fourth_octet = (x - 255) % 256
-            return f'{first_octet}.1.{third_octet}.{fourth_octet}'
+        return self.get_unique_base_src_ip(x)
+
+    def generate_src_ipv4_addresses(self, first_x: int, count: int) -> np.ndarray:
+        return self.get_unique_base_src_ips(first_x, count)
         
 
 if __name__ == "__main__":
@@ -1,3 +1,14 @@
+import numpy as np
+
+# Addresses are allocated from a table of the allowed first octets, built when an excluded subnet
+# changes it rather than on every address. The allowed first octet is the smallest allowed one in
+# string order, '10' comes before '2'. Address x <= 254 is first.1.0.x, the addresses after that
+# fill first.second.third.fourth with third from 1 to 255 before second moves on from 1.
+
+ALL_FIRST_OCTETS = frozenset(str(i) for i in range(1, 256))
+ADDRESSES_PER_SECOND_OCTET = 255 * 256
+
+
 class BaseIPv4Generator:
     
     def __init__(self, excluded_subnets=[]):
@@ -8,34 +19,61 @@ class BaseIPv4Generator:
             if len(subnet_parts) >= 1:
                 self.excluded_first_octets.add(subnet_parts[0])
 
+        self.update_first_octets()
+
     def add_excluded_subnet(self, subnet: str):
         subnet_parts = subnet.split('.')
-        if len(subnet_parts) >= 1:
+        if len(subnet_parts) >= 1 and subnet_parts[0] not in self.excluded_first_octets:
             self.excluded_first_octets.add(subnet_parts[0])
-    
+            self.update_first_octets()
+
+    def update_first_octets(self):
+
+        possible_first_octets = ALL_FIRST_OCTETS - self.excluded_first_octets
+        smallest_first_octet = min(possible_first_octets) if possible_first_octets else None
+
+        # First octet of the addresses up to 254, None when every first octet is excluded
+        self.low_first_octet = smallest_first_octet if '1' in self.excluded_first_octets else '1'
+
+        # First octet of the addresses after 254, '1' once nearly all first octets are excluded
+        self.high_first_octet = smallest_first_octet if len(self.excluded_first_octets) < 254 and smallest_first_octet else '1'
 
     def get_unique_base_src_ip(self, x) -> str:
         # Check if x is within the valid range
         if x < 0:
             raise ValueError("Value of x must be greater than or equal to 0.")
 
-        # Determine the first octet based on x and excluded subnets
-        first_octet = '1'
-        if x > 254 and len(self.excluded_first_octets) < 254:
-            possible_first_octets = set(str(i) for i in range(1, 256)) - self.excluded_first_octets
-            if possible_first_octets:
-                first_octet = min(possible_first_octets)
-
-        # Generate the IPv4 address
         if x <= 254:
-            if first_octet in self.excluded_first_octets:
-                # Find the next available first octet
-                first_octet = min(set(str(i) for i in range(1, 256)) - self.excluded_first_octets)
-            return f'{first_octet}.1.0.{x}'
-        else:
-            third_octet = (x - 255) // 256 + 1
-            fourth_octet = (x - 255) % 256
-            return f'{first_octet}.1.{third_octet}.{fourth_octet}'
+            if self.low_first_octet is None:
+                raise ValueError("All first octets are excluded.")
+            return f'{self.low_first_octet}.1.0.{x}'
+
+        second_octet, rest = divmod(x - 255, ADDRESSES_PER_SECOND_OCTET)
+        if second_octet > 254:
+            raise ValueError("Value of x is too large for a unique IPv4 address.")
+        third_octet, fourth_octet = divmod(rest, 256)
+        return f'{self.high_first_octet}.{second_octet + 1}.{third_octet + 1}.{fourth_octet}'
+
+    def get_unique_base_src_ips(self, first_x: int, count: int) -> np.ndarray:
+        # Addresses first_x to first_x + count - 1 as packed uint32, format_ipv4 turns them into strings
+        if first_x < 0 or count < 0:
+            raise ValueError("Value of x must be greater than or equal to 0.")
+
+        x = np.arange(first_x, first_x + count, dtype=np.int64)
+        is_low = x <= 254
+
+        if self.low_first_octet is None and is_low.any():
+            raise ValueError("All first octets are excluded.")
+
+        second_octet, rest = np.divmod(np.maximum(x - 255, 0), ADDRESSES_PER_SECOND_OCTET)
+        if count and not is_low[-1] and second_octet[-1] > 254:
+            raise ValueError("Value of x is too large for a unique IPv4 address.")
+
+        first_octet = np.where(is_low, int(self.low_first_octet or 0), int(self.high_first_octet))
+        # (third octet + 1) * 256 + fourth octet is rest + 256
+        other_octets = np.where(is_low, (1 << 16) | x, ((second_octet + 1) << 16) + 256 + rest)
+
+        return ((first_octet << 24) | other_octets).astype(np.uint32)
         
 
 if __name__ == "__main__":
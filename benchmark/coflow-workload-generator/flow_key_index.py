@@ -0,0 +1,174 @@
+import numpy as np
+
+from operator import itemgetter
+from columnar_trace import parse_ipv4
+
+# Integer packed flow keys
+#
+# The (src_ip, src_port, dst_ip, dst_port) key of a flow is packed into 96 bits, the source and
+# the destination endpoint each into a uint64 as IP << 16 | port. The keys of all flows of a trace
+# are one numpy array of 16 bytes per flow instead of a set of Python tuples. The keys are packed
+# a column at a time, which is the only pass over the flow dicts. Unique, count and lookup sort the
+# keys as one uint64 of the source and the rank of the destination, a trace only has a few
+# destinations. numpy compares structured rows much slower.
+
+FLOW_KEY_DTYPE = np.dtype([('src', '<u8'), ('dst', '<u8')])
+
+PACK_CHUNK_SIZE = 1 << 16 # flows of an iterator packed at a time
+
+MAX_DESTINATION_RANKS = 1 << 16 # the source endpoint takes 48 bits
+
+
+class PackedIPs(dict):
+    # IP string to IP << 16, traces reuse a small number of IPs so each one is only parsed once
+    def __missing__(self, ip: str) -> int:
+        packed_ip = self[ip] = parse_ipv4(ip) << 16
+        return packed_ip
+
+
+def pack_flow_keys(flows: list, packed_ips: PackedIPs = None) -> np.ndarray:
+
+    if packed_ips is None:
+        packed_ips = PackedIPs()
+
+    number_of_flows = len(flows)
+    keys = np.empty(number_of_flows, dtype=FLOW_KEY_DTYPE)
+
+    for endpoint in ('src', 'dst'):
+        ips = np.fromiter(map(packed_ips.__getitem__, map(itemgetter(f'{endpoint}_ip'), flows)), dtype=np.uint64, count=number_of_flows)
+        ports = np.fromiter(map(itemgetter(f'{endpoint}_port'), flows), dtype=np.uint64, count=number_of_flows)
+        keys[endpoint] = ips | ports
+
+    return keys
+
+
+def concatenate_flow_keys(flow_keys: list) -> np.ndarray:
+    return np.concatenate([np.empty(0, dtype=FLOW_KEY_DTYPE)] + list(flow_keys))
+
+
+def is_equal_key(keys: np.ndarray, other_keys: np.ndarray) -> np.ndarray:
+    return (keys['src'] == other_keys['src']) & (keys['dst'] == other_keys['dst'])
+
+
+def get_sort_order(keys: np.ndarray) -> np.ndarray:
+    # Stable order by source and then destination, the same as np.lexsort((keys['dst'], keys['src']))
+    unique_destinations, destination_ranks = np.unique(keys['dst'], return_inverse=True)
+
+    if len(unique_destinations) > MAX_DESTINATION_RANKS:
+        return np.lexsort((keys['dst'], keys['src']))
+
+    return np.argsort((keys['src'] << np.uint64(16)) | destination_ranks.astype(np.uint64), kind='stable')
+
+
+class FlowKeyIndex:
+
+    def __init__(self, keys: np.ndarray):
+        # One key per flow, in trace order
+        self.keys = keys
+        self.sorted_unique_keys = None
+        self.number_of_unique_keys = None
+
+    @classmethod
+    def from_coflows(cls, coflows, packed_ips: PackedIPs = None) -> 'FlowKeyIndex':
+        # Coflows can be an iterator, only the packed keys and the flows of one chunk are kept
+
+        if packed_ips is None:
+            packed_ips = PackedIPs()
+
+        flow_keys = []
+        flows = []
+        for coflow in coflows:
+            flows.extend(coflow['flows'])
+            if len(flows) >= PACK_CHUNK_SIZE:
+                flow_keys.append(pack_flow_keys(flows, packed_ips))
+                flows = []
+        flow_keys.append(pack_flow_keys(flows, packed_ips))
+
+        return cls(concatenate_flow_keys(flow_keys))
+
+    @classmethod
+    def from_trace(cls, coflow_trace: dict, packed_ips: PackedIPs = None) -> 'FlowKeyIndex':
+        return cls.from_coflows(coflow_trace['coflows'], packed_ips)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def build(self):
+
+        if self.sorted_unique_keys is not None:
+            return
+
+        # The order is stable, so equal keys stay in trace order and the first of every run is its first appearance
+        order = get_sort_order(self.keys)
+        sorted_keys = self.keys[order]
+
+        is_run_start = np.ones(len(sorted_keys), dtype=bool)
+        is_run_start[1:] = ~is_equal_key(sorted_keys[1:], sorted_keys[:-1])
+        self.run_starts = np.flatnonzero(is_run_start)
+        self.sorted_unique_keys = sorted_keys[self.run_starts]
+        del sorted_keys
+
+        # Unique keys are numbered by their first appearance in the trace
+        self.appearance_order = np.argsort(order[self.run_starts], kind='stable')
+        self.flow_ids_of_sorted_unique = np.empty(len(self.run_starts), dtype=np.int64)
+        self.flow_ids_of_sorted_unique[self.appearance_order] = np.arange(len(self.run_starts))
+
+        self.flow_ids = np.empty(len(self.keys), dtype=np.int64)
+        self.flow_ids[order] = self.flow_ids_of_sorted_unique[np.cumsum(is_run_start) - 1]
+
+    def count_unique(self) -> int:
+
+        if self.sorted_unique_keys is not None:
+            return len(self.sorted_unique_keys)
+
+        # Counting only needs the sorted keys, not the numbering that build adds
+        if self.number_of_unique_keys is None:
+            sorted_keys = self.keys[get_sort_order(self.keys)]
+            self.number_of_unique_keys = int(np.count_nonzero(~is_equal_key(sorted_keys[1:], sorted_keys[:-1]))) + bool(len(sorted_keys))
+
+        return self.number_of_unique_keys
+
+    def get_unique_keys(self) -> np.ndarray:
+        # In the order they first appear in the trace
+        self.build()
+        return self.sorted_unique_keys[self.appearance_order]
+
+    def get_counts(self) -> np.ndarray:
+        # Number of flows with each unique key, in the order of get_unique_keys
+        self.build()
+        return np.diff(np.append(self.run_starts, len(self.keys)))[self.appearance_order]
+
+    def get_flow_ids(self) -> np.ndarray:
+        # The number of the unique key of every flow, in trace order
+        self.build()
+        return self.flow_ids
+
+    def lookup(self, keys: np.ndarray) -> np.ndarray:
+        # The numbers of the given keys, -1 for keys that are not in the index
+        self.build()
+
+        keys = np.asarray(keys, dtype=FLOW_KEY_DTYPE)
+        number_of_unique_keys = len(self.sorted_unique_keys)
+
+        # Sorted together with the unique keys, a looked up key comes right after the unique key equal to it,
+        # the order is stable and the unique keys come first
+        merged_keys = np.concatenate((self.sorted_unique_keys, keys))
+        order = get_sort_order(merged_keys)
+
+        # The last unique key at or before every position of the merged order
+        positions = np.where(order < number_of_unique_keys, np.arange(len(order)), -1)
+        last_unique = np.maximum.accumulate(positions) if len(positions) else positions
+
+        looked_up_positions = np.flatnonzero(order >= number_of_unique_keys)
+        looked_up = order[looked_up_positions] - number_of_unique_keys
+        candidates = order[np.maximum(last_unique[looked_up_positions], 0)]
+
+        found = (last_unique[looked_up_positions] >= 0) & is_equal_key(merged_keys[candidates], keys[looked_up])
+
+        flow_ids = np.full(len(keys), -1, dtype=np.int64)
+        flow_ids[looked_up[found]] = self.flow_ids_of_sorted_unique[candidates[found]]
+
+        return flow_ids
+
+    def contains(self, keys: np.ndarray) -> np.ndarray:
+        return self.lookup(keys) >= 0
@@ -2,10 +2,12 @@ import numpy as np
 from scipy.interpolate import CubicSpline
 
 class CDFGenerator:
-    def __init__(self, cdf_file_path):
+    def __init__(self, cdf_file_path, lookup_table_size: int = None):
         self.cdf_file_path = cdf_file_path
         self.x_values, self.y_values = self.read_cdf()
         self.cubic_spline = CubicSpline(self.y_values, self.x_values)
+        # Optional dense inverse-CDF table, sampled with linear interpolation instead of evaluating the spline
+        self.lookup_table = self.create_lookup_table(lookup_table_size) if lookup_table_size else None
 
     def read_cdf(self):
         data = np.loadtxt(self.cdf_file_path)
@@ -13,20 +15,39 @@ class CDFGenerator:
         y_values = data[:, 1]
         return x_values, y_values
 
+    def create_lookup_table(self, lookup_table_size: int) -> np.ndarray:
+        if lookup_table_size < 2:
+            raise ValueError("Lookup table needs at least 2 entries.")
+        # Byte sizes at evenly spaced probabilities, so the entry for a probability is found without a search
+        return self.cubic_spline(np.linspace(0.0, 1.0, lookup_table_size))
+
+    def lookup_byte_sizes(self, rand_values: np.ndarray) -> np.ndarray:
+        positions = rand_values * (len(self.lookup_table) - 1)
+        indices = np.minimum(positions.astype(np.int64), len(self.lookup_table) - 2)
+        fractions = positions - indices
+        lower = self.lookup_table[indices]
+        return lower + fractions * (self.lookup_table[indices + 1] - lower)
+
     def generate_byte_size(self):
         rand_value = np.random.rand()
         byte_size = self.cubic_spline(rand_value)
         return int(byte_size)
 
+    def generate_byte_sizes(self, n: int, random_state=np.random) -> np.ndarray:
+        # Same random draws as n calls to generate_byte_size, the spline is evaluated once over all of them
+        rand_values = random_state.rand(n)
+        if self.lookup_table is not None:
+            byte_sizes = self.lookup_byte_sizes(rand_values)
+        else:
+            byte_sizes = self.cubic_spline(rand_values)
+        return byte_sizes.astype(np.int64)
+
 if __name__ == "__main__":
     cdf_generator = CDFGenerator("Facebook_HadoopDist_All.txt")
 
     nr_of_numbers = 2853364
 
-    byte_sizes = []
-
-    for _ in range(nr_of_numbers):
-        byte_sizes.append(cdf_generator.generate_byte_size())
+    byte_sizes = cdf_generator.generate_byte_sizes(nr_of_numbers)
 
     print(f"Min: {np.min(byte_sizes)}")
     print(f"Max: {np.max(byte_sizes)}")
@@ -0,0 +1,97 @@
+import math
+import numpy as np
+
+# HyperLogLog sketch for approximate distinct counts
+#
+# The sketch keeps 2^precision registers of one byte, whatever the number of values added. Values
+# are integers, hashed with the splitmix64 finalizer so that sketches built in different processes
+# agree and can be merged by taking the maximum of every register. The relative standard error of
+# the estimate is about 1.04 / sqrt(2^precision).
+
+MIN_PRECISION = 4
+MAX_PRECISION = 18
+
+BATCH_SIZE = 1 << 16 # values are collected and added to the registers in batches of at least this many
+
+
+def hash_values(values: np.ndarray) -> np.ndarray:
+    # splitmix64 finalizer, uint64 arithmetic wraps around
+    z = np.asarray(values, dtype=np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+def get_bit_lengths(values: np.ndarray) -> np.ndarray:
+    # frexp is exact for integers below 2^53, so the two 32 bit halves are handled apart
+    high = (values >> np.uint64(32)).astype(np.float64)
+    low = (values & np.uint64(0xffffffff)).astype(np.float64)
+    return np.where(high > 0, 32 + np.frexp(high)[1], np.frexp(low)[1])
+
+
+def get_precision(error: float) -> int:
+    if not 0 < error < 1:
+        raise ValueError("Cardinality error must be between 0 and 1.")
+    precision = math.ceil(2 * math.log2(1.04 / error))
+    return min(max(precision, MIN_PRECISION), MAX_PRECISION)
+
+
+class HyperLogLog:
+
+    def __init__(self, error: float = 0.01):
+        self.precision = get_precision(error)
+        self.registers = np.zeros(1 << self.precision, dtype=np.uint8)
+        self.pending = []
+        self.number_of_pending = 0
+
+    def add(self, values: np.ndarray):
+        # Adding a few values at a time to the registers costs more than the values themselves
+        self.pending.append(np.asarray(values, dtype=np.uint64))
+        self.number_of_pending += len(self.pending[-1])
+        if self.number_of_pending >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+
+        hashes = hash_values(np.concatenate(self.pending)) if self.pending else np.empty(0, dtype=np.uint64)
+        self.pending = []
+        self.number_of_pending = 0
+        if not len(hashes):
+            return
+
+        # The first bits of the hash pick the register, the register keeps the highest position of the first one bit in the rest
+        register_indexes = (hashes >> np.uint64(64 - self.precision)).astype(np.int64)
+        ranks = (64 - self.precision + 1 - get_bit_lengths(hashes & np.uint64((1 << (64 - self.precision)) - 1))).astype(np.uint8)
+
+        np.maximum.at(self.registers, register_indexes, ranks)
+
+    def merge(self, other: 'HyperLogLog'):
+        if other.precision != self.precision:
+            raise ValueError("Only sketches with the same precision can be merged.")
+        self.flush()
+        other.flush()
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self) -> int:
+
+        self.flush()
+
+        number_of_registers = len(self.registers)
+
+        if number_of_registers == 16:
+            alpha = 0.673
+        elif number_of_registers == 32:
+            alpha = 0.697
+        elif number_of_registers == 64:
+            alpha = 0.709
+        else:
+            alpha = 0.7213 / (1 + 1.079 / number_of_registers)
+
+        estimate = alpha * number_of_registers ** 2 / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+
+        # Linear counting is more accurate while many registers are still empty
+        empty_registers = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * number_of_registers and empty_registers:
+            estimate = number_of_registers * math.log(number_of_registers / empty_registers)
+
+        return int(round(estimate))
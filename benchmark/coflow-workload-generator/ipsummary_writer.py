@@ -0,0 +1,90 @@
+import time
+import struct
+import socket
+
+from compressed_io import open_file
+from raw_pcap_writer import mac_to_bytes, DESTINATION_MAC, MAX_PAYLOAD_SIZE, ETHERTYPE_IPV4, IP_PROTO_UDP, IP_HEADER_LENGTH, UDP_HEADER_LENGTH
+
+# Writer for Click's binary IPSummaryDump format (.sum)
+#
+# The replay setup only reads these fields with FromIPSummaryDump, so the records are written
+# straight from the trace, the same as ToIPSummaryDump(BINARY true, FIELDS ...) would write them
+# for the pcap of the trace. No payload is ever built.
+
+SUMMARY_FIELDS = ['timestamp', 'eth_src', 'eth_dst', 'ip_src', 'ip_dst', 'sport', 'dport', 'ip_len', 'ip_proto', 'eth_type']
+
+SUMMARY_HEADER = '!IPSummaryDump 1.3\n!creator "coflow-workload-generator"\n!data ' + ' '.join(SUMMARY_FIELDS) + '\n!binary\n'
+
+# Every binary record starts with its length in bytes, the length field included
+SUMMARY_RECORD = struct.Struct('!III6s6s4s4sHHIBH')
+
+
+class UDPSummaryTemplate:
+
+    # Constant fields of the records of one flow
+
+    def __init__(self, source_ip: str, source_port: int, destination_ip: str, destination_port: int, source_mac: str):
+        self.source_mac = mac_to_bytes(source_mac)
+        self.destination_mac = mac_to_bytes(DESTINATION_MAC)
+        self.source_ip = socket.inet_aton(source_ip)
+        self.destination_ip = socket.inet_aton(destination_ip)
+        self.source_port = source_port
+        self.destination_port = destination_port
+
+    def create_record(self, payload_size: int, sec: int, usec: int) -> bytes:
+
+        if payload_size > MAX_PAYLOAD_SIZE:
+            raise RuntimeError("Packet length is above MTU of 1500 bytes")
+
+        ip_length = IP_HEADER_LENGTH + UDP_HEADER_LENGTH + payload_size
+
+        return SUMMARY_RECORD.pack(SUMMARY_RECORD.size, sec, usec, self.source_mac, self.destination_mac, self.source_ip, self.destination_ip,
+                                   self.source_port, self.destination_port, ip_length, IP_PROTO_UDP, ETHERTYPE_IPV4)
+
+
+def generate_udp_summary_records(source_ip, source_port, destination_ip, destination_port, source_mac, udp_payload, timestamp: float = None, timestamps: list = None) -> bytes:
+    # Records of the packets create_flow.generate_udp_traffic would build. timestamps has a (sec, usec)
+    # pair for every packet, otherwise all records get the same timestamp.
+
+    if udp_payload <= 0:
+        return b''
+
+    template = UDPSummaryTemplate(source_ip, source_port, destination_ip, destination_port, source_mac)
+
+    number_of_full_packets, last_payload_size = divmod(udp_payload, MAX_PAYLOAD_SIZE)
+
+    if timestamps is not None:
+        payload_sizes = [MAX_PAYLOAD_SIZE] * number_of_full_packets + ([last_payload_size] if last_payload_size else [])
+        return b''.join(template.create_record(payload_size, sec, usec) for payload_size, (sec, usec) in zip(payload_sizes, timestamps))
+
+    if timestamp is None:
+        timestamp = time.time()
+
+    sec = int(timestamp)
+    usec = int(round((timestamp - sec) * 1000000))
+
+    records = template.create_record(MAX_PAYLOAD_SIZE, sec, usec) * number_of_full_packets
+    if last_payload_size:
+        records += template.create_record(last_payload_size, sec, usec)
+
+    return records
+
+
+class IPSummaryDumpWriter:
+
+    def __init__(self, summary_file: str):
+        self.summary_file = summary_file
+
+    def __enter__(self):
+
+        # Click's FromIPSummaryDump reads gzip compressed summaries itself
+        self.f = open_file(self.summary_file, 'wb')
+        self.f.write(SUMMARY_HEADER.encode('ascii'))
+
+        return self
+
+    def write_records(self, records: bytes):
+        self.f.write(records)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.f.close()
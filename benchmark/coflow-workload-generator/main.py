@@ -6,28 +6,93 @@ from pathlib import Path
 from time import perf_counter
 
 from merge_pcaps import merge_pcap_files
-import trace_producer, parse_trace, add_ports_to_trace, add_flow_size_JSON, create_pcap_file_CDF, add_IPs_JSON, add_MAC_JSON, adjust_coflowiness, copy_file, add_date, adjust_mean, uppdate_metadata
+import stage_cache, stage_profiler, trace_producer, parse_trace, add_ports_to_trace, add_flow_size_JSON, create_pcap_file_CDF, add_IPs_JSON, add_MAC_JSON, adjust_coflowiness, copy_file, add_date, adjust_mean, uppdate_metadata, remove_flows, trace_io, packet_timing, trace_metadata
 
 
 class CreateCoflowTrace:
 
-    def run(self, coflows: int, NUM_PODS: int, coflowiness: float, unique_flows: int, load_factor: float, cores: int, flow_size_distribution_file_path: str, merge: bool):
+    def __init__(self):
+        self.stage_cache = None
+        self.cardinality_error = None
+        self.profiler = None
+
+    def run(self, coflows: int, NUM_PODS: int, coflowiness: float, unique_flows: int, load_factor: float, cores: int, flow_size_distribution_file_path: str, merge: bool, pipeline: bool = False, debug_snapshots: bool = False, streaming: bool = False, packet_backend: str = 'scapy', line_rate: float = packet_timing.DEFAULT_LINE_RATE, enrichment_workers: int = 0, seed: int = 0, stage_cache_dir: str = None, stage_cache_size: int = stage_cache.DEFAULT_STAGE_CACHE_SIZE, coflowiness_sweep: list = None, cardinality_error: float = None, summary_compression: str = None, base_timestamp: int = 0, profile: bool = False, profile_top_functions: int = 0, profile_traced_memory: bool = False):
 
         # Check if the directories exist
         self.check_if_dirs_exists()
 
-        print(f'\nStarting to generate a trace with {NUM_PODS} pods, coflowiness {coflowiness}, {unique_flows} max unique flows, and flow size distribution {os.path.basename(flow_size_distribution_file_path)}')
+        # Reuse the output of every stage whose inputs, parameters and seed did not change
+        self.stage_cache = stage_cache.StageCache(stage_cache_dir, stage_cache_size, seed) if stage_cache_dir else None
+
+        # None counts the unique values in the metadata exactly, otherwise they are HyperLogLog estimates
+        self.cardinality_error = cardinality_error
+
+        # Time and memory of every stage, written next to the complete traces
+        self.profiler = stage_profiler.StageProfiler(profile_top_functions, profile_traced_memory) if profile else None
+
+        print(f'\nStarting to generate a trace with {NUM_PODS} pods, coflowiness {coflowiness_sweep or coflowiness}, {unique_flows} max unique flows, and flow size distribution {os.path.basename(flow_size_distribution_file_path)}')
 
         print(f'\nRunning Sincronia trace producer with {coflows} coflows, ALPHA=FB-UP, and load factor {load_factor}')
 
-        path_to_sincronia_trace = trace_producer.run(NUM_COFLOWS=coflows, ALPHA='FB-UP', LOAD_FACTOR=load_factor)
+        fb_trace_key = stage_cache.hash_file('coflow-benchmark-trace.txt') if self.stage_cache else None
+
+        path_to_sincronia_trace, trace_key = self.run_stage('trace_producer', {'coflows': coflows, 'ALPHA': 'FB-UP', 'load_factor': load_factor}, [fb_trace_key],
+                                                            lambda: trace_producer.run(NUM_COFLOWS=coflows, ALPHA='FB-UP', LOAD_FACTOR=load_factor),
+                                                            sidecar_suffixes=(parse_trace.FLOW_STARTS_SUFFIX,), input_file_paths=['coflow-benchmark-trace.txt'])
 
         print(f'\nPath to Sincronia trace file: {path_to_sincronia_trace}')
 
+        if coflowiness_sweep:
+            complete_json_traces = self.build_coflowiness_sweep(path_to_sincronia_trace, NUM_PODS, coflowiness_sweep, unique_flows, flow_size_distribution_file_path, enrichment_workers, seed, trace_key)
+        elif pipeline:
+            complete_json_traces = [self.build_trace_in_memory(path_to_sincronia_trace, NUM_PODS, coflowiness, unique_flows, flow_size_distribution_file_path, debug_snapshots, enrichment_workers, seed, trace_key)]
+        else:
+            complete_json_traces = [self.build_trace_from_files(path_to_sincronia_trace, NUM_PODS, coflowiness, unique_flows, flow_size_distribution_file_path, streaming, enrichment_workers, seed, trace_key)]
+
+        for complete_json_trace in complete_json_traces:
+            self.generate_pcaps(complete_json_trace, cores, merge, packet_backend, line_rate, summary_compression, base_timestamp)
+
+        if self.profiler is not None:
+            parameters = {'coflows': coflows, 'NUM_PODS': NUM_PODS, 'coflowiness': coflowiness_sweep or coflowiness, 'unique_flows': unique_flows, 'load_factor': load_factor, 'cores': cores,
+                          'flow_size_distribution': os.path.basename(flow_size_distribution_file_path), 'pipeline': pipeline, 'streaming': streaming, 'packet_backend': packet_backend,
+                          'enrichment_workers': enrichment_workers, 'seed': seed, 'stage_cache': bool(stage_cache_dir), 'cardinality_error': cardinality_error}
+            self.profiler.print_summary()
+            for complete_json_trace in complete_json_traces:
+                report_file_path = self.profiler.save_report(os.path.join(self.complete_json_dir, f'{Path(complete_json_trace).stem}_profile.json'), parameters)
+                print(f'\nProfiling report saved to: {report_file_path}')
+
+
+    def generate_pcaps(self, complete_json_trace: str, cores: int, merge: bool, packet_backend: str, line_rate: float, summary_compression: str = None, base_timestamp: int = 0):
+
+        # Generate the pcap file
+    
+        print(f"\nGenerating pcap file from {complete_json_trace}\n")
+
+        pcap_file_paths = self.profile_stage('pcap', lambda: create_pcap_file_CDF.CoflowTraceGenerator().run(complete_json_trace, self.pcap_dir, cores, packet_backend, line_rate=line_rate, summary_compression=summary_compression, base_timestamp=base_timestamp), [complete_json_trace])
+
+        for i, pcap_file_path in enumerate(pcap_file_paths):
+            print(f"\nPcap file {i} saved to: {pcap_file_path}")
+            print(f"Size of pcap file {i}: {humanize.naturalsize(os.path.getsize(pcap_file_path))}\n")
+        
+        if merge and len(pcap_file_paths) > 1 and packet_backend == 'summary':
+            print("Merging is only supported for pcap files, the summary files are left as they are.\n")
+        elif merge and len(pcap_file_paths) > 1:
+            filename_without_extension = Path(complete_json_trace).stem
+            merged_pcap_file_path = f'{os.path.join(self.pcap_dir, f"merged_{os.path.basename(filename_without_extension)}.pcap")}'
+            # The packets already carry the flow arrival times, so the worker files are merged without offsets
+            output_file = self.profile_stage('merge', lambda: merge_pcap_files(pcap_file_paths, merged_pcap_file_path, time_offsets=[0] * len(pcap_file_paths)), pcap_file_paths)
+            print(f"Size of merged pcap file: {humanize.naturalsize(os.path.getsize(output_file))}\n")
+
+
+    def build_trace_from_files(self, path_to_sincronia_trace: str, NUM_PODS: int, coflowiness: float, unique_flows: int, flow_size_distribution_file_path: str, streaming: bool = False, enrichment_workers: int = 0, seed: int = 0, trace_key: str = None) -> str:
+
+        # With a stage cache every stage is keyed by the key of the stage before it, trace_key is the key of the Sincronia trace
+        sharded = bool(enrichment_workers) and not streaming
+
         print(f'\nParsing the trace file: {path_to_sincronia_trace}')
         
         # Parse the trace
-        json_coflow_trace_file_path = parse_trace.ParseTrace().run(path_to_sincronia_trace, self.json_parsed_dir)
+        json_coflow_trace_file_path, key = self.run_stage('parse', {}, [trace_key], lambda: parse_trace.ParseTrace().run(path_to_sincronia_trace, self.json_parsed_dir), input_file_paths=[path_to_sincronia_trace])
 
         print(f"\nTrace parsed to JSON: {json_coflow_trace_file_path}")
 
@@ -35,7 +100,7 @@ class CreateCoflowTrace:
 
         print(f"\nAdjusting mean coflow length to 100 in {json_coflow_trace_file_path}")
 
-        json_coflow_trace_file_path_with_mean = adjust_mean.AdjustMean().run(json_coflow_trace_file_path, self.mean_dir)
+        json_coflow_trace_file_path_with_mean, key = self.run_stage('mean', {}, [key], lambda: adjust_mean.AdjustMean().run(json_coflow_trace_file_path, self.mean_dir), input_file_paths=[json_coflow_trace_file_path])
 
         print(f"\nMean adjusted to 100 and saved to {json_coflow_trace_file_path_with_mean}")
                   
@@ -43,37 +108,40 @@ class CreateCoflowTrace:
 
         print(f"\nAdding ports to file: {json_coflow_trace_file_path_with_mean}")
 
-        json_coflow_trace_file_path_with_ports = add_ports_to_trace.AddPortsToCoflowTrace().run(json_coflow_trace_file_path_with_mean, self.json_port_dir)
+        json_coflow_trace_file_path_with_ports, key = self.run_stage('ports', {'sharded': sharded}, [key], lambda: add_ports_to_trace.AddPortsToCoflowTrace().run(json_coflow_trace_file_path_with_mean, self.json_port_dir, streaming=streaming, workers=enrichment_workers, seed=seed), input_file_paths=[json_coflow_trace_file_path_with_mean])
     
         print(f'\nPorts added to trace and saved to {json_coflow_trace_file_path_with_ports}')
 
         print(f'\nAdding IPs and base flows to {json_coflow_trace_file_path_with_ports}')
 
-        json_coflow_trace_file_path_with_IPs = add_IPs_JSON.AddIPsToCoflowTrace().run(json_coflow_trace_file_path_with_ports, self.ip_dir, NUM_PODS=NUM_PODS)
+        json_coflow_trace_file_path_with_IPs, key = self.run_stage('IPs', {'NUM_PODS': NUM_PODS, 'sharded': sharded}, [key], lambda: add_IPs_JSON.AddIPsToCoflowTrace().run(json_coflow_trace_file_path_with_ports, self.ip_dir, NUM_PODS=NUM_PODS, streaming=streaming, workers=enrichment_workers, seed=seed), input_file_paths=[json_coflow_trace_file_path_with_ports])
 
         print(f'\nIPs and base flows added to trace and saved to {json_coflow_trace_file_path_with_IPs}')
 
         print(f'\nAdjusting coflowiness to {coflowiness} in {json_coflow_trace_file_path_with_IPs}')
 
-        json_coflow_trace_file_path_with_adjusted_coflowiness = adjust_coflowiness.AdjustCoflowiness().run(json_coflow_trace_file_path_with_IPs, self.coflowiness_dir, coflowiness, unique_flows)
+        json_coflow_trace_file_path_with_adjusted_coflowiness, key = self.run_stage('coflowiness', {'coflowiness': coflowiness, 'unique_flows': unique_flows, 'cardinality_error': self.cardinality_error}, [key], lambda: adjust_coflowiness.AdjustCoflowiness().run(json_coflow_trace_file_path_with_IPs, self.coflowiness_dir, coflowiness, unique_flows, streaming=streaming, workers=enrichment_workers, cardinality_error=self.cardinality_error), input_file_paths=[json_coflow_trace_file_path_with_IPs])
 
         print(f'\nCoflowiness adjusted to {coflowiness} and saved to {json_coflow_trace_file_path_with_adjusted_coflowiness}')
 
         print(f'\nAdding MACs to {json_coflow_trace_file_path_with_adjusted_coflowiness}')
 
-        json_coflow_trace_file_path_with_MACs = add_MAC_JSON.AddMACsToCoflowTrace().run(json_coflow_trace_file_path_with_adjusted_coflowiness, self.mac_dir)
+        json_coflow_trace_file_path_with_MACs, key = self.run_stage('MACs', {'sharded': sharded}, [key], lambda: add_MAC_JSON.AddMACsToCoflowTrace().run(json_coflow_trace_file_path_with_adjusted_coflowiness, self.mac_dir, streaming=streaming, workers=enrichment_workers), input_file_paths=[json_coflow_trace_file_path_with_adjusted_coflowiness])
 
         print(f'\nMACs added to trace and saved to {json_coflow_trace_file_path_with_MACs}')
 
         print(f'\nAdding flow sizes to {json_coflow_trace_file_path_with_MACs}')
 
-        json_trace_with_flow_sizes = add_flow_size_JSON.AddSizeToCoflowTrace().run(json_coflow_trace_file_path_with_MACs, flow_size_distribution_file_path, self.flow_size_dir)
+        # The CDF is an external input, its content is part of the key
+        CDF_key = stage_cache.hash_file(flow_size_distribution_file_path) if self.stage_cache else None
+
+        json_trace_with_flow_sizes, key = self.run_stage('size', {'sharded': sharded}, [key, CDF_key], lambda: add_flow_size_JSON.AddSizeToCoflowTrace().run(json_coflow_trace_file_path_with_MACs, flow_size_distribution_file_path, self.flow_size_dir, streaming=streaming, workers=enrichment_workers, seed=seed), input_file_paths=[json_coflow_trace_file_path_with_MACs])
 
         print(f'\nFlow sizes added to trace and saved to {json_trace_with_flow_sizes}')
 
         print(f'\nUpdating metadata in {json_trace_with_flow_sizes}')
 
-        json_trace_with_updated_metadata = uppdate_metadata.UpdateMetadata().run(json_file_path=json_trace_with_flow_sizes, output_dir=self.updated_metadata_dir, NUM_PODS=NUM_PODS)
+        json_trace_with_updated_metadata, key = self.run_stage('metadata', {'NUM_PODS': NUM_PODS, 'cardinality_error': self.cardinality_error}, [key], lambda: uppdate_metadata.UpdateMetadata().run(json_file_path=json_trace_with_flow_sizes, output_dir=self.updated_metadata_dir, NUM_PODS=NUM_PODS, cardinality_error=self.cardinality_error), input_file_paths=[json_trace_with_flow_sizes])
 
         # Add date to the trace file with format %Y-%m-%d
         complete_json_trace = add_date.add_date(json_trace_with_updated_metadata)
@@ -83,21 +151,215 @@ class CreateCoflowTrace:
         # when complete_json_trace is generated, copy it to the complete_json_dir
         copy_file.copy_file_to_directory(complete_json_trace, self.complete_json_dir)
 
-        # Generate the pcap file
-    
-        print(f"\nGenerating pcap file from {complete_json_trace}\n")
+        return complete_json_trace
 
-        pcap_file_paths = create_pcap_file_CDF.CoflowTraceGenerator().run(complete_json_trace, self.pcap_dir, cores)
 
-        for i, pcap_file_path in enumerate(pcap_file_paths):
-            print(f"\nPcap file {i} saved to: {pcap_file_path}")
-            print(f"Size of pcap file {i}: {humanize.naturalsize(os.path.getsize(pcap_file_path))}\n")
-        
-        if merge and len(pcap_file_paths) > 1:
-            filename_without_extension = Path(complete_json_trace).stem
-            merged_pcap_file_path = f'{os.path.join(self.pcap_dir, f"merged_{os.path.basename(filename_without_extension)}.pcap")}'
-            output_file = merge_pcap_files(pcap_file_paths, merged_pcap_file_path)
-            print(f"Size of merged pcap file: {humanize.naturalsize(os.path.getsize(output_file))}\n")
+    def run_stage(self, stage: str, parameters: dict, inputs: list, compute, sidecar_suffixes: tuple = (), input_file_paths: list = ()) -> tuple:
+
+        # Without a stage cache every stage runs, there is no key to pass on
+        if self.stage_cache is None:
+            return self.profile_stage(stage, compute, input_file_paths), None
+
+        # Stages restored from the cache are not profiled
+        return self.stage_cache.run_stage(stage, parameters, inputs, lambda: self.profile_stage(stage, compute, input_file_paths), sidecar_suffixes)
+
+
+    def profile_stage(self, stage: str, compute, input_file_paths: list = ()):
+
+        if self.profiler is None:
+            return compute()
+
+        return self.profiler.profile(stage, compute, input_file_paths)
+
+
+    def run_trace_stage(self, stage: str, parameters: dict, inputs: list, compute, get_output_file_path, debug_snapshots: bool, input_file_paths: list = ()) -> tuple:
+
+        # run_stage for the in-memory stages, returns (trace, file path, key, True when the trace was restored from the cache).
+        # With a stage cache the trace of every stage is written to its file path to be cached, as with debug_snapshots.
+        if self.stage_cache is None:
+            coflow_trace = self.profile_stage(stage, compute, input_file_paths)
+            json_file_path = get_output_file_path()
+            self.save_snapshot(coflow_trace, json_file_path, debug_snapshots)
+            return coflow_trace, json_file_path, None, False
+
+        # The in-memory stages are keyed apart from the file based stages, their outputs are not the same files
+        return self.stage_cache.run_trace_stage(stage, {**parameters, 'in_memory': True}, inputs, lambda: (self.profile_stage(stage, compute, input_file_paths), get_output_file_path()))
+
+
+    def get_restored_metadata(self, coflow_trace: dict) -> trace_metadata.TraceMetadata:
+        # The metadata the coflowiness and MAC stages keep up to date, for a trace restored from the stage cache.
+        # Both stages leave an exact count of the unique flows in it.
+        metadata = trace_metadata.TraceMetadata.from_trace(coflow_trace, self.cardinality_error)
+        metadata.get_unique_flows(coflow_trace)
+        return metadata
+
+
+    def build_trace_in_memory(self, path_to_sincronia_trace: str, NUM_PODS: int, coflowiness: float, unique_flows: int, flow_size_distribution_file_path: str, debug_snapshots: bool, enrichment_workers: int = 0, seed: int = 0, trace_key: str = None) -> str:
+
+        # Every stage transforms the same in-memory trace, the file paths are only tracked
+        # to name the debug snapshots and the complete trace like the file based stages do
+
+        coflow_trace, json_file_path, key = self.prepare_trace_in_memory(path_to_sincronia_trace, NUM_PODS, debug_snapshots, enrichment_workers, seed, trace_key)
+
+        coflow_trace, json_file_path, metadata, key = self.adjust_coflowiness_in_memory(coflow_trace, json_file_path, coflowiness, unique_flows, debug_snapshots, enrichment_workers, key)
+
+        print(f'\nAdding flow sizes')
+
+        coflow_trace, json_file_path, key = self.add_flow_sizes_in_memory(coflow_trace, json_file_path, flow_size_distribution_file_path, debug_snapshots, enrichment_workers, seed, key)
+
+        return self.save_complete_trace_in_memory(coflow_trace, json_file_path, NUM_PODS, metadata)
+
+
+    def build_coflowiness_sweep(self, path_to_sincronia_trace: str, NUM_PODS: int, coflowiness_values: list, unique_flows: int, flow_size_distribution_file_path: str, enrichment_workers: int = 0, seed: int = 0, trace_key: str = None) -> list:
+
+        # The stages that do not depend on the coflowiness run once on one in-memory trace. The flow
+        # sizes are drawn before the variants are split off, so a flow has the same ports, IPs and size
+        # in every variant that keeps it and the variants only differ in coflowiness.
+
+        coflow_trace, json_file_path, key = self.prepare_trace_in_memory(path_to_sincronia_trace, NUM_PODS, False, enrichment_workers, seed, trace_key)
+
+        print(f'\nAdding flow sizes')
+
+        size_adder = add_flow_size_JSON.AddSizeToCoflowTrace()
+        coflow_trace, _, key = self.add_flow_sizes_in_memory(coflow_trace, json_file_path, flow_size_distribution_file_path, False, enrichment_workers, seed, key)
+
+        complete_json_traces = []
+
+        for coflowiness in coflowiness_values:
+
+            print(f'\nCreating the variant with coflowiness {coflowiness}')
+
+            variant_trace, variant_file_path, variant_metadata, _ = self.adjust_coflowiness_in_memory(self.copy_trace(coflow_trace), json_file_path, coflowiness, unique_flows, False, enrichment_workers, key)
+
+            # Named like the single trace, where the sizes are added after the MACs
+            variant_file_path = size_adder.get_output_file_path(variant_file_path, flow_size_distribution_file_path, self.flow_size_dir)
+
+            complete_json_traces.append(self.save_complete_trace_in_memory(variant_trace, variant_file_path, NUM_PODS, variant_metadata))
+
+        return complete_json_traces
+
+
+    def prepare_trace_in_memory(self, path_to_sincronia_trace: str, NUM_PODS: int, debug_snapshots: bool, enrichment_workers: int = 0, seed: int = 0, trace_key: str = None) -> tuple:
+
+        # Parses the trace and adds ports and IPs, returns the trace, the file path it is named by and its stage cache key
+
+        sharded = bool(enrichment_workers)
+
+        print(f'\nParsing the trace file in memory: {path_to_sincronia_trace}')
+
+        trace_parser = parse_trace.ParseTrace()
+        coflow_trace, json_file_path, key, _ = self.run_trace_stage('parse', {}, [trace_key], lambda: trace_parser.parse_txt_to_dict(path_to_sincronia_trace),
+                                                                    lambda: trace_parser.get_output_file_path(path_to_sincronia_trace, self.json_parsed_dir), debug_snapshots, [path_to_sincronia_trace])
+
+        print(f"\nAdjusting mean coflow length to 100")
+
+        mean_adjuster = adjust_mean.AdjustMean()
+        coflow_trace, json_file_path, key, _ = self.run_trace_stage('mean', {}, [key], lambda: mean_adjuster.adjust_mean_trace(coflow_trace),
+                                                                    lambda: mean_adjuster.get_output_file_path(json_file_path, self.mean_dir), debug_snapshots)
+
+        print(f'New mean coflow length: {mean_adjuster.get_mean_coflow_length_trace(coflow_trace)}')
+
+        print(f"\nAdding ports")
+
+        port_adder = add_ports_to_trace.AddPortsToCoflowTrace()
+        if enrichment_workers:
+            add_ports = lambda: port_adder.add_ports_to_trace_sharded(coflow_trace, enrichment_workers, seed)
+        else:
+            add_ports = lambda: port_adder.add_ports_to_trace(coflow_trace)
+        coflow_trace, json_file_path, key, _ = self.run_trace_stage('ports', {'sharded': sharded}, [key], add_ports,
+                                                                    lambda: port_adder.get_output_file_path(json_file_path, self.json_port_dir), debug_snapshots)
+
+        print(f'\nAdding IPs and base flows')
+
+        ip_adder = add_IPs_JSON.AddIPsToCoflowTrace()
+        if enrichment_workers:
+            add_IPs = lambda: ip_adder.add_IPs_to_trace_sharded(coflow_trace, NUM_PODS, enrichment_workers, seed)
+        else:
+            add_IPs = lambda: ip_adder.add_IPs_to_trace(coflow_trace, NUM_PODS=NUM_PODS)
+        coflow_trace, json_file_path, key, _ = self.run_trace_stage('IPs', {'NUM_PODS': NUM_PODS, 'sharded': sharded}, [key], add_IPs,
+                                                                    lambda: ip_adder.get_output_file_path(json_file_path, self.ip_dir), debug_snapshots)
+
+        return coflow_trace, json_file_path, key
+
+
+    def adjust_coflowiness_in_memory(self, coflow_trace: dict, json_file_path: str, coflowiness: float, unique_flows: int, debug_snapshots: bool, enrichment_workers: int = 0, key: str = None) -> tuple:
+
+        # Adjusts the coflowiness, removes flows above unique_flows and adds the MACs. Also returns the
+        # metadata these stages kept up to date, the flow sizes added afterwards do not change it.
+
+        sharded = bool(enrichment_workers)
+
+        print(f'\nAdjusting coflowiness to {coflowiness}')
+
+        coflowiness_adjuster = adjust_coflowiness.AdjustCoflowiness()
+
+        def get_coflowiness_file_path():
+            # The flows are only removed above unique_flows, which names the file
+            coflowiness_file_path = coflowiness_adjuster.get_output_file_path(json_file_path, self.coflowiness_dir, coflowiness)
+            if coflowiness_adjuster.flows_removed:
+                coflowiness_file_path = remove_flows.RemoveFlows().get_output_file_path(coflowiness_file_path, self.coflowiness_dir)
+            return uppdate_metadata.UpdateMetadata().get_output_file_path(coflowiness_file_path, self.coflowiness_dir)
+
+        coflow_trace, json_file_path, key, restored = self.run_trace_stage('coflowiness', {'coflowiness': coflowiness, 'unique_flows': unique_flows, 'sharded': sharded, 'cardinality_error': self.cardinality_error}, [key],
+                                                                           lambda: coflowiness_adjuster.run_trace(coflow_trace, coflowiness, unique_flows, workers=enrichment_workers, cardinality_error=self.cardinality_error),
+                                                                           get_coflowiness_file_path, debug_snapshots)
+        metadata = self.get_restored_metadata(coflow_trace) if restored else coflowiness_adjuster.metadata
+
+        print(f'\nAdding MACs')
+
+        mac_adder = add_MAC_JSON.AddMACsToCoflowTrace()
+        if enrichment_workers:
+            add_MACs = lambda: mac_adder.add_MACs_to_trace_sharded(coflow_trace, enrichment_workers, metadata)
+        else:
+            add_MACs = lambda: mac_adder.add_MACs_to_trace(coflow_trace, metadata)
+        coflow_trace, json_file_path, key, restored = self.run_trace_stage('MACs', {'sharded': sharded}, [key], add_MACs,
+                                                                           lambda: mac_adder.get_output_file_path(json_file_path, self.mac_dir), debug_snapshots)
+        if restored:
+            metadata = self.get_restored_metadata(coflow_trace)
+
+        return coflow_trace, json_file_path, metadata, key
+
+
+    def add_flow_sizes_in_memory(self, coflow_trace: dict, json_file_path: str, flow_size_distribution_file_path: str, debug_snapshots: bool, enrichment_workers: int = 0, seed: int = 0, key: str = None) -> tuple:
+
+        # The CDF is an external input, its content is part of the key
+        CDF_key = stage_cache.hash_file(flow_size_distribution_file_path) if self.stage_cache else None
+
+        size_adder = add_flow_size_JSON.AddSizeToCoflowTrace()
+        coflow_trace, json_file_path, key, _ = self.run_trace_stage('size', {'sharded': bool(enrichment_workers)}, [key, CDF_key],
+                                                                    lambda: size_adder.run_trace(coflow_trace, flow_size_distribution_file_path, workers=enrichment_workers, seed=seed),
+                                                                    lambda: size_adder.get_output_file_path(json_file_path, flow_size_distribution_file_path, self.flow_size_dir), debug_snapshots)
+
+        return coflow_trace, json_file_path, key
+
+
+    def save_complete_trace_in_memory(self, coflow_trace: dict, json_file_path: str, NUM_PODS: int, metadata: trace_metadata.TraceMetadata = None) -> str:
+
+        print(f'\nUpdating metadata')
+
+        metadata_updater = uppdate_metadata.UpdateMetadata()
+        coflow_trace = self.profile_stage('metadata', lambda: metadata_updater.update_metadata_trace(coflow_trace, NUM_PODS, metadata))
+        json_file_path = metadata_updater.get_output_file_path(json_file_path, self.updated_metadata_dir)
+
+        # Only the complete trace is written, directly to the complete_json_dir with the date added
+        complete_json_trace = os.path.join(self.complete_json_dir, os.path.basename(add_date.get_dated_file_path(json_file_path)))
+        self.profile_stage('save', lambda: trace_io.save_trace(coflow_trace, complete_json_trace))
+
+        print(f'\nComplete JSON trace saved to: {complete_json_trace}')
+
+        return complete_json_trace
+
+
+    def copy_trace(self, coflow_trace: dict) -> dict:
+        # The stages only replace flow values and flow lists, so copying down to the flow dicts is enough
+        return {**coflow_trace, 'coflows': [{**coflow, 'flows': [dict(flow) for flow in coflow['flows']]} for coflow in coflow_trace['coflows']]}
+
+
+    def save_snapshot(self, coflow_trace: dict, json_file_path: str, debug_snapshots: bool):
+
+        if debug_snapshots:
+            trace_io.save_trace(coflow_trace, json_file_path)
+            print(f'Debug snapshot saved to {json_file_path}')
 
     
     def check_if_dirs_exists(self):
@@ -165,6 +427,22 @@ if __name__ == "__main__":
     parser.add_argument('--flow-size-distribution', type=str, default=flow_size_distribution_file_path, help='Path to flow size distribution file')
     parser.add_argument('--cores', type=int, default=1, help='Number of cores to use. (default: 1)')
     parser.add_argument('--merge', type=bool, default=False, help='Merge pcap files. (default: False)')
+    parser.add_argument('--pipeline', action='store_true', help='Run all stages on one in-memory trace and only write the complete trace. (default: False)')
+    parser.add_argument('--debug-snapshots', action='store_true', help='With --pipeline, also write the output of every stage to its directory. (default: False)')
+    parser.add_argument('--streaming', action='store_true', help='Without --pipeline, read and write the JSON traces one coflow at a time to bound memory. (default: False)')
+    parser.add_argument('--line-rate', type=float, default=packet_timing.DEFAULT_LINE_RATE / 1e9, help='Line rate in Gbit/s at which the packets of a flow are timestamped from its start time. (default: 10)')
+    parser.add_argument('--base-timestamp', type=int, default=0, help='Time in seconds since the epoch that the flow start times of the packets are counted from. The pcaps only depend on the trace and this value. (default: 0)')
+    parser.add_argument('--enrichment-workers', type=int, default=0, help='Run the port, IP, coflowiness, MAC and size stages over shards of coflows with this many processes. The trace only depends on --seed, not on the number of workers. Ignored with --streaming. (default: 0, one coflow at a time in this process)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the per-shard RNGs used with --enrichment-workers. (default: 0)')
+    parser.add_argument('--cardinality-error', type=float, default=None, help='Report the unique IP, port, MAC and flow counts in the metadata as HyperLogLog estimates with this relative standard error. Takes a few KB instead of memory that grows with the trace. (default: exact counts)')
+    parser.add_argument('--coflowiness-sweep', type=float, nargs='+', default=None, help='Build one trace per coflowiness value in one in-memory run. The shared stages run once, so the traces only differ in coflowiness. Replaces --coflowiness. (e.g. 0.1 0.25 0.5 0.75 0.9)')
+    parser.add_argument('--stage-cache-dir', type=str, default=None, help='Cache the output of every stage keyed by its inputs, parameters and --seed, and reuse it on later runs. Only the stages after the first changed input or parameter run again. With --pipeline the trace of every stage is also written to its directory to be cached. (default: no cache)')
+    parser.add_argument('--stage-cache-size', type=float, default=stage_cache.DEFAULT_STAGE_CACHE_SIZE / 1024**3, help='Size limit of the stage cache in GiB, least recently used entries are evicted first. (default: 20)')
+    parser.add_argument('--summary-compression', type=str, default=None, choices=['zip', 'gzip', 'zstd'], help='With --packet-backend summary, write the .sum files compressed. Click reads gzip compressed summaries directly, load_trace.sh unpacks the others. (default: uncompressed)')
+    parser.add_argument('--profile', action='store_true', help='Record the wall and CPU time, peak memory, file sizes and flows per second of every stage in a JSON report next to the complete trace. (default: False)')
+    parser.add_argument('--profile-top-functions', type=int, default=0, help='With --profile, also run every stage under cProfile and keep this many functions with the highest self time (time in the function itself). (default: 0, no cProfile)')
+    parser.add_argument('--profile-traced-memory', action='store_true', help='With --profile, also record the peak memory allocated by Python in every stage with tracemalloc, which slows the stages down. (default: False)')
+    parser.add_argument('--packet-backend', type=str, default='scapy', choices=['scapy', 'raw', 'summary'], help='Build packets with Scapy, write raw frames straight into the pcap (identical frames), or write Click binary IPSummaryDump (.sum) files for replay. (default: scapy)')
 
     args = parser.parse_args()
 
@@ -176,11 +454,28 @@ if __name__ == "__main__":
     flow_size_distribution_file_path = args.flow_size_distribution
     cores = args.cores
     merge = args.merge 
-
-    if coflowiness < 0.1 or coflowiness > 0.9:
-        print("Coflowiness should be between 0 and 1.")
-        ValueError("Coflowiness should be between 0 and 1.")
-        exit(1)
+    pipeline = args.pipeline
+    debug_snapshots = args.debug_snapshots
+    streaming = args.streaming
+    packet_backend = args.packet_backend
+    line_rate = args.line_rate * 1e9
+    base_timestamp = args.base_timestamp
+    enrichment_workers = args.enrichment_workers
+    seed = args.seed
+    stage_cache_dir = args.stage_cache_dir
+    stage_cache_size = int(args.stage_cache_size * 1024**3)
+    coflowiness_sweep = args.coflowiness_sweep
+    cardinality_error = args.cardinality_error
+    summary_compression = args.summary_compression
+    profile = args.profile
+    profile_top_functions = args.profile_top_functions
+    profile_traced_memory = args.profile_traced_memory
+
+    for value in coflowiness_sweep or [coflowiness]:
+        if value < 0.1 or value > 0.9:
+            print("Coflowiness should be between 0 and 1.")
+            ValueError("Coflowiness should be between 0 and 1.")
+            exit(1)
 
     start = perf_counter()
 
@@ -192,7 +487,23 @@ if __name__ == "__main__":
         load_factor=load_factor,
         cores=cores,
         flow_size_distribution_file_path=flow_size_distribution_file_path,
-        merge=merge)
+        merge=merge,
+        pipeline=pipeline,
+        debug_snapshots=debug_snapshots,
+        streaming=streaming,
+        packet_backend=packet_backend,
+        line_rate=line_rate,
+        base_timestamp=base_timestamp,
+        enrichment_workers=enrichment_workers,
+        seed=seed,
+        stage_cache_dir=stage_cache_dir,
+        stage_cache_size=stage_cache_size,
+        coflowiness_sweep=coflowiness_sweep,
+        cardinality_error=cardinality_error,
+        summary_compression=summary_compression,
+        profile=profile,
+        profile_top_functions=profile_top_functions,
+        profile_traced_memory=profile_traced_memory)
 
     end = perf_counter()
 
@@ -1,8 +1,56 @@
 import os
-import subprocess
+import mmap
+import heapq
+import struct
 from time import perf_counter
 
-def merge_pcap_files(input_files, output_file):
+# Timestamp-ordered merge of the per-worker pcap files
+#
+# Same result as editcap -t <offset> on every file followed by mergecap, without the Wireshark
+# tools and without temporary copies. The inputs are memory mapped and only one record header
+# per file is held in memory at any time.
+
+PCAP_HEADER_SIZE = 24
+PCAP_RECORD_HEADER_SIZE = 16
+
+# magic bytes -> (byte order, timestamp ticks per second)
+PCAP_MAGICS = {
+    b'\xd4\xc3\xb2\xa1': ('<', 1000000),
+    b'\xa1\xb2\xc3\xd4': ('>', 1000000),
+    b'\x4d\x3c\xb2\xa1': ('<', 1000000000),
+    b'\xa1\xb2\x3c\x4d': ('>', 1000000000)
+}
+
+PCAP_MAGIC_MICROSECONDS = 0xa1b2c3d4
+PCAP_MAGIC_NANOSECONDS = 0xa1b23c4d
+
+def read_pcap_header(data, pcap_file):
+
+    if len(data) < PCAP_HEADER_SIZE or bytes(data[:4]) not in PCAP_MAGICS:
+        raise ValueError(f"{pcap_file} is not a pcap file")
+
+    byte_order, ticks_per_second = PCAP_MAGICS[bytes(data[:4])]
+    _, _, _, _, snaplen, linktype = struct.unpack_from(f'{byte_order}HHIIII', data, 4)
+
+    return byte_order, ticks_per_second, snaplen, linktype
+
+def iter_pcap_records(data, byte_order, ticks_per_second, offset, file_index, pcap_file):
+    # Yields (timestamp in ticks with the offset applied, file index, start, end, original length) for every record
+    record_header = struct.Struct(f'{byte_order}IIII')
+    offset_ticks = int(round(offset * ticks_per_second))
+    position = PCAP_HEADER_SIZE
+    size = len(data)
+
+    while position + PCAP_RECORD_HEADER_SIZE <= size:
+        sec, frac, captured_length, original_length = record_header.unpack_from(data, position)
+        start = position + PCAP_RECORD_HEADER_SIZE
+        end = start + captured_length
+        if end > size:
+            raise ValueError(f"{pcap_file} is truncated at byte {position}")
+        yield sec * ticks_per_second + frac + offset_ticks, file_index, start, end, original_length
+        position = end
+
+def merge_pcap_files(input_files, output_file, time_offsets=None):
 
     print(f"\nMerging pcap files: ")
     for input_file in input_files:
@@ -18,29 +66,61 @@ def merge_pcap_files(input_files, output_file):
     print(f"Output file: {os.path.basename(output_file)}\n")
     print('Merging files...')
 
-    edited_files = []
-
-    for offset, file in enumerate(input_files):
-        print(f'Editing file {os.path.basename(file)} with offset {offset}')
-        edited_file = f'{file}_offset_{offset}.pcap'
-        edited_files.append(edited_file)
-        command = ['/usr/bin/editcap', '-t', str(offset), file, edited_file]
-        subprocess.run(command, check=True)
-
-    command = ['/usr/bin/mergecap', '-w', output_file] + edited_files
+    # Worker i is shifted by i seconds, as with editcap -t i
+    if time_offsets is None:
+        time_offsets = range(len(input_files))
 
     start = perf_counter()
 
+    files = []
+    maps = []
+    records = []
+    formats = set()
+    snaplen = 0
+
     try:
-        # Run the subprocess command
-        subprocess.run(command, check=True)
+        for file_index, (file, offset) in enumerate(zip(input_files, time_offsets)):
+            print(f'Reading file {os.path.basename(file)} with offset {offset}')
+            f = open(file, 'rb')
+            files.append(f)
+            # Empty files cannot be mapped, they fail the header check below
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(file) else b''
+            maps.append(data)
+
+            byte_order, ticks_per_second, file_snaplen, linktype = read_pcap_header(data, file)
+            formats.add((ticks_per_second, linktype))
+            snaplen = max(snaplen, file_snaplen)
+            records.append(iter_pcap_records(data, byte_order, ticks_per_second, offset, file_index, file))
+
+        if len(formats) != 1:
+            raise ValueError("Input pcap files differ in link type or timestamp precision")
+
+        ticks_per_second, linktype = formats.pop()
+        magic = PCAP_MAGIC_NANOSECONDS if ticks_per_second == 1000000000 else PCAP_MAGIC_MICROSECONDS
+        record_header = struct.Struct('=IIII')
+
+        nr_of_packets = 0
+
+        with open(output_file, 'wb', buffering=1024 * 1024) as output:
+            output.write(struct.pack('=IHHIIII', magic, 2, 4, 0, 0, snaplen, linktype))
+            # Ties keep the order of the input files, like mergecap
+            for timestamp, file_index, record_start, record_end, original_length in heapq.merge(*records):
+                sec, frac = divmod(timestamp, ticks_per_second)
+                output.write(record_header.pack(sec, frac, record_end - record_start, original_length))
+                output.write(maps[file_index][record_start:record_end])
+                nr_of_packets += 1
+
         print(f'Merge completed. Output file: {output_file}')
-    except subprocess.CalledProcessError as e:
-        print(f'Error during merging: {e}')
+    finally:
+        for data in maps:
+            if isinstance(data, mmap.mmap):
+                data.close()
+        for f in files:
+            f.close()
 
     end = perf_counter()
 
-    print(f'\nMerged {len(input_files)} files in {end - start:.2f} seconds')
+    print(f'\nMerged {nr_of_packets} packets from {len(input_files)} files in {end - start:.2f} seconds')
     
     return output_file
 
@@ -0,0 +1,78 @@
+import heapq
+
+from bisect import bisect_left
+from trace_index import MAX_PAYLOAD_SIZE
+
+# Packet timestamps from the modeled flow arrivals
+#
+# Every flow starts sending at its start time from trace_producer (milliseconds from the start
+# of the trace) and its packets leave back to back at the line rate of its source host. The
+# timestamps of a flow depend on nothing but the flow, so they are the same for any number of
+# pcap workers and any split of the coflows between them. Flows that overlap in time are
+# interleaved by interleave_flows.
+
+DEFAULT_LINE_RATE = 10e9 # bits per second
+
+HEADERS_LENGTH = 42 # Ethernet, IPv4 and UDP headers of the generated frames
+MIN_FRAME_LENGTH = 60 # frames are padded to this on the wire
+ETHERNET_WIRE_OVERHEAD = 24 # FCS, preamble and inter-frame gap
+
+
+def get_flow_start(coflow: dict, flow: dict) -> float:
+    # Start time in milliseconds, traces without flow start times fall back to the coflow arrival
+    return float(flow.get('start_time', coflow['arrival_time']))
+
+
+class LineRateClock:
+
+    def __init__(self, line_rate: float = DEFAULT_LINE_RATE, base_timestamp: int = 0):
+
+        if line_rate <= 0:
+            raise ValueError("Line rate must be positive.")
+
+        self.line_rate = line_rate
+        # Whole seconds, the times within the trace are kept apart to keep microsecond precision
+        self.base_timestamp = int(base_timestamp)
+
+    def get_wire_time(self, frame_length: int) -> float:
+        return (max(frame_length, MIN_FRAME_LENGTH) + ETHERNET_WIRE_OVERHEAD) * 8 / self.line_rate
+
+    def schedule_flow(self, flow_start: float) -> tuple:
+        # Returns (time of the first packet in seconds from the start of the trace, time between packets).
+        # Every packet but the last carries a full payload, so the packets of a flow are evenly spaced.
+        return flow_start / 1000, self.get_wire_time(HEADERS_LENGTH + MAX_PAYLOAD_SIZE)
+
+    def get_packet_timestamps(self, first_packet_time: float, interval: float, number_of_packets: int) -> list:
+        # (sec, usec) of every packet of a flow
+        timestamps = []
+        for packet in range(number_of_packets):
+            sec, usec = divmod(int(round((first_packet_time + packet * interval) * 1000000)), 1000000)
+            timestamps.append((self.base_timestamp + sec, usec))
+        return timestamps
+
+
+def interleave_flows(flows, slice_packets=lambda packets, start, end: packets[start:end]):
+    # flows yields (packets, timestamps) per flow with start times that do not go backwards, like the
+    # flows of a trace in trace order. Yields (packets, timestamps) runs in timestamp order, a flow that
+    # does not overlap the others comes out as one run. slice_packets cuts a run out of the packets.
+
+    active_flows = [] # (timestamp of the next packet, flow index, position of the next packet, packets, timestamps)
+
+    def next_runs(bound):
+        # Runs of packets sent before bound
+        while active_flows and active_flows[0][0] < bound:
+            _, flow_index, start, packets, timestamps = heapq.heappop(active_flows)
+            run_bound = min(bound, active_flows[0][0]) if active_flows else bound
+            end = max(start + 1, bisect_left(timestamps, run_bound, start))
+            yield slice_packets(packets, start, end), timestamps[start:end]
+            if end < len(timestamps):
+                heapq.heappush(active_flows, (timestamps[end], flow_index, end, packets, timestamps))
+
+    for flow_index, (packets, timestamps) in enumerate(flows):
+        if not timestamps:
+            yield packets, timestamps
+            continue
+        yield from next_runs(timestamps[0])
+        heapq.heappush(active_flows, (timestamps[0], flow_index, 0, packets, timestamps))
+
+    yield from next_runs((float('inf'),))
@@ -2,20 +2,46 @@ import json
 import os
 import sys
 
+from compressed_io import open_file, get_compression_suffix, strip_compression_suffix
+
+
+# Sidecar written by trace_producer with the start time of every flow in milliseconds
+FLOW_STARTS_SUFFIX = '.starts'
+
+
+def get_flow_starts_file_path(trace_file: str) -> str:
+    # Compressed like the trace
+    return strip_compression_suffix(trace_file) + FLOW_STARTS_SUFFIX + get_compression_suffix(trace_file)
+
 
 class ParseTrace:
 
-    def parse_txt_to_json(self, file_path):
+    def read_flow_starts(self, file_path) -> list:
+        # One list of flow start times per coflow, None for traces without the sidecar
+        flow_starts_file_path = get_flow_starts_file_path(file_path)
+
+        if not os.path.exists(flow_starts_file_path):
+            return None
+
+        with open_file(flow_starts_file_path, 'r') as file:
+            return [list(map(float, line.split())) for line in file]
+
+    def parse_txt_to_dict(self, file_path) -> dict:
         data = {}
 
-        with open(file_path, 'r') as file:
+        with open_file(file_path, 'r') as file:
             # Read the first line
             num_inp_ports, num_coflows = map(int, file.readline().split())
             data['num_inp_ports'] = num_inp_ports
             data['num_coflows'] = num_coflows
             data['coflows'] = []
 
-            for _ in range(num_coflows):
+            flow_starts = self.read_flow_starts(file_path)
+
+            if flow_starts is not None and len(flow_starts) != num_coflows:
+                raise ValueError(f"Flow start times in {get_flow_starts_file_path(file_path)} do not match the coflows in {file_path}")
+
+            for coflow_index in range(num_coflows):
                 coflow_info = file.readline().split()
                 coflow_id, arrival_time, num_flows, num_sources, num_destinations = map(int, coflow_info[:5])
                 flows = []
@@ -25,6 +51,13 @@ class ParseTrace:
                     flow_source_id, flow_dest_id, flow_size = map(float, flow_info)
                     flows.append({'source_id': flow_source_id, 'dest_id': flow_dest_id})
 
+                # Without start times the packets of every flow are timestamped from the coflow arrival
+                if flow_starts is not None:
+                    if len(flow_starts[coflow_index]) != num_flows:
+                        raise ValueError(f"Coflow {coflow_id} has {num_flows} flows but {len(flow_starts[coflow_index])} start times")
+                    for flow, start_time in zip(flows, flow_starts[coflow_index]):
+                        flow['start_time'] = start_time
+
                 coflow_data = {
                     'coflow_id': coflow_id,
                     'arrival_time': arrival_time,
@@ -36,19 +69,25 @@ class ParseTrace:
 
                 data['coflows'].append(coflow_data)
 
-        return json.dumps(data, indent=2)
+        return data
+
+    def parse_txt_to_json(self, file_path):
+        return json.dumps(self.parse_txt_to_dict(file_path), indent=2)
 
+    def get_output_file_path(self, file_path, json_traces_dir) -> str:
+        base_name = os.path.splitext(os.path.basename(strip_compression_suffix(file_path)))[0]
 
-    def run(self, file_path, json_traces_dir) -> str:
-        base_name = os.path.splitext(os.path.basename(file_path))[0]
+        # create full file path, the JSON trace is compressed like the Sincronia trace
+        return os.path.join(json_traces_dir, base_name + '.json' + get_compression_suffix(file_path))
 
-        # create full file path
-        json_file_path = os.path.join(json_traces_dir, base_name + '.json')
+
+    def run(self, file_path, json_traces_dir) -> str:
+        json_file_path = self.get_output_file_path(file_path, json_traces_dir)
 
         parsed_data = self.parse_txt_to_json(file_path)
 
         # save the parsed data to a json file
-        with open(json_file_path, 'w') as json_file:
+        with open_file(json_file_path, 'w') as json_file:
             json_file.write(parsed_data)
 
         return json_file_path
\ No newline at end of file
@@ -0,0 +1,140 @@
+import time
+import struct
+import socket
+
+# Scapy-free pcap writer for the UDP traffic of create_flow
+#
+# Frames are assembled from precomputed Ethernet/IPv4/UDP header bytes and written straight
+# into the pcap stream. The bytes are the same as Scapy's Ether()/IP()/UDP()/payload with
+# the defaults used in create_flow, and the file header is the same as wrpcap writes.
+
+PCAP_MAGIC = 0xa1b2c3d4
+PCAP_SNAPLEN = 65535 # scapy MTU, the snaplen wrpcap writes
+LINKTYPE_ETHERNET = 1
+
+DESTINATION_MAC = "00:00:00:03:00:00" # same as create_flow
+MAX_PAYLOAD_SIZE = 1458 # same as generate_udp_traffic in create_flow
+
+ETHERTYPE_IPV4 = 0x0800
+IP_TTL = 64
+IP_PROTO_UDP = 17
+IP_ID = 1 # scapy default id
+IP_HEADER_LENGTH = 20
+UDP_HEADER_LENGTH = 8
+
+PAYLOAD_BYTE = 0x41 # b'A'
+PAYLOAD = bytes([PAYLOAD_BYTE]) * MAX_PAYLOAD_SIZE
+
+PCAP_HEADER = struct.Struct('=IHHIIII')
+PCAP_RECORD_HEADER = struct.Struct('=IIII')
+IP_HEADER = struct.Struct('!BBHHHBBH4s4s')
+UDP_HEADER = struct.Struct('!HHHH')
+
+
+def mac_to_bytes(mac: str) -> bytes:
+    # Accepts the unpadded "00:EC:00:0:1:f" form from add_MAC_JSON
+    return bytes(int(group, 16) for group in mac.split(':'))
+
+
+def checksum_sum(data: bytes) -> int:
+    # One's complement sum of the 16-bit big endian words, not folded
+    if len(data) % 2:
+        data += b'\x00'
+    return sum(struct.unpack(f'!{len(data) // 2}H', data))
+
+
+def fold_checksum(value: int) -> int:
+    while value >> 16:
+        value = (value & 0xffff) + (value >> 16)
+    return ~value & 0xffff
+
+
+def payload_checksum_sum(payload_size: int) -> int:
+    # Sum of the payload words without building the payload
+    word = (PAYLOAD_BYTE << 8) | PAYLOAD_BYTE
+    return word * (payload_size // 2) + (PAYLOAD_BYTE << 8) * (payload_size % 2)
+
+
+class UDPFrameTemplate:
+
+    # Header bytes and partial checksums of one flow, only the lengths and checksums
+    # change with the payload size
+
+    def __init__(self, source_ip: str, source_port: int, destination_ip: str, destination_port: int, source_mac: str):
+
+        self.source_ip = socket.inet_aton(source_ip)
+        self.destination_ip = socket.inet_aton(destination_ip)
+        self.source_port = source_port
+        self.destination_port = destination_port
+
+        self.ethernet_header = mac_to_bytes(DESTINATION_MAC) + mac_to_bytes(source_mac) + struct.pack('!H', ETHERTYPE_IPV4)
+
+        # IP header without total length and checksum
+        self.ip_checksum_sum = checksum_sum(IP_HEADER.pack(0x45, 0, 0, IP_ID, 0, IP_TTL, IP_PROTO_UDP, 0, self.source_ip, self.destination_ip))
+
+        # Pseudo header and UDP header without the UDP length, which is counted twice
+        self.udp_checksum_sum = checksum_sum(self.source_ip + self.destination_ip) + IP_PROTO_UDP + source_port + destination_port
+
+    def create_frame(self, payload_size: int) -> bytes:
+
+        if payload_size > MAX_PAYLOAD_SIZE:
+            raise RuntimeError("Packet length is above MTU of 1500 bytes")
+
+        udp_length = UDP_HEADER_LENGTH + payload_size
+        ip_length = IP_HEADER_LENGTH + udp_length
+
+        ip_checksum = fold_checksum(self.ip_checksum_sum + ip_length)
+
+        udp_checksum = fold_checksum(self.udp_checksum_sum + 2 * udp_length + payload_checksum_sum(payload_size))
+        if udp_checksum == 0:
+            udp_checksum = 0xffff
+
+        return (self.ethernet_header
+                + IP_HEADER.pack(0x45, 0, ip_length, IP_ID, 0, IP_TTL, IP_PROTO_UDP, ip_checksum, self.source_ip, self.destination_ip)
+                + UDP_HEADER.pack(self.source_port, self.destination_port, udp_length, udp_checksum)
+                + PAYLOAD[:payload_size])
+
+
+def generate_udp_frames(source_ip, source_port, destination_ip, destination_port, source_mac, udp_payload) -> list:
+    # Same packets as create_flow.generate_udp_traffic, as raw frames
+
+    template = UDPFrameTemplate(source_ip, source_port, destination_ip, destination_port, source_mac)
+
+    number_of_full_frames, last_payload_size = divmod(udp_payload, MAX_PAYLOAD_SIZE) if udp_payload > 0 else (0, 0)
+
+    frames = [template.create_frame(MAX_PAYLOAD_SIZE)] * number_of_full_frames if number_of_full_frames else []
+    if last_payload_size:
+        frames.append(template.create_frame(last_payload_size))
+
+    return frames
+
+
+class RawPcapWriter:
+
+    def __init__(self, pcap_file: str):
+        self.pcap_file = pcap_file
+
+    def __enter__(self):
+
+        self.f = open(self.pcap_file, 'wb')
+        self.f.write(PCAP_HEADER.pack(PCAP_MAGIC, 2, 4, 0, 0, PCAP_SNAPLEN, LINKTYPE_ETHERNET))
+
+        return self
+
+    def write_frames(self, frames: list, timestamp: float = None, timestamps: list = None):
+        # timestamps has a (sec, usec) pair for every frame, otherwise all frames get the same timestamp
+
+        if timestamps is None:
+            if timestamp is None:
+                timestamp = time.time()
+
+            sec = int(timestamp)
+            usec = int(round((timestamp - sec) * 1000000))
+            timestamps = [(sec, usec)] * len(frames)
+
+        for frame, (sec, usec) in zip(frames, timestamps):
+            self.f.write(PCAP_RECORD_HEADER.pack(sec, usec, len(frame), len(frame)))
+            self.f.write(frame)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.f.close()
@@ -1,11 +1,13 @@
 import os
 import sys
-import json
 import math
 import random
+import numpy as np
 
 import uppdate_metadata
-from pathlib import Path
+from trace_io import load_trace, save_trace, get_trace_suffix, get_trace_name, iter_coflows
+from flow_key_index import FlowKeyIndex
+from trace_metadata import TraceMetadata
 
 
 class RemoveFlows:
@@ -13,74 +15,21 @@ class RemoveFlows:
     def __init__(self):
         pass
      
-    def create_flow_set(self, json_file: str) -> set:
+    def create_flow_index(self, json_file: str, streaming: bool = False) -> FlowKeyIndex:
 
-        flow_set = set()
-        
-        if not os.path.exists(json_file):
-            print(f"File '{json_file}' not found.")
-            raise FileNotFoundError
-
-        with open(json_file, 'r') as f:
-            coflow_trace = json.load(f)
-
-        for coflow in coflow_trace['coflows']:
-            
-            for flow in coflow['flows']:
-                src_ip = flow['src_ip']
-                src_port = flow['src_port']
-                dst_ip = flow['dst_ip']
-                dst_port = flow['dst_port']
-                flow = (src_ip, src_port, dst_ip, dst_port)
-                flow_set.add(flow)
-
-        return flow_set
-    
-    def create_candidate_flows(self, json_file: str, flow_set: set) -> list:
-
-        with open(json_file, 'r') as f:
-            coflow_trace = json.load(f)
-
-        candidate_flows = []
-
-        for coflow in coflow_trace['coflows']:
-            
-            first_flow = True
-
-            for flow in coflow['flows']:
-                if first_flow:
-                    first_flow = False
-                    continue
-                
-                else:
-                    src_ip = flow['src_ip']
-                    src_port = flow['src_port']
-                    dst_ip = flow['dst_ip']
-                    dst_port = flow['dst_port']
-                    flow = (src_ip, src_port, dst_ip, dst_port)
-                    if flow in flow_set:
-                        candidate_flows.append(flow)
-        
-        return candidate_flows
+        # Only one coflow at a time is kept in memory
+        if streaming:
+            return FlowKeyIndex.from_coflows(iter_coflows(json_file))
 
-    def create_lists(self, candidate_flows: list) -> tuple:
-        candidate_flows_dst_port_2100 = []
-        candidate_flows_other_dst_port = []
+        coflow_trace = load_trace(json_file)
 
-        for flow in candidate_flows:
-            if flow[3] == 2100:
-                candidate_flows_dst_port_2100.append(flow)
-            else:
-                candidate_flows_other_dst_port.append(flow)
+        return FlowKeyIndex.from_trace(coflow_trace)
 
-        return candidate_flows_dst_port_2100, candidate_flows_other_dst_port
-
-
-    def remove_flows(self, json_file: str, output_file_path: str, nr_of_wanted_unique_flows: int = 193000) -> str:  
+    def remove_flows_trace(self, coflow_trace: dict, nr_of_wanted_unique_flows: int = 193000, metadata: TraceMetadata = None) -> dict:
 
-        flow_set = self.create_flow_set(json_file)
+        flow_index = FlowKeyIndex.from_trace(coflow_trace) if metadata is None else metadata.get_flow_index(coflow_trace)
 
-        nr_of_unique_flows = len(flow_set)
+        nr_of_unique_flows = flow_index.count_unique()
         print(f"Number of unique flows before removal: {nr_of_unique_flows}")
 
         if nr_of_unique_flows < nr_of_wanted_unique_flows:
@@ -92,59 +41,89 @@ class RemoveFlows:
         
         flows_to_remove = nr_of_unique_flows - nr_of_wanted_unique_flows
 
-        candidate_flows = self.create_candidate_flows(json_file, flow_set)
-
-        candidate_flows_dst_port_2100, candidate_flows_other_dst_port = self.create_lists(candidate_flows)
+        # The candidates are every flow but the first of a coflow, in trace order and with repeats,
+        # split by whether the destination port is 2100
+        coflow_sizes = np.array([len(coflow['flows']) for coflow in coflow_trace['coflows']], dtype=np.int64)
+        is_candidate = np.ones(len(flow_index), dtype=bool)
+        is_candidate[(np.cumsum(coflow_sizes) - coflow_sizes)[coflow_sizes > 0]] = False
+
+        is_base_flow = (flow_index.keys['dst'] & 0xffff) == 2100
+        candidate_flows_dst_port_2100 = flow_index.keys[is_candidate & is_base_flow]
+        candidate_flows_other_dst_port = flow_index.keys[is_candidate & ~is_base_flow]
+
+        # Sampling positions draws the same flows as sampling the candidate lists themselves
+        removal_keys = np.concatenate((
+            candidate_flows_dst_port_2100[random.sample(range(len(candidate_flows_dst_port_2100)), math.ceil(flows_to_remove/2))],
+            candidate_flows_other_dst_port[random.sample(range(len(candidate_flows_other_dst_port)), math.floor(flows_to_remove/2))]
+        ))
+
+        is_removed = FlowKeyIndex(removal_keys).contains(flow_index.keys)
+
+        is_removed_per_coflow = np.split(is_removed, np.cumsum(coflow_sizes)[:-1]) if len(coflow_sizes) else []
+        for coflow, is_flow_removed in zip(coflow_trace['coflows'], is_removed_per_coflow):
+            if not is_flow_removed.any():
+                continue
+            remaining_flows = []
+            for flow, removed in zip(coflow['flows'], is_flow_removed.tolist()):
+                if not removed:
+                    remaining_flows.append(flow)
+                elif metadata is not None:
+                    metadata.remove_flow(flow)
+            coflow['flows'] = remaining_flows
+            if metadata is not None:
+                metadata.update_coflow(coflow)
+
+        remaining_flow_index = FlowKeyIndex(flow_index.keys[~is_removed])
+        nr_of_remaining_unique_flows = remaining_flow_index.count_unique()
+        if metadata is not None:
+            metadata.set_flow_index(remaining_flow_index)
+
+        print(f"Number of unique flows after removal: {nr_of_remaining_unique_flows}")
+        print(f"Number of flows removed: {len(removal_keys)}")
+        print(f'Number of desired unique flows: {nr_of_wanted_unique_flows}')
 
-        removal_list = []
-        removal_list.extend(random.sample(candidate_flows_dst_port_2100, math.ceil(flows_to_remove/2)))
-        removal_list.extend(random.sample(candidate_flows_other_dst_port, math.floor(flows_to_remove/2)))
+        return coflow_trace
 
-        with open(json_file, 'r') as f:
-            coflow_trace = json.load(f)
-        
-        flows_to_remove = []
-        for coflow in coflow_trace['coflows']:
-            for flow in coflow['flows']:
-                src_ip = flow['src_ip']
-                src_port = flow['src_port']
-                dst_ip = flow['dst_ip']
-                dst_port = flow['dst_port']
-                flow_tuple = (src_ip, src_port, dst_ip, dst_port)
-                if flow_tuple in removal_list:
-                    flows_to_remove.append(flow_tuple)
-        
-            coflow['flows'] = [flow for flow in coflow['flows'] if (flow['src_ip'], flow['src_port'], flow['dst_ip'], flow['dst_port']) not in removal_list]
-        
-        flow_set = set()
-        
-        with open(output_file_path, 'w') as f:
-            json.dump(coflow_trace, f, indent=2)
+    def remove_flows(self, json_file: str, output_file_path: str, nr_of_wanted_unique_flows: int = 193000) -> str:  
 
-        flow_set = self.create_flow_set(output_file_path)
+        coflow_trace = load_trace(json_file)
 
-        print(f"Number of unique flows after removal: {len(flow_set)}")
-        print(f"Number of flows removed: {len(removal_list)}")
-        print(f'Number of desired unique flows: {nr_of_wanted_unique_flows}')
+        coflow_trace = self.remove_flows_trace(coflow_trace, nr_of_wanted_unique_flows)
 
-        return output_file_path
+        return save_trace(coflow_trace, output_file_path)
     
 
-    def run(self, json_file_path: str, output_dir: str, desired_number_of_flows: int = 193000) -> str:
+    def get_output_file_path(self, json_file_path: str, output_dir: str) -> str:
+
+        json_file_name_without_extension = get_trace_name(json_file_path)
+
+        output_file = f'{json_file_name_without_extension}_removed{get_trace_suffix(json_file_path)}'
+
+        return os.path.join(output_dir, output_file)
+
 
-        self.json_file_name_without_extension = Path(os.path.basename(json_file_path)).stem
+    def run_trace(self, coflow_trace: dict, desired_number_of_flows: int = 193000, NUM_PODS: int = 8, metadata: TraceMetadata = None, cardinality_error: float = None) -> dict:
 
-        output_file = f'{self.json_file_name_without_extension}_removed.json'
+        coflow_trace = self.remove_flows_trace(coflow_trace, desired_number_of_flows, metadata)
 
-        output_file_path = os.path.join(output_dir, output_file)
+        return uppdate_metadata.UpdateMetadata().update_metadata_trace(coflow_trace, NUM_PODS, metadata, cardinality_error)
 
-        output_file_path = self.remove_flows(json_file_path, output_file_path, desired_number_of_flows)
 
-        # Instantiate the UpdateMetadata class
+    def run(self, json_file_path: str, output_dir: str, desired_number_of_flows: int = 193000, cardinality_error: float = None) -> str:
+
+        # The metadata is updated in memory, so the trace is loaded and written once.
+        # The output has the same name as when the removed trace was updated as a separate file.
         update_metadata_instance = uppdate_metadata.UpdateMetadata()
 
-        # Call the run() method on the instance
-        updated_output_file_path = update_metadata_instance.run(json_file_path=output_file_path, output_dir=output_dir, NUM_PODS=8)
+        updated_output_file_path = update_metadata_instance.get_output_file_path(self.get_output_file_path(json_file_path, output_dir), output_dir)
+
+        coflow_trace = load_trace(json_file_path)
+
+        coflow_trace = self.run_trace(coflow_trace, desired_number_of_flows, NUM_PODS=8, cardinality_error=cardinality_error)
+
+        updated_output_file_path = save_trace(coflow_trace, updated_output_file_path)
+
+        print(f"Updated metadata saved to: {updated_output_file_path}")
 
         return updated_output_file_path
     
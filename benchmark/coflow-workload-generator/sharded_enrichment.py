@@ -0,0 +1,38 @@
+import zlib
+import numpy as np
+
+from multiprocessing import Pool
+
+# Sharded execution of the per-coflow enrichment stages
+#
+# The coflows are cut into shards of a fixed number of coflows and every shard draws from its own
+# RNG, seeded from the trace seed, the stage and the shard index. The state a stage carries from
+# one coflow to the next is computed for the start of every shard with a prefix scan over small
+# per-shard summaries. The output therefore only depends on the seed, not on the number of workers.
+
+SHARD_SIZE = 256 # coflows per shard
+
+
+def split_into_shards(coflows: list, shard_size: int = SHARD_SIZE) -> list:
+
+    if shard_size <= 0:
+        raise ValueError("Shard size must be positive.")
+
+    return [coflows[start:start + shard_size] for start in range(0, len(coflows), shard_size)]
+
+
+def join_shards(shards: list) -> list:
+    return [coflow for shard in shards for coflow in shard]
+
+
+def get_shard_seed(seed: int, stage: str, shard_index: int) -> int:
+    return int(np.random.SeedSequence([seed, zlib.crc32(stage.encode()), shard_index]).generate_state(1)[0])
+
+
+def map_shards(function, shard_arguments: list, workers: int) -> list:
+    # Results in shard order, with one worker the shards run in this process
+    if workers <= 1 or len(shard_arguments) <= 1:
+        return [function(*arguments) for arguments in shard_arguments]
+
+    with Pool(min(workers, len(shard_arguments))) as pool:
+        return pool.starmap(function, shard_arguments, chunksize=1)
@@ -0,0 +1,168 @@
+import os
+import json
+import random
+import shutil
+import hashlib
+import numpy as np
+
+from trace_io import load_trace, save_trace
+
+# Content-addressed cache of the outputs of the trace generation stages
+#
+# The key of a stage output is a hash of the stage, its parameters, the seed and the keys of its
+# inputs. The key of an upstream output stands in for its content, so a multi-GB intermediate trace
+# is never hashed itself, only external files like the flow size CDF are. Every stage seeds the
+# random and numpy RNGs from its key, which makes its output a function of the key. Entries are
+# evicted least recently used first once the cache grows beyond its size limit.
+
+STAGE_CACHE_VERSION = 1
+DEFAULT_STAGE_CACHE_SIZE = 20 * 1024 * 1024 * 1024 # bytes
+
+ENTRY_METADATA_FILE = 'entry.json'
+
+
+def hash_file(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class StageCache:
+
+    def __init__(self, cache_dir: str, max_size: int = DEFAULT_STAGE_CACHE_SIZE, seed: int = 0):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.seed = seed
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get_key(self, stage: str, parameters: dict, inputs: list) -> str:
+        # inputs are keys of upstream stage outputs or hashes of external files
+        description = json.dumps({'version': STAGE_CACHE_VERSION, 'stage': stage, 'parameters': parameters, 'seed': self.seed, 'inputs': inputs}, sort_keys=True)
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def get_entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def load(self, key: str) -> str:
+        # Restores the files of the entry to where the stage wrote them, returns the output file or None
+        entry_dir = self.get_entry_dir(key)
+        metadata_file = os.path.join(entry_dir, ENTRY_METADATA_FILE)
+
+        if not os.path.exists(metadata_file):
+            return None
+
+        with open(metadata_file, 'r') as f:
+            metadata = json.load(f)
+
+        for cached_file in metadata['files']:
+            file_path = cached_file['path']
+            # Skip the copy when the file has not been touched since it was cached or restored
+            if os.path.exists(file_path):
+                stat = os.stat(file_path)
+                if stat.st_size == cached_file['size'] and stat.st_mtime_ns == cached_file['mtime_ns']:
+                    continue
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            tmp_file_path = f'{file_path}.tmp'
+            shutil.copyfile(os.path.join(entry_dir, cached_file['name']), tmp_file_path)
+            os.replace(tmp_file_path, file_path)
+            cached_file['mtime_ns'] = os.stat(file_path).st_mtime_ns
+
+        # Rewriting the metadata also marks the entry as recently used
+        with open(metadata_file, 'w') as f:
+            json.dump(metadata, f, indent=2)
+
+        return metadata['output']
+
+    def store(self, key: str, stage: str, output_path: str, file_paths: list):
+
+        entry_dir = self.get_entry_dir(key)
+        tmp_entry_dir = f'{entry_dir}.tmp'
+
+        shutil.rmtree(tmp_entry_dir, ignore_errors=True)
+        os.makedirs(tmp_entry_dir)
+
+        cached_files = []
+        for index, file_path in enumerate(file_paths):
+            name = f'{index}_{os.path.basename(file_path)}'
+            shutil.copyfile(file_path, os.path.join(tmp_entry_dir, name))
+            stat = os.stat(file_path)
+            cached_files.append({'path': os.path.abspath(file_path), 'name': name, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns})
+
+        with open(os.path.join(tmp_entry_dir, ENTRY_METADATA_FILE), 'w') as f:
+            json.dump({'stage': stage, 'output': os.path.abspath(output_path), 'files': cached_files}, f, indent=2)
+
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.replace(tmp_entry_dir, entry_dir)
+
+        self.evict(keep=key)
+
+    def get_entry_size(self, entry_dir: str) -> int:
+        return sum(os.path.getsize(os.path.join(entry_dir, name)) for name in os.listdir(entry_dir))
+
+    def evict(self, keep: str = None):
+
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            entry_dir = self.get_entry_dir(key)
+            metadata_file = os.path.join(entry_dir, ENTRY_METADATA_FILE)
+            if os.path.exists(metadata_file):
+                entries.append((os.path.getmtime(metadata_file), self.get_entry_size(entry_dir), key))
+
+        cache_size = sum(size for _, size, _ in entries)
+
+        # Least recently used first, the entry that was just stored stays even if it is larger than the limit
+        for _, size, key in sorted(entries):
+            if cache_size <= self.max_size:
+                break
+            if key == keep:
+                continue
+            print(f'Evicting stage cache entry {key} ({size} bytes)')
+            shutil.rmtree(self.get_entry_dir(key), ignore_errors=True)
+            cache_size -= size
+
+    def run_stage(self, stage: str, parameters: dict, inputs: list, compute, sidecar_suffixes: tuple = ()) -> tuple:
+        # Returns (output path, key), compute runs the stage and returns its output path
+
+        key = self.get_key(stage, parameters, inputs)
+
+        output_path = self.load(key)
+        if output_path is not None:
+            print(f'Stage {stage}: reusing cached output {output_path}')
+            return output_path, key
+
+        self.seed_stage(key)
+
+        output_path = compute()
+
+        file_paths = [output_path] + [output_path + suffix for suffix in sidecar_suffixes if os.path.exists(output_path + suffix)]
+        self.store(key, stage, output_path, file_paths)
+
+        return output_path, key
+
+    def run_trace_stage(self, stage: str, parameters: dict, inputs: list, compute) -> tuple:
+        # run_stage for the in-memory stages. compute runs the stage and returns (trace, output path), the
+        # trace is written to the output path to be cached. Returns (trace, output path, key, restored).
+
+        key = self.get_key(stage, parameters, inputs)
+
+        output_path = self.load(key)
+        if output_path is not None:
+            print(f'Stage {stage}: reusing cached output {output_path}')
+            return load_trace(output_path), output_path, key, True
+
+        self.seed_stage(key)
+
+        coflow_trace, output_path = compute()
+
+        save_trace(coflow_trace, output_path)
+        self.store(key, stage, output_path, [output_path])
+
+        return coflow_trace, output_path, key, False
+
+    def seed_stage(self, key: str):
+        # The output of a stage is a function of its key
+        stage_seed = int(key[:8], 16)
+        random.seed(stage_seed)
+        np.random.seed(stage_seed)
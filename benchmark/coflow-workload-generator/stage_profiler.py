@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import pstats
+import cProfile
+import resource
+import tracemalloc
+
+from time import perf_counter
+
+from trace_io import iter_coflows
+from compressed_io import open_file, strip_compression_suffix
+
+# Per stage profiling of a trace generation run
+#
+# Every stage call is timed in wall and CPU time, the CPU time includes the workers the stage
+# started and waited for. The peak RSS of a stage is measured by resetting the peak of the process
+# before the stage, which Linux allows through /proc/self/clear_refs. The flows of a stage are the
+# flows of the trace it returns or writes, or of its input trace when it writes something else,
+# like the pcap files. They are counted after the stage, outside of its time. cProfile and
+# tracemalloc only see this process, not the workers of the sharded stages or the pcap workers.
+
+TRACE_SUFFIXES = ('.json', '.npz')
+SINCRONIA_TRACE_SUFFIX = '.txt'
+
+
+def reset_peak_rss() -> bool:
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def get_peak_rss(is_reset: bool) -> int:
+
+    if is_reset:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+
+    # Without a reset this is the peak of the whole run so far, ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def get_children_cpu_time() -> float:
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+def get_file_sizes(file_paths: list) -> int:
+    return sum(os.path.getsize(file_path) for file_path in file_paths if os.path.exists(file_path))
+
+
+def count_flows_in_file(file_path: str) -> int:
+
+    # The Sincronia trace has a header line and the number of flows of a coflow as its third number
+    if strip_compression_suffix(file_path).endswith(SINCRONIA_TRACE_SUFFIX):
+        with open_file(file_path) as f:
+            next(f, None)
+            return sum(int(line.split()[2]) for line in f if line.strip())
+
+    if strip_compression_suffix(file_path).endswith(TRACE_SUFFIXES):
+        return sum(len(coflow['flows']) for coflow in iter_coflows(file_path))
+
+    return None
+
+
+def get_top_functions(profile: cProfile.Profile, number_of_functions: int) -> list:
+
+    # Sorted by the time spent in the function itself, the cumulative time would only show the stage call
+    stats = pstats.Stats(profile).stats
+    top_functions = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:number_of_functions]
+
+    return [{
+        'function': f'{os.path.basename(file_name)}:{line}({function_name})',
+        'calls': calls,
+        'total_time': total_time,
+        'cumulative_time': cumulative_time
+    } for (file_name, line, function_name), (_, calls, total_time, cumulative_time, _) in top_functions]
+
+
+class StageProfiler:
+
+    def __init__(self, top_functions: int = 0, trace_memory: bool = False):
+        # top_functions is the number of functions of the cProfile output kept per stage, 0 turns cProfile off
+        self.top_functions = top_functions
+        self.trace_memory = trace_memory
+        self.stages = []
+        self.flow_counts = {}
+        self.start = perf_counter()
+
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def count_flows(self, file_path: str) -> int:
+        # Files are counted once, the output of a stage is the input of the next
+        if file_path not in self.flow_counts:
+            self.flow_counts[file_path] = count_flows_in_file(file_path) if os.path.exists(file_path) else None
+        return self.flow_counts[file_path]
+
+    def profile(self, stage: str, compute, input_file_paths: list = ()):
+
+        input_file_paths = [file_path for file_path in input_file_paths if file_path]
+
+        is_peak_rss_reset = reset_peak_rss()
+        children_peak_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        profile = cProfile.Profile() if self.top_functions else None
+
+        start = perf_counter()
+        start_cpu_time = time.process_time()
+        start_children_cpu_time = get_children_cpu_time()
+
+        if profile is not None:
+            profile.enable()
+        try:
+            result = compute()
+        finally:
+            if profile is not None:
+                profile.disable()
+
+        wall_time = perf_counter() - start
+        cpu_time = time.process_time() - start_cpu_time + get_children_cpu_time() - start_children_cpu_time
+
+        stage_profile = {
+            'stage': stage,
+            'wall_time': wall_time,
+            'cpu_time': cpu_time,
+            'peak_rss': get_peak_rss(is_peak_rss_reset),
+            'peak_rss_of_stage': is_peak_rss_reset,
+            # The largest worker so far, only set when a worker of this stage was larger than every worker before
+            'children_peak_rss': None,
+            'peak_traced_memory': tracemalloc.get_traced_memory()[1] if self.trace_memory else None,
+            'input_files': input_file_paths,
+            'input_bytes': get_file_sizes(input_file_paths),
+            'output_files': [],
+            'output_bytes': None,
+            'flows': None,
+            'flows_per_second': None
+        }
+
+        new_children_peak_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+        if new_children_peak_rss > children_peak_rss:
+            stage_profile['children_peak_rss'] = new_children_peak_rss
+
+        # Stages return the in-memory trace, the file they wrote or the files they wrote
+        if isinstance(result, dict) and 'coflows' in result:
+            stage_profile['flows'] = sum(len(coflow['flows']) for coflow in result['coflows'])
+        else:
+            output_file_paths = [result] if isinstance(result, str) else list(result or [])
+            stage_profile['output_files'] = output_file_paths
+            stage_profile['output_bytes'] = get_file_sizes(output_file_paths)
+            flow_counts = [self.count_flows(file_path) for file_path in output_file_paths]
+            if output_file_paths and None not in flow_counts:
+                stage_profile['flows'] = sum(flow_counts)
+            elif input_file_paths:
+                stage_profile['flows'] = self.count_flows(input_file_paths[0])
+
+        if stage_profile['flows'] is not None and wall_time > 0:
+            stage_profile['flows_per_second'] = stage_profile['flows'] / wall_time
+
+        if profile is not None:
+            stage_profile['top_functions'] = get_top_functions(profile, self.top_functions)
+
+        self.stages.append(stage_profile)
+
+        print(f'Stage {stage} took {wall_time:.3f} seconds ({cpu_time:.3f} seconds CPU)')
+
+        return result
+
+    def get_report(self, parameters: dict) -> dict:
+        return {
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'parameters': parameters,
+            'total_wall_time': perf_counter() - self.start,
+            'stages': self.stages
+        }
+
+    def save_report(self, report_file_path: str, parameters: dict) -> str:
+
+        with open(report_file_path, 'w') as f:
+            json.dump(self.get_report(parameters), f, indent=2)
+
+        return report_file_path
+
+    def print_summary(self):
+
+        print(f'\n{"stage":<16}{"wall time":>12}{"CPU time":>12}{"peak RSS":>12}{"flows/s":>14}')
+
+        for stage_profile in self.stages:
+            flows_per_second = f'{stage_profile["flows_per_second"]:.0f}' if stage_profile['flows_per_second'] is not None else ''
+            print(f'{stage_profile["stage"]:<16}{stage_profile["wall_time"]:>11.3f}s{stage_profile["cpu_time"]:>11.3f}s{stage_profile["peak_rss"] / 1024**2:>9.1f} MB{flows_per_second:>14}')
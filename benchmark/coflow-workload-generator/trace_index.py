@@ -0,0 +1,142 @@
+import os
+import re
+import sys
+import json
+import mmap
+
+# Byte offset index sidecar for JSON coflow traces
+#
+# The index is written next to the trace as <trace>.idx and holds one entry per coflow:
+# [coflow_id, start byte, end byte, number of flows, number of packets]. Workers seek
+# straight to their coflows instead of streaming the whole trace.
+
+INDEX_VERSION = 1
+
+MAX_PAYLOAD_SIZE = 1458 # same as generate_udp_traffic in create_flow
+
+# JSON strings (which may contain brackets) or a single bracket
+TOKEN_PATTERN = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|[\[\]{}]')
+
+
+def get_index_file_path(json_file: str) -> str:
+    return f'{json_file}.idx'
+
+
+def get_number_of_packets(flow_size_bytes: int) -> int:
+    return -(-int(flow_size_bytes) // MAX_PAYLOAD_SIZE)
+
+
+def find_coflow_byte_ranges(json_file: str) -> list:
+
+    byte_ranges = []
+
+    with open(json_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+
+        depth = 0
+        last_key = None
+        in_coflows = False
+        start = None
+
+        for token in TOKEN_PATTERN.finditer(data):
+            value = token.group()
+
+            if value[0] == ord('"'):
+                if depth == 1:
+                    last_key = value
+                continue
+
+            if value in (b'{', b'['):
+                if depth == 1 and value == b'[' and last_key == b'"coflows"':
+                    in_coflows = True
+                elif depth == 2 and in_coflows and value == b'{':
+                    start = token.start()
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 2 and in_coflows and value == b'}':
+                    byte_ranges.append((start, token.end()))
+                elif depth == 1 and in_coflows:
+                    in_coflows = False
+
+    return byte_ranges
+
+
+def build_trace_index(json_file: str) -> dict:
+
+    if not os.path.exists(json_file):
+        print(f"File '{json_file}' not found.")
+        raise FileNotFoundError
+
+    coflows = []
+
+    with open(json_file, 'rb') as f:
+        for start, end in find_coflow_byte_ranges(json_file):
+            f.seek(start)
+            coflow = json.loads(f.read(end - start))
+            num_packets = sum(get_number_of_packets(flow.get('flow_size_bytes', 0)) for flow in coflow['flows'])
+            coflows.append([coflow['coflow_id'], start, end, len(coflow['flows']), num_packets])
+
+    stat = os.stat(json_file)
+
+    return {
+        'version': INDEX_VERSION,
+        'trace_size': stat.st_size,
+        'trace_mtime_ns': stat.st_mtime_ns,
+        'num_coflows': len(coflows),
+        'coflows': coflows
+    }
+
+
+def write_trace_index(json_file: str, trace_index: dict) -> str:
+
+    index_file_path = get_index_file_path(json_file)
+
+    with open(index_file_path, 'w') as f:
+        json.dump(trace_index, f)
+
+    return index_file_path
+
+
+def load_trace_index(json_file: str) -> dict:
+    # Returns None if there is no index or if the trace changed after the index was written
+
+    index_file_path = get_index_file_path(json_file)
+
+    if not os.path.exists(index_file_path):
+        return None
+
+    with open(index_file_path, 'r') as f:
+        trace_index = json.load(f)
+
+    stat = os.stat(json_file)
+
+    if trace_index.get('version') != INDEX_VERSION or trace_index['trace_size'] != stat.st_size or trace_index['trace_mtime_ns'] != stat.st_mtime_ns:
+        return None
+
+    return trace_index
+
+
+def get_trace_index(json_file: str) -> dict:
+
+    trace_index = load_trace_index(json_file)
+
+    if trace_index is None:
+        print(f"Building coflow index for {json_file}")
+        trace_index = build_trace_index(json_file)
+        print(f"Coflow index saved to {write_trace_index(json_file, trace_index)}")
+
+    return trace_index
+
+
+def read_coflow(f, start: int, end: int) -> dict:
+    f.seek(start)
+    return json.loads(f.read(end - start))
+
+
+if __name__ == "__main__":
+
+    json_file = sys.argv[1]
+
+    trace_index = build_trace_index(json_file)
+
+    print(f"Indexed {trace_index['num_coflows']} coflows, saved to {write_trace_index(json_file, trace_index)}")
@@ -0,0 +1,170 @@
+import os
+import json
+import ijson
+
+from pathlib import Path
+from ijson.common import ObjectBuilder
+from columnar_trace import ColumnarTrace, is_columnar_trace
+from compressed_io import open_file, get_compression_suffix, strip_compression_suffix
+
+
+def load_trace(json_file: str) -> dict:
+
+    if not os.path.exists(json_file):
+        print(f"File '{json_file}' not found.")
+        raise FileNotFoundError
+
+    # Columnar traces are decoded back into the JSON schema
+    if is_columnar_trace(json_file):
+        return ColumnarTrace.load(json_file).to_trace()
+
+    # Load JSON coflow trace, decompressed while it is read if it is compressed
+    with open_file(json_file, 'r') as f:
+        coflow_trace = json.load(f)
+
+    return coflow_trace
+
+
+def save_trace(coflow_trace: dict, output_file_path: str) -> str:
+
+    if is_columnar_trace(output_file_path):
+        return ColumnarTrace.from_trace(coflow_trace).save(output_file_path)
+
+    with open_file(output_file_path, 'w') as f:
+        json.dump(coflow_trace, f, indent=2)
+
+    return output_file_path
+
+
+def get_trace_suffix(json_file_path: str) -> str:
+    # Stages keep the format of their input, columnar in gives columnar out
+    return '.npz' if is_columnar_trace(json_file_path) else get_json_suffix(json_file_path)
+
+
+def get_json_suffix(json_file_path: str) -> str:
+    # JSON output of a stage, compressed like its input
+    return '.json' + get_compression_suffix(json_file_path)
+
+
+def get_trace_name(json_file_path: str) -> str:
+    # File name without the directory, the compression and the extension
+    return Path(os.path.basename(strip_compression_suffix(json_file_path))).stem
+
+
+def read_trace_header(json_file: str) -> dict:
+    # Top-level keys in front of 'coflows', which is where every stage writes its metadata
+
+    if not os.path.exists(json_file):
+        print(f"File '{json_file}' not found.")
+        raise FileNotFoundError
+
+    if is_columnar_trace(json_file):
+        coflow_trace_header = ColumnarTrace.load(json_file).header
+        return {key: coflow_trace_header['metadata'][key] for key in coflow_trace_header['key_order'] if key != 'coflows'}
+
+    header = {}
+
+    with open_file(json_file, 'rb') as f:
+        key = None
+        depth = 0
+
+        for prefix, event, value in ijson.parse(f, use_float=True):
+            if prefix == '' and event == 'map_key':
+                if value == 'coflows':
+                    break
+                key = value
+                builder = ObjectBuilder()
+                continue
+
+            if key is None:
+                continue
+
+            builder.event(event, value)
+
+            if event in ('start_map', 'start_array'):
+                depth += 1
+            elif event in ('end_map', 'end_array'):
+                depth -= 1
+
+            if depth == 0:
+                header[key] = builder.value
+                key = None
+
+    return header
+
+
+def iter_coflows(json_file: str):
+
+    if not os.path.exists(json_file):
+        print(f"File '{json_file}' not found.")
+        raise FileNotFoundError
+
+    if is_columnar_trace(json_file):
+        yield from ColumnarTrace.load(json_file).iter_coflows()
+        return
+
+    with open_file(json_file, 'rb') as f:
+        yield from ijson.items(f, 'coflows.item', use_float=True)
+
+
+class TraceWriter:
+
+    # Writes a trace one coflow at a time, the output is the same as json.dump(coflow_trace, f, indent=2)
+
+    def __init__(self, output_file_path: str, header: dict):
+
+        if is_columnar_trace(output_file_path):
+            raise ValueError("Columnar traces can not be written one coflow at a time.")
+
+        self.output_file_path = output_file_path
+        # The trace is written next to the output and only moved there once it is complete
+        self.temp_file_path = f'{output_file_path}.tmp'
+        self.header = header
+        self.nr_of_coflows = 0
+
+    def __enter__(self):
+
+        self.f = open_file(self.temp_file_path, 'w', self.output_file_path)
+        self.f.write('{')
+
+        for key, value in self.header.items():
+            self.f.write(f'\n  {json.dumps(key)}: {self.indent(json.dumps(value, indent=2), 2)},')
+
+        self.f.write('\n  "coflows": [')
+
+        return self
+
+    def write_coflow(self, coflow: dict):
+
+        if self.nr_of_coflows > 0:
+            self.f.write(',')
+
+        self.f.write(f'\n    {self.indent(json.dumps(coflow, indent=2), 4)}')
+        self.nr_of_coflows += 1
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        # A failed write leaves no truncated trace behind that a rerun or the trace index could pick up
+        if exc_type is not None:
+            self.f.close()
+            os.remove(self.temp_file_path)
+            return
+
+        self.f.write('\n  ]\n}' if self.nr_of_coflows > 0 else ']\n}')
+        self.f.close()
+        os.replace(self.temp_file_path, self.output_file_path)
+
+    def indent(self, text: str, spaces: int) -> str:
+        return text.replace('\n', '\n' + ' ' * spaces)
+
+
+def stream_trace(json_file: str, output_file_path: str, transform_coflow) -> str:
+    # Reads, transforms and writes one coflow at a time, memory stays O(largest coflow)
+
+    header = read_trace_header(json_file)
+
+    with TraceWriter(output_file_path, header) as writer:
+        for coflow in iter_coflows(json_file):
+            writer.write_coflow(transform_coflow(coflow))
+
+    return output_file_path
@@ -0,0 +1,204 @@
+import numpy as np
+
+from operator import itemgetter
+from collections import Counter
+
+from utils.check_coflowiness import CheckCoflowiness
+from flow_key_index import FlowKeyIndex, PackedIPs, pack_flow_keys, concatenate_flow_keys
+from columnar_trace import parse_mac
+from hyperloglog import HyperLogLog, hash_values
+
+# Trace metadata maintained by the stages that change flows
+#
+# The stages that add, remove or rewrite flows update the counts here as they go, so the
+# metadata of the final trace is emitted without another pass over it. The values are counted
+# rather than kept in sets, which lets a removed flow take its IPs and ports out of the metadata.
+# Counts of shards of a trace add up to the counts of the trace.
+#
+# With a cardinality error the distinct values are HyperLogLog sketches instead, a few KB each
+# however large the trace is. Sketches of shards merge like the counts do, but a value can not be
+# taken out of a sketch, so after flows are removed the sketches are rebuilt from the final trace.
+#
+# The flow keys are packed once as the flows are added and kept, 16 bytes per flow, so the stages
+# that count or number the unique flows share one FlowKeyIndex instead of packing the trace again.
+# Removing a flow drops the kept keys until the stage sets the index of the remaining flows.
+
+UNIQUE_COUNTERS = ('src_ips', 'dst_ips', 'src_ports', 'dst_ports', 'src_macs')
+
+
+def decrement(counter: Counter, value):
+    counter[value] -= 1
+    if not counter[value]:
+        del counter[value]
+
+
+class TraceMetadata:
+
+    def __init__(self, cardinality_error: float = None):
+        self.base_flow_dst_port = CheckCoflowiness().base_flow_dst_port
+        self.cardinality_error = cardinality_error
+        self.total_flows = 0
+        self.total_base_flows = 0
+        self.reset_unique_counters()
+        # Set by the stages that count the unique flows anyway, None when it has to be counted again
+        self.unique_flows = None
+        self.packed_ips = PackedIPs()
+        # Packed keys of the flows in trace order, None when they are out of date
+        self.packed_flow_keys = []
+        self.flow_index = None
+
+    def reset_unique_counters(self):
+        if self.cardinality_error is None:
+            for name in UNIQUE_COUNTERS:
+                setattr(self, name, Counter())
+        else:
+            for name in UNIQUE_COUNTERS + ('flow_keys',):
+                setattr(self, name, HyperLogLog(self.cardinality_error))
+            self.sketches_outdated = False
+
+    @classmethod
+    def from_trace(cls, coflow_trace: dict, cardinality_error: float = None) -> 'TraceMetadata':
+        metadata = cls(cardinality_error)
+        for coflow in coflow_trace['coflows']:
+            metadata.add_coflow(coflow)
+        return metadata
+
+    def __getstate__(self) -> dict:
+        # Shard metadata is pickled back to the parent, the IP cache is only worth keeping locally
+        state = self.__dict__.copy()
+        state['packed_ips'] = PackedIPs()
+        return state
+
+    def add_flow(self, flow: dict):
+        self.add_flows([flow])
+
+    def add_flows(self, flows: list):
+        keys = pack_flow_keys(flows, self.packed_ips)
+        self.total_flows += len(flows)
+        self.total_base_flows += int(np.count_nonzero((keys['dst'] & np.uint64(0xffff)) == self.base_flow_dst_port))
+        if self.cardinality_error is not None:
+            self.add_to_sketches(keys, flows)
+        else:
+            self.src_ips.update(map(itemgetter('src_ip'), flows))
+            self.dst_ips.update(map(itemgetter('dst_ip'), flows))
+            self.src_ports.update(map(itemgetter('src_port'), flows))
+            self.dst_ports.update(map(itemgetter('dst_port'), flows))
+            self.src_macs.update(flow['src_mac'] for flow in flows if 'src_mac' in flow)
+        if self.packed_flow_keys is not None:
+            self.packed_flow_keys.append(keys)
+        self.flow_index = None
+        self.unique_flows = None
+
+    def remove_flow(self, flow: dict):
+        self.total_flows -= 1
+        self.total_base_flows -= flow['dst_port'] == self.base_flow_dst_port
+        if self.cardinality_error is not None:
+            self.sketches_outdated = True
+        else:
+            decrement(self.src_ips, flow['src_ip'])
+            decrement(self.dst_ips, flow['dst_ip'])
+            decrement(self.src_ports, flow['src_port'])
+            decrement(self.dst_ports, flow['dst_port'])
+            if 'src_mac' in flow:
+                decrement(self.src_macs, flow['src_mac'])
+        self.packed_flow_keys = None
+        self.flow_index = None
+        self.unique_flows = None
+
+    def add_to_sketches(self, keys: np.ndarray, flows):
+        # The IPs and ports are taken from the packed flow keys, only the MACs from the flows
+        self.flow_keys.add(hash_values(keys['src']) ^ keys['dst'])
+        self.src_ips.add(keys['src'] >> np.uint64(16))
+        self.dst_ips.add(keys['dst'] >> np.uint64(16))
+        self.src_ports.add(keys['src'] & np.uint64(0xffff))
+        self.dst_ports.add(keys['dst'] & np.uint64(0xffff))
+        self.src_macs.add(np.array([parse_mac(flow['src_mac']) for flow in flows if 'src_mac' in flow], dtype=np.uint64))
+
+    def update_coflow(self, coflow: dict):
+        # The per coflow metadata, after the flows of the coflow changed
+        coflow['num_sources'] = len({flow['src_ip'] for flow in coflow['flows']})
+        coflow['num_destinations'] = len({flow['dst_ip'] for flow in coflow['flows']})
+        coflow['num_flows'] = len(coflow['flows'])
+
+    def add_coflow(self, coflow: dict):
+        self.add_flows(coflow['flows'])
+        self.update_coflow(coflow)
+
+    def set_src_macs(self, src_mac_counts: dict):
+        # For stages that give every flow a new MAC
+        if self.cardinality_error is not None:
+            self.src_macs = HyperLogLog(self.cardinality_error)
+            self.src_macs.add(np.array([parse_mac(src_mac) for src_mac in src_mac_counts], dtype=np.uint64))
+        else:
+            self.src_macs = Counter(src_mac_counts)
+
+    def merge(self, other: 'TraceMetadata'):
+        if other.cardinality_error != self.cardinality_error:
+            raise ValueError("Only metadata with the same cardinality error can be merged.")
+        self.total_flows += other.total_flows
+        self.total_base_flows += other.total_base_flows
+        if self.cardinality_error is not None:
+            for name in UNIQUE_COUNTERS + ('flow_keys',):
+                getattr(self, name).merge(getattr(other, name))
+            self.sketches_outdated |= other.sketches_outdated
+        else:
+            for name in UNIQUE_COUNTERS:
+                getattr(self, name).update(getattr(other, name))
+        # The shards are merged in trace order
+        if self.packed_flow_keys is not None and other.packed_flow_keys is not None:
+            self.packed_flow_keys.extend(other.packed_flow_keys)
+        else:
+            self.packed_flow_keys = None
+        self.flow_index = None
+        self.unique_flows = None
+
+    def get_flow_index(self, coflow_trace: dict) -> FlowKeyIndex:
+        # The index of the kept keys, the trace is only packed again when they are out of date
+        if self.flow_index is None:
+            if self.packed_flow_keys is not None and sum(map(len, self.packed_flow_keys)) == self.total_flows:
+                self.flow_index = FlowKeyIndex(concatenate_flow_keys(self.packed_flow_keys))
+            else:
+                self.flow_index = FlowKeyIndex.from_trace(coflow_trace, self.packed_ips)
+            self.packed_flow_keys = [self.flow_index.keys]
+        return self.flow_index
+
+    def set_flow_index(self, flow_index: FlowKeyIndex):
+        # For stages that remove flows and index the remaining ones anyway
+        self.flow_index = flow_index
+        self.packed_flow_keys = [flow_index.keys]
+        self.unique_flows = flow_index.count_unique()
+
+    def get_unique_flows(self, coflow_trace: dict) -> int:
+        # Exact, the stages decide how many flows to remove from it
+        if self.unique_flows is None:
+            self.unique_flows = self.get_flow_index(coflow_trace).count_unique()
+        return self.unique_flows
+
+    def get_unique_counts(self, coflow_trace: dict) -> dict:
+
+        if self.cardinality_error is None:
+            unique_counts = {name: len(getattr(self, name)) for name in UNIQUE_COUNTERS}
+            unique_counts['flows'] = self.get_unique_flows(coflow_trace)
+            return unique_counts
+
+        if self.sketches_outdated:
+            self.reset_unique_counters()
+            self.add_to_sketches(self.get_flow_index(coflow_trace).keys, (flow for coflow in coflow_trace['coflows'] for flow in coflow['flows']))
+
+        unique_counts = {name: getattr(self, name).estimate() for name in UNIQUE_COUNTERS}
+        # A count a stage already made is exact and costs nothing
+        unique_counts['flows'] = self.unique_flows if self.unique_flows is not None else self.flow_keys.estimate()
+        return unique_counts
+
+    def get_coflowiness(self) -> tuple:
+        # Same as CheckCoflowiness().check_coflowiness_trace
+
+        if self.total_flows == 0:
+            return 0, 0.0, 0.0
+
+        fraction_of_base_flows = self.total_base_flows / self.total_flows
+        coflowiness = 1 - fraction_of_base_flows
+
+        print(f"Total flows: {self.total_flows}, base flows: {self.total_base_flows}, coflowiness: {coflowiness}")
+
+        return self.total_base_flows, coflowiness, fraction_of_base_flows
@@ -1,8 +1,143 @@
 import os
 import pickle
+import hashlib
 import scipy.stats
 import numpy as np
 
+from parse_trace import get_flow_starts_file_path
+
+FB_TRACE_CACHE_VERSION = 1
+
+def parse_fb_trace(fb_trace: str) -> dict:
+
+    # One pass over the trace for the ir, destination data and num_sources histograms and the FB upscale coflows
+    irs = [];
+    destination_datas_trace = [];
+    num_sources_trace = [];
+    coflow_trace = [];
+    with open(fb_trace) as f1:
+        for line in f1:
+            numbers_str = line.split();
+            coflow_id = int(numbers_str[0]);
+            num_senders = int(numbers_str[2]);
+            num_receivers = int(numbers_str[3+num_senders]);
+            irs.append(float(num_receivers)/float(num_senders));
+            num_sources_trace.append(num_senders);
+            destination_datas = [];
+            for i in range(num_receivers):
+                destination_data = float(numbers_str[4+num_senders+i].split(':')[1]);
+                destination_datas_trace.append(destination_data);
+                destination_datas.append(int(destination_data));
+            coflow = {};
+            coflow['id'] = coflow_id;
+            coflow['num_senders'] = num_senders;
+            coflow['num_destinations'] = num_receivers;
+            coflow['destination_datas'] = destination_datas;
+            coflow_trace.append(coflow);
+
+    return {
+        'hist_ir': np.histogram(irs,bins='auto'),
+        'hist_dd': np.histogram(destination_datas_trace,bins='auto'),
+        'hist_num_sources': np.histogram(num_sources_trace,bins='auto'),
+        'coflow_trace': coflow_trace
+    };
+
+def load_fb_trace(fb_trace: str, cache_dir: str = 'pickles') -> dict:
+
+    # Parsed trace and fitted histograms are cached on disk, keyed by the content hash of the trace.
+    # The rv_histogram objects are not cached, an unpickled one samples from its own copy of the random state.
+    with open(fb_trace, 'rb') as f1:
+        digest = hashlib.sha256(f1.read()).hexdigest();
+
+    cache_file = os.path.join(cache_dir, f'fb_trace_v{FB_TRACE_CACHE_VERSION}_{digest[:16]}.pkl');
+
+    if os.path.exists(cache_file):
+        with open(cache_file, 'rb') as f1:
+            return pickle.load(f1);
+
+    fb_trace_distributions = parse_fb_trace(fb_trace);
+
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir);
+
+    # Write to a temporary file first so that parallel runs never read a partial cache
+    tmp_cache_file = f'{cache_file}.{os.getpid()}.tmp';
+    with open(tmp_cache_file, 'wb') as f1:
+        pickle.dump(fb_trace_distributions, f1);
+    os.replace(tmp_cache_file, cache_file);
+
+    return fb_trace_distributions;
+
+def generate_fb_up_coflows(coflow_trace: list, NUM_COFLOWS: int, NUM_INP_PORTS: int, LOAD_FACTOR: float, ACCESS_LINK_BANDWIDTH: float) -> list:
+
+    # FB upscale on arrays, gives the same coflows as the per flow loop for the same np.random seed.
+    # The per coflow draws stay in a loop since they are interleaved in the random stream.
+    ports = np.arange(0,NUM_INP_PORTS);
+    num_sources_list = [];
+    num_destinations_list = [];
+    flow_sources = [];
+    flow_destinations = [];
+    flow_sizes = [];
+    for i in range(NUM_COFLOWS):
+        coflow_id = np.random.choice(526);
+        coflow = coflow_trace[coflow_id]; #coflow_trace is a list of dictionary created by the coflow trace
+        num_sources = coflow['num_senders'];
+        num_destinations = coflow['num_destinations'];
+        sources = np.random.choice(ports,num_sources,replace=False);
+        sources.sort();
+        destinations = np.random.choice(ports,num_destinations,replace=False);
+        destinations.sort();
+        destination_datas = np.asarray(coflow['destination_datas'], dtype=np.float64);
+        # flows are ordered by destination and then by source
+        flow_sources.append(np.tile(sources, num_destinations));
+        flow_destinations.append(np.repeat(destinations, num_sources));
+        flow_sizes.append(np.repeat(destination_datas[:num_destinations]/num_sources, num_sources));
+        num_sources_list.append(num_sources);
+        num_destinations_list.append(num_destinations);
+
+    count_flows = np.asarray(num_sources_list, dtype=np.int64) * np.asarray(num_destinations_list, dtype=np.int64);
+    flow_sources = np.concatenate(flow_sources) if flow_sources else np.zeros(0, dtype=np.int64);
+    flow_destinations = np.concatenate(flow_destinations) if flow_destinations else np.zeros(0, dtype=np.int64);
+    flow_sizes = np.concatenate(flow_sizes).tolist() if flow_sizes else [];
+
+    num_flows = len(flow_sizes);
+    total_flow_size = sum(flow_sizes); # summed in flow order like the per flow loop
+
+    mean_flow_size = total_flow_size/num_flows; #mean flow size is in MB
+    flow_arrival_rate = float(LOAD_FACTOR * ACCESS_LINK_BANDWIDTH * NUM_INP_PORTS) / mean_flow_size;
+    flow_arrival_rate_milli_second = flow_arrival_rate/1000;
+    beta = 1/flow_arrival_rate_milli_second;
+
+    flow_starts = np.random.exponential(scale=beta, size=num_flows).cumsum(); #inter arrival time in micro seconds
+
+    # per coflow arrival time is the start of its last flow, -1 for coflows without flows
+    flow_offsets = np.zeros(NUM_COFLOWS + 1, dtype=np.int64);
+    flow_offsets[1:] = np.cumsum(count_flows);
+    arrival_times = np.full(NUM_COFLOWS, -1.0);
+    has_flows = count_flows > 0;
+    if has_flows.any():
+        arrival_times[has_flows] = np.maximum.reduceat(flow_starts, flow_offsets[:-1][has_flows]);
+
+    # Source_ID and Destination_ID stay numpy integers, as in the per flow loop. One object per port
+    # is shared by all flows so that pickle stores each port once instead of once per flow.
+    port_ids = list(ports);
+    flow_sources = [port_ids[source] for source in flow_sources.tolist()];
+    flow_destinations = [port_ids[destination] for destination in flow_destinations.tolist()];
+    flow_starts = flow_starts.tolist();
+    flow_offsets = flow_offsets.tolist();
+
+    coflows = [];
+    for i in range(NUM_COFLOWS):
+        start, end = flow_offsets[i], flow_offsets[i+1];
+        flows = [{'Coflow_ID': i, 'Source_ID': source, 'Destination_ID': destination, 'Size': size, 'Start': flow_start}
+                 for source, destination, size, flow_start in zip(flow_sources[start:end], flow_destinations[start:end], flow_sizes[start:end], flow_starts[start:end])];
+        C = {'Coflow_ID': i, 'Flows': flows, 'Num_sources':num_sources_list[i], 'Num_destinations':num_destinations_list[i]};
+        C['Arrival_Time'] = int(arrival_times[i]);
+        C['Count_Flows'] = end - start;
+        coflows.append(C);
+
+    return coflows;
+
 def run(NUM_COFLOWS: int, ALPHA: any, LOAD_FACTOR: float, INTRA_COFLOW_CONTENTION: float = None, SOURCE_NUM_DIST: str = None, DESTINATION_DATA_DIST: str = None):
 
     #NUM_COFLOWS = int(sys.argv[1]);
@@ -31,97 +166,24 @@ def run(NUM_COFLOWS: int, ALPHA: any, LOAD_FACTOR: float, INTRA_COFLOW_CONTENTIO
 
 
 
-    irs = [];
-    #generate irs from tracefile
-    with open(fb_trace) as f1:
-        for line in f1:
-            numbers_str = line.split();
-            num_senders = int(numbers_str[2]);
-            num_receivers = int(numbers_str[3+num_senders]);
-            irs.append(float(num_receivers)/float(num_senders));
-
-
-    #create distribution for ir
-    data_irs = irs;
-    hist_ir = np.histogram(data_irs,bins='auto');
-    hist_dist_ir = scipy.stats.rv_histogram(hist_ir);
-
-    #generate destination_datas from tracefile
-    destination_datas = [];
-    with open(fb_trace) as f1:
-        for line in f1:
-            numbers_str = line.split();
-            num_senders = int(numbers_str[2]);
-            num_receivers = int(numbers_str[3+num_senders]);
-            for i in range(num_receivers):
-                destination_datas.append(float(numbers_str[4+num_senders+i].split(':')[1]));
-    #generate distribution
-    data_dd = destination_datas;
-    hist_dd = np.histogram(data_dd,bins='auto');
-    hist_dist_dd = scipy.stats.rv_histogram(hist_dd);
-
-    #generate num_sources distribution from tracefile
-    num_sources_trace = [];
-    with open(fb_trace) as f1:
-        for line in f1:
-            numbers_str = line.split();
-            num_senders = int(numbers_str[2]);
-            num_sources_trace.append(num_senders);
-    #generate distribution
-    data_num_sources = num_sources_trace;
-    hist_num_sources = np.histogram(data_num_sources,bins='auto');
-    hist_dist_num_sources = scipy.stats.rv_histogram(hist_num_sources);
-
-    #create list of dictionary for FB upscale
-    coflow_trace = [];
-    with open(fb_trace) as f1:
-        for line in f1:
-            numbers_str = line.split();
-            coflow_id = int(numbers_str[0]);
-            num_senders = int(numbers_str[2]);
-            num_receivers = int(numbers_str[3+num_senders]);
-            destination_datas = [];
-            for i in range(num_receivers):
-                destination_datas.append(int(float(numbers_str[4+num_senders+i].split(':')[1])));
-            coflow = {};
-            coflow['id'] = coflow_id;
-            coflow['num_senders'] = num_senders;
-            coflow['num_destinations'] = num_receivers;
-            coflow['destination_datas'] = destination_datas;
-            coflow_trace.append(coflow);
+    fb_trace_distributions = load_fb_trace(fb_trace);
+    coflow_trace = fb_trace_distributions['coflow_trace'];
 
+    #create distributions, a fresh rv_histogram samples from the global np.random
+    hist_dist_ir = scipy.stats.rv_histogram(fb_trace_distributions['hist_ir']);
+    hist_dist_dd = scipy.stats.rv_histogram(fb_trace_distributions['hist_dd']);
+    hist_dist_num_sources = scipy.stats.rv_histogram(fb_trace_distributions['hist_num_sources']);
 
-    total_flow_size = 0;
-    num_flows = 0;
-    flows = [];
-    num_sources_list = [];
-    num_destinations_list = [];
-    for i in range(NUM_COFLOWS):
-        # num_sources = min(np.random.zipf(2),MAX_NUM_SOURCES);
-        if(ALPHA=='FB-UP'):
-            coflow_id = np.random.choice(526);
-            coflow = coflow_trace[coflow_id]; #coflow_trace is a list of dictionary created by the coflow trace
-            num_sources = coflow['num_senders'];
-            num_destinations = coflow['num_destinations'];
-            num_destinations_actual = num_destinations;
-            sources = np.random.choice(np.arange(0,NUM_INP_PORTS),num_sources,replace=False);
-            sources.sort();
-            destinations = np.random.choice(np.arange(0,NUM_INP_PORTS),num_destinations,replace=False);
-            destinations.sort();
-            destination_datas = coflow['destination_datas'];
-            # if(i==0):
-            #     print(coflow['id']);
-            #     print(num_sources);
-            #     print(num_destinations);
-            #     print(len(destination_datas));
-            for j in range(num_destinations):
-                for k in range(num_sources):
-                    flow_size = destination_datas[j]/num_sources;
-                    num_flows = num_flows + 1;
-                    total_flow_size = total_flow_size + flow_size;
-                    F = {'Coflow_ID': i, 'Source_ID': sources[k], 'Destination_ID': destinations[j], 'Size': flow_size};
-                    flows.append(F);
-        else:
+    if(ALPHA=='FB-UP'):
+        coflows = generate_fb_up_coflows(coflow_trace, NUM_COFLOWS, NUM_INP_PORTS, LOAD_FACTOR, ACCESS_LINK_BANDWIDTH);
+    else:
+        total_flow_size = 0;
+        num_flows = 0;
+        flows = [];
+        num_sources_list = [];
+        num_destinations_list = [];
+        for i in range(NUM_COFLOWS):
+            # num_sources = min(np.random.zipf(2),MAX_NUM_SOURCES);
             if(SOURCE_NUM_DIST=='U'):
                 MAX_NUM_SOURCES = min(ALPHA,NUM_INP_PORTS);
                 # num_sources = min(int(round(np.random.uniform(1,MAX_NUM_SOURCES))),MAX_NUM_SOURCES);
@@ -177,41 +239,41 @@ def run(NUM_COFLOWS: int, ALPHA: any, LOAD_FACTOR: float, INTRA_COFLOW_CONTENTIO
                     total_flow_size = total_flow_size + flow_size;
                     F = {'Coflow_ID': i, 'Source_ID': sources_d[l], 'Destination_ID': d, 'Size': flow_size};
                     flows.append(F);
-        num_sources_list.append(num_sources);
-        num_destinations_list.append(num_destinations_actual);
+            num_sources_list.append(num_sources);
+            num_destinations_list.append(num_destinations_actual);
 
-    mean_flow_size = total_flow_size/num_flows; #mean flow size is in MB
-    flow_arrival_rate = float(LOAD_FACTOR * ACCESS_LINK_BANDWIDTH * NUM_INP_PORTS) / mean_flow_size;
-    flow_arrival_rate_milli_second = flow_arrival_rate/1000;
-    # flow_arrival_rate_micro_second = flow_arrival_rate/1000000;
-    beta = 1/flow_arrival_rate_milli_second;
-    # beta = 1/flow_arrival_rate_micro_second;
+        mean_flow_size = total_flow_size/num_flows; #mean flow size is in MB
+        flow_arrival_rate = float(LOAD_FACTOR * ACCESS_LINK_BANDWIDTH * NUM_INP_PORTS) / mean_flow_size;
+        flow_arrival_rate_milli_second = flow_arrival_rate/1000;
+        # flow_arrival_rate_micro_second = flow_arrival_rate/1000000;
+        beta = 1/flow_arrival_rate_milli_second;
+        # beta = 1/flow_arrival_rate_micro_second;
 
-    start = 0;
-    for f in flows:
-        # inter_arrival = np.random.poisson(L);
-        inter_arrival = np.random.exponential(scale=beta); #inter arrival time in micro seconds
-        f['Start'] = start + inter_arrival;
-        start = start + inter_arrival;
+        start = 0;
+        for f in flows:
+            # inter_arrival = np.random.poisson(L);
+            inter_arrival = np.random.exponential(scale=beta); #inter arrival time in micro seconds
+            f['Start'] = start + inter_arrival;
+            start = start + inter_arrival;
 
-    # generate coflow dictionaries
-    coflows = [];
-    for i in range(NUM_COFLOWS):
-        C = {'Coflow_ID': i, 'Flows': [], 'Num_sources':num_sources_list[i], 'Num_destinations':num_destinations_list[i]};
-        coflows.append(C);
+        # generate coflow dictionaries
+        coflows = [];
+        for i in range(NUM_COFLOWS):
+            C = {'Coflow_ID': i, 'Flows': [], 'Num_sources':num_sources_list[i], 'Num_destinations':num_destinations_list[i]};
+            coflows.append(C);
 
-    for f in flows:
-        coflows[f['Coflow_ID']]['Flows'].append(f);
+        for f in flows:
+            coflows[f['Coflow_ID']]['Flows'].append(f);
 
-    for C in coflows:
-        max_arrival_time = -1;
-        count_flows = 0;
-        for f in C['Flows']:
-            count_flows = count_flows + 1;
-            if(f['Start'] > max_arrival_time):
-                max_arrival_time = f['Start'];
-        C['Arrival_Time'] = int(max_arrival_time);
-        C['Count_Flows'] = count_flows;
+        for C in coflows:
+            max_arrival_time = -1;
+            count_flows = 0;
+            for f in C['Flows']:
+                count_flows = count_flows + 1;
+                if(f['Start'] > max_arrival_time):
+                    max_arrival_time = f['Start'];
+            C['Arrival_Time'] = int(max_arrival_time);
+            C['Count_Flows'] = count_flows;
 
     #output trace to file
     outfile = OUTPUT_FILE;
@@ -232,6 +294,11 @@ def run(NUM_COFLOWS: int, ALPHA: any, LOAD_FACTOR: float, INTRA_COFLOW_CONTENTIO
         line_to_print = ' '.join(l);
         out_file.write(line_to_print+'\n');
 
+    #flow start times in milliseconds, one line per coflow, read by ParseTrace to timestamp the packets
+    with open(get_flow_starts_file_path(OUTPUT_FILE),'w') as starts_file:
+        for C in coflows:
+            starts_file.write(' '.join(repr(float(f['Start'])) for f in C['Flows'])+'\n');
+
     #enter coflow data to pickle
     output_file = open(PICKLE_FILE,'wb');
     pickle.dump(coflows,output_file);
@@ -1,107 +1,74 @@
 
 from pathlib import Path
 import os
-import json
 
-from utils.check_coflowiness import CheckCoflowiness
+from trace_io import load_trace, save_trace, get_trace_suffix, get_trace_name
+from trace_metadata import TraceMetadata
 
 class UpdateMetadata:
 
-    def update_metadata(self, json_file: str, output_file_path: str, NUM_PODS: int) -> str:
+    def update_metadata_trace(self, coflow_trace: dict, NUM_PODS: int, metadata: TraceMetadata = None, cardinality_error: float = None) -> dict:
 
-        print(f"\nUpdating metadata for file: {Path(json_file)}")
+        # Stages that keep a TraceMetadata up to date pass it in, otherwise it is counted in one pass over the trace.
+        # With a cardinality error the unique counts are HyperLogLog estimates.
+        if metadata is None:
+            metadata = TraceMetadata.from_trace(coflow_trace, cardinality_error)
 
-        if not os.path.exists(json_file):
-            print(f"File '{json_file}' not found.")
-            raise FileNotFoundError
-        
-        total_base_flows, coflowiness, fraction_of_base_flows = CheckCoflowiness().check_coflowiness(json_file)
+        total_base_flows, coflowiness, fraction_of_base_flows = metadata.get_coflowiness()
 
-        # Load JSON coflow trace
-        with open(json_file, 'r') as f:
-            coflow_trace = json.load(f)
-
-        flow_set = set()
-        src_mac_set = set()
-        total_src_ips = set()
-        total_dst_ips = set()
-        total_dst_ports = set()
-        total_src_ports = set()
-        total_flows = 0
-
-        for coflow in coflow_trace['coflows']:
-            
-            src_ips = set()  # Store distinct source IPs
-            dst_ips = set()  # Store distinct destination IPs
-            num_flows = 0     # Counter for total flows
-
-            for flow in coflow['flows']:
-                src_ip = flow['src_ip']
-                src_port = flow['src_port']
-                dst_ip = flow['dst_ip']
-                dst_port = flow['dst_port']
-                
-                if 'src_mac' in flow:
-                    src_mac = flow['src_mac']
-                    src_mac_set.add(src_mac)
-                
-                src_ips.add(src_ip)
-                dst_ips.add(dst_ip)
-                flow_set.add((src_ip, src_port, dst_ip, dst_port))
-
-                total_src_ips.add(src_ip)
-                total_dst_ips.add(dst_ip)
-                total_dst_ports.add(dst_port)
-                total_src_ports.add(src_port)
-
-                num_flows += 1
-                total_flows += 1
-
-            # Update coflow metadata
-            coflow['num_sources'] = len(src_ips)
-            coflow['num_destinations'] = len(dst_ips)
-            coflow['num_flows'] = num_flows
+        unique_counts = metadata.get_unique_counts(coflow_trace)
 
         if 'num_pods' not in coflow_trace:
             coflow_trace['num_pods'] = NUM_PODS
 
-        #check if src_mac set is empty
-        if not src_mac_set:
-            len_src_mac_set = 0
-        else:
-            len_src_mac_set = len(src_mac_set)
-        
         new_data = {
             "num_pods": coflow_trace['num_pods'],
             "num_coflows": len(coflow_trace['coflows']),
-            "unique_flows": len(flow_set),
-            "total_flows": total_flows,
-            "unique_src_macs": len_src_mac_set,
+            "unique_flows": unique_counts['flows'],
+            "total_flows": metadata.total_flows,
+            "unique_src_macs": unique_counts['src_macs'],
             "total_base_flows": total_base_flows,
             "coflowiness": coflowiness,
             "fraction_of_base_flows": fraction_of_base_flows,
-            "unique_src_ips": len(total_src_ips),
-            "unique_src_ports": len(total_src_ports),
-            "unique_dst_ips": len(total_dst_ips),
-            "unique_dst_ports": len(total_dst_ports),
+            "unique_src_ips": unique_counts['src_ips'],
+            "unique_src_ports": unique_counts['src_ports'],
+            "unique_dst_ips": unique_counts['dst_ips'],
+            "unique_dst_ports": unique_counts['dst_ports'],
             "coflows": coflow_trace['coflows']
         }
 
-        with open(output_file_path, 'w') as f:
-            json.dump(new_data, f, indent=2)
+        # Marks the unique counts as estimates
+        if metadata.cardinality_error is not None:
+            new_data = {"cardinality_error": metadata.cardinality_error, **new_data}
+
+        return new_data
+
+    def update_metadata(self, json_file: str, output_file_path: str, NUM_PODS: int, cardinality_error: float = None) -> str:
+
+        print(f"\nUpdating metadata for file: {Path(json_file)}")
+
+        # Load JSON coflow trace
+        coflow_trace = load_trace(json_file)
+
+        new_data = self.update_metadata_trace(coflow_trace, NUM_PODS, cardinality_error=cardinality_error)
 
-        return output_file_path
+        return save_trace(new_data, output_file_path)
     
 
-    def run(self, json_file_path: str, output_dir: str, NUM_PODS: int = 8) -> str:
+    def get_output_file_path(self, json_file_path: str, output_dir: str) -> str:
+
+        json_file_name_without_extension = get_trace_name(json_file_path)
+
+        output_file = f'{json_file_name_without_extension}_updated{get_trace_suffix(json_file_path)}'
+
+        return os.path.join(output_dir, output_file)
 
-        self.json_file_name_without_extension = Path(os.path.basename(json_file_path)).stem
 
-        output_file = f'{self.json_file_name_without_extension}_updated.json'
+    def run(self, json_file_path: str, output_dir: str, NUM_PODS: int = 8, cardinality_error: float = None) -> str:
 
-        output_file_path = os.path.join(output_dir, output_file)
+        output_file_path = self.get_output_file_path(json_file_path, output_dir)
 
-        output_file_path = self.update_metadata(json_file_path, output_file_path, NUM_PODS)
+        output_file_path = self.update_metadata(json_file_path, output_file_path, NUM_PODS, cardinality_error)
 
         print(f"Updated metadata saved to: {output_file_path}")
 
@@ -0,0 +1,41 @@
+import sys
+
+from trace_io import load_trace
+
+
+class CheckCoflowiness:
+
+    def __init__(self):
+        self.base_flow_dst_port = 2100 # base flows are the flows with 2100 as destination port
+
+    def check_coflowiness_trace(self, coflow_trace: dict) -> tuple:
+
+        total_flows = 0
+        total_base_flows = 0
+
+        for coflow in coflow_trace['coflows']:
+            for flow in coflow['flows']:
+                total_flows += 1
+                if flow['dst_port'] == self.base_flow_dst_port:
+                    total_base_flows += 1
+
+        if total_flows == 0:
+            return 0, 0.0, 0.0
+
+        fraction_of_base_flows = total_base_flows / total_flows
+        coflowiness = 1 - fraction_of_base_flows
+
+        print(f"Total flows: {total_flows}, base flows: {total_base_flows}, coflowiness: {coflowiness}")
+
+        return total_base_flows, coflowiness, fraction_of_base_flows
+
+    def check_coflowiness(self, json_file: str) -> tuple:
+
+        coflow_trace = load_trace(json_file)
+
+        return self.check_coflowiness_trace(coflow_trace)
+
+
+if __name__ == "__main__":
+
+    CheckCoflowiness().check_coflowiness(sys.argv[1])
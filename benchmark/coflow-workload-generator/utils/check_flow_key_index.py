@@ -0,0 +1,75 @@
+import os
+import sys
+import time
+import numpy as np
+
+# Run as python utils/check_flow_key_index.py <trace>, the generator modules are one directory up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from trace_io import load_trace
+from flow_key_index import FlowKeyIndex, PackedIPs, pack_flow_keys, concatenate_flow_keys
+
+# The stages that count the unique flows: coflowiness, remove flows and MACs
+STAGES_COUNTING_UNIQUE_FLOWS = 3
+
+
+class CheckFlowKeyIndex:
+
+    # The flow keys are packed once while the metadata is counted, the stages then count the kept keys.
+    # That has to give the same count as a set of flow tuples and must not be slower than building the
+    # set in every stage.
+
+    def get_best_time(self, function, repeats: int) -> tuple:
+
+        best_time = float('inf')
+        for _ in range(repeats):
+            start = time.perf_counter()
+            result = function()
+            best_time = min(best_time, time.perf_counter() - start)
+
+        return best_time, result
+
+    def count_flow_set(self, coflow_trace: dict) -> int:
+        return len({(flow['src_ip'], flow['src_port'], flow['dst_ip'], flow['dst_port']) for coflow in coflow_trace['coflows'] for flow in coflow['flows']})
+
+    def pack_flow_keys(self, coflow_trace: dict) -> np.ndarray:
+        # What the metadata does as the coflowiness stage adds the coflows
+        packed_ips = PackedIPs()
+        return concatenate_flow_keys([pack_flow_keys(coflow['flows'], packed_ips) for coflow in coflow_trace['coflows']])
+
+    def check_flow_key_index(self, json_file: str, repeats: int = 3) -> bool:
+
+        coflow_trace = load_trace(json_file)
+
+        set_time, set_count = self.get_best_time(lambda: self.count_flow_set(coflow_trace), repeats)
+        pack_time, keys = self.get_best_time(lambda: self.pack_flow_keys(coflow_trace), repeats)
+        index_time, index_count = self.get_best_time(lambda: FlowKeyIndex(keys).count_unique(), repeats)
+
+        print(f"Unique flows of {len(keys)} flows: set {set_count} in {set_time:.3f}s, index {index_count} in {index_time:.3f}s, packing the keys once {pack_time:.3f}s")
+
+        if index_count != set_count:
+            print(f"The index counts {index_count} unique flows, the set {set_count}")
+            return False
+
+        if index_time > set_time:
+            print(f"Counting the packed keys takes {index_time:.3f}s, longer than the {set_time:.3f}s of the set")
+            return False
+
+        trace_set_time = STAGES_COUNTING_UNIQUE_FLOWS * set_time
+        trace_index_time = pack_time + STAGES_COUNTING_UNIQUE_FLOWS * index_time
+        if trace_index_time > trace_set_time:
+            print(f"Packing once and counting in {STAGES_COUNTING_UNIQUE_FLOWS} stages takes {trace_index_time:.3f}s, longer than the {trace_set_time:.3f}s of a set per stage")
+            return False
+
+        print(f"Counting in {STAGES_COUNTING_UNIQUE_FLOWS} stages: index {trace_index_time:.3f}s, set {trace_set_time:.3f}s")
+
+        return True
+
+
+if __name__ == "__main__":
+
+    if not os.path.exists(sys.argv[1]):
+        print(f"File '{sys.argv[1]}' not found.")
+        exit(1)
+
+    exit(0 if CheckFlowKeyIndex().check_flow_key_index(sys.argv[1]) else 1)
@@ -0,0 +1,70 @@
+import os
+import sys
+import tempfile
+
+# Run as python utils/check_packet_timing.py <trace>, the generator modules are one directory up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from compressed_io import open_file
+from ipsummary_writer import SUMMARY_HEADER, SUMMARY_RECORD
+from create_pcap_file_CDF import CoflowTraceGenerator
+
+
+class CheckPacketTiming:
+
+    # The packet timestamps only depend on the flows, so the records of a trace have to be the same
+    # for any number of pcap workers, and the records of every worker have to be in timestamp order
+
+    def read_summary_records(self, summary_file: str) -> list:
+
+        with open_file(summary_file, 'rb') as f:
+            data = f.read()[len(SUMMARY_HEADER):]
+
+        return [((sec, usec), *fields) for (_, sec, usec, *fields) in SUMMARY_RECORD.iter_unpack(data)]
+
+    def generate_records(self, json_file: str, cores: int, line_rate: float) -> list:
+        # One list of records per worker
+
+        with tempfile.TemporaryDirectory() as summary_dir:
+            summary_files = CoflowTraceGenerator().run(json_file, summary_dir, cores, packet_backend='summary', line_rate=line_rate)
+            return [self.read_summary_records(summary_file) for summary_file in summary_files]
+
+    def check_packet_timing(self, json_file: str, cores: list = (1, 4), line_rate: float = 10e9) -> bool:
+
+        records_per_workers = {}
+
+        for nr_of_cores in cores:
+            worker_records = self.generate_records(json_file, nr_of_cores, line_rate)
+
+            for pid, records in enumerate(worker_records):
+                timestamps = [record[0] for record in records]
+                if timestamps != sorted(timestamps):
+                    print(f"Records of worker {pid} of {len(worker_records)} are not in timestamp order")
+                    return False
+
+            # The generator uses at most one worker per CPU and per coflow
+            records_per_workers[len(worker_records)] = sorted(record for records in worker_records for record in records)
+
+        if len(records_per_workers) < 2:
+            print(f"All runs used {next(iter(records_per_workers))} workers, the check needs at least {max(cores)} CPUs and coflows")
+            return False
+
+        first_workers, first_records = next(iter(records_per_workers.items()))
+
+        for nr_of_workers, records in records_per_workers.items():
+            if records != first_records:
+                print(f"Packet timestamps with {nr_of_workers} workers differ from the timestamps with {first_workers} workers")
+                return False
+
+        print(f"Packet timestamps of {len(first_records)} packets are the same with {', '.join(map(str, records_per_workers))} workers")
+
+        return True
+
+
+if __name__ == "__main__":
+
+    if not os.path.exists(sys.argv[1]):
+        print(f"File '{sys.argv[1]}' not found.")
+        exit(1)
+
+    exit(0 if CheckPacketTiming().check_packet_timing(sys.argv[1]) else 1)
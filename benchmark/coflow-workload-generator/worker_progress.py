@@ -0,0 +1,122 @@
+import json
+import time
+
+from multiprocessing.sharedctypes import RawArray
+
+# Progress counters shared between the pcap workers and the parent
+#
+# Every worker owns one block of counters in shared memory and is the only writer of it, so
+# no locks or Manager round trips are needed. The parent only reads the blocks.
+
+COFLOWS, PACKETS, BYTES = range(3)
+STARTED, FINISHED = range(2)
+
+
+class WorkerProgress:
+
+    def __init__(self, estimated_packets: list):
+        self.nr_of_workers = len(estimated_packets)
+        self.estimated_packets = list(estimated_packets)
+        self.counters = RawArray('q', self.nr_of_workers * 3)
+        self.times = RawArray('d', self.nr_of_workers * 2)
+
+    # Worker side
+
+    def start(self, pid: int):
+        self.times[pid * 2 + STARTED] = time.time()
+
+    def add_coflow(self, pid: int):
+        self.counters[pid * 3 + COFLOWS] += 1
+
+    def add_packets(self, pid: int, packets: int, nr_of_bytes: int):
+        self.counters[pid * 3 + PACKETS] += packets
+        self.counters[pid * 3 + BYTES] += nr_of_bytes
+
+    def finish(self, pid: int):
+        self.times[pid * 2 + FINISHED] = time.time()
+
+    # Parent side
+
+    def get_worker(self, pid: int, now: float = None) -> dict:
+
+        started = self.times[pid * 2 + STARTED]
+        finished = self.times[pid * 2 + FINISHED]
+
+        if now is None:
+            now = time.time()
+
+        seconds = (finished or now) - started if started else 0.0
+
+        packets = self.counters[pid * 3 + PACKETS]
+        nr_of_bytes = self.counters[pid * 3 + BYTES]
+        remaining_packets = max(self.estimated_packets[pid] - packets, 0)
+
+        packets_per_second = packets / seconds if seconds > 0 else 0.0
+
+        return {
+            'pid': pid,
+            'coflows': self.counters[pid * 3 + COFLOWS],
+            'packets': packets,
+            'estimated_packets': self.estimated_packets[pid],
+            'bytes': nr_of_bytes,
+            'seconds': seconds,
+            'packets_per_second': packets_per_second,
+            'MB_per_second': nr_of_bytes / seconds / 1e6 if seconds > 0 else 0.0,
+            'eta_seconds': 0.0 if finished else (remaining_packets / packets_per_second if packets_per_second > 0 else None),
+            'finished': bool(finished)
+        }
+
+    def get_total(self, workers: list, seconds: float) -> dict:
+
+        packets = sum(worker['packets'] for worker in workers)
+        nr_of_bytes = sum(worker['bytes'] for worker in workers)
+        etas = [worker['eta_seconds'] for worker in workers]
+
+        return {
+            'coflows': sum(worker['coflows'] for worker in workers),
+            'packets': packets,
+            'estimated_packets': sum(self.estimated_packets),
+            'bytes': nr_of_bytes,
+            'seconds': seconds,
+            'packets_per_second': packets / seconds if seconds > 0 else 0.0,
+            'MB_per_second': nr_of_bytes / seconds / 1e6 if seconds > 0 else 0.0,
+            # The slowest worker decides when the run is done
+            'eta_seconds': None if None in etas else max(etas, default=0.0)
+        }
+
+    def format_eta(self, eta_seconds) -> str:
+        return '?' if eta_seconds is None else f'{eta_seconds:.0f}s'
+
+    def print_progress(self, seconds: float):
+
+        now = time.time()
+        workers = [self.get_worker(pid, now) for pid in range(self.nr_of_workers)]
+        total = self.get_total(workers, seconds)
+
+        for worker in workers:
+            state = 'done' if worker['finished'] else f"ETA {self.format_eta(worker['eta_seconds'])}"
+            print(f"Worker {worker['pid']}: {worker['coflows']} coflows, {worker['packets']}/{worker['estimated_packets']} packets, "
+                  f"{worker['packets_per_second']:.0f} packets/s, {worker['MB_per_second']:.1f} MB/s, {state}")
+
+        print(f"Total: {total['packets']}/{total['estimated_packets']} packets, {total['packets_per_second']:.0f} packets/s, "
+              f"{total['MB_per_second']:.1f} MB/s, ETA {self.format_eta(total['eta_seconds'])}")
+
+    def write_summary(self, summary_file: str, output_files: list, seconds: float, parameters: dict = None) -> str:
+        # parameters are the settings the output files depend on, written along with the workers
+
+        workers = [self.get_worker(pid) for pid in range(self.nr_of_workers)]
+        total = self.get_total(workers, seconds)
+        del total['eta_seconds']
+
+        for worker, output_file in zip(workers, output_files):
+            worker['output_file'] = output_file
+            del worker['eta_seconds']
+
+        # Ratio of the slowest worker to the mean, close to 1 when the work is balanced
+        mean_seconds = sum(worker['seconds'] for worker in workers) / len(workers) if workers else 0.0
+        total['straggler_ratio'] = max(worker['seconds'] for worker in workers) / mean_seconds if mean_seconds > 0 else 1.0
+
+        with open(summary_file, 'w') as f:
+            json.dump({'workers': workers, 'total': total} if parameters is None else {'parameters': parameters, 'workers': workers, 'total': total}, f, indent=2)
+
+        return summary_file
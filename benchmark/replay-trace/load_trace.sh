@@ -12,9 +12,9 @@ if [[ -z "$SEARCH_DIR" || ! -d "$SEARCH_DIR" ]]; then
     exit 1
 fi
 
-# List all .sum files in the directory
+# List all .sum files in the directory, also zip, gzip and zstd compressed ones
 echo "Listing all .sum files in $SEARCH_DIR:"
-files=($(find "$SEARCH_DIR" -maxdepth 1 -type f -name '*.sum'))
+files=($(find "$SEARCH_DIR" -maxdepth 1 -type f \( -name '*.sum' -o -name '*.sum.zip' -o -name '*.sum.gz' -o -name '*.sum.zst' \)))
 if [[ ${#files[@]} -eq 0 ]]; then
     echo "No .sum files found in the directory."
     exit 1
@@ -46,8 +46,13 @@ echo "Selected file: $(basename "${files[$file_index]}")"
 echo "Copying the selected file to $DESTINATION..."
 echo " "
 
-# Copy the selected file to the destination
-cp "${files[$file_index]}" "$DESTINATION"
+# Copy the selected file to the destination, a compressed file is decompressed on the way
+case "${files[$file_index]}" in
+    *.zip) unzip -p "${files[$file_index]}" > "$DESTINATION" ;;
+    *.gz) gzip -dc "${files[$file_index]}" > "$DESTINATION" ;;
+    *.zst) zstd -dc "${files[$file_index]}" > "$DESTINATION" ;;
+    *) cp "${files[$file_index]}" "$DESTINATION" ;;
+esac
 
 # Confirmation message
 echo "Successfully copied $(basename "${files[$file_index]}") to $DESTINATION"